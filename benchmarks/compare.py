@@ -0,0 +1,48 @@
+import argparse
+import json
+import sys
+
+# numeric results that describe the run rather than its speed
+IGNORED = ('games', 'moves', 'errors', 'count', 'seconds')
+
+
+def flatten(results, prefix=''):
+    values = {}
+    for (key, value) in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in IGNORED:
+            values[name] = value
+    return values
+
+
+def compare(baseline, current, threshold):
+    # yields (metric, baseline, current, change, regressed); change is
+    # positive when current is worse
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    for name in sorted(set(old) & set(new)):
+        if not old[name]:
+            continue
+        change = (new[name] - old[name]) / old[name]
+        if 'per_second' in name:
+            change = -change
+        yield name, old[name], new[name], change, change > threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown, 0.1 is 10%%')
+    args = parser.parse_args()
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        rows = list(compare(json.load(baseline_file), json.load(current_file), args.threshold))
+    for (name, old, new, change, regressed) in rows:
+        print('%-40s %14.3f %14.3f %+8.1f%% %s' % (name, old, new, change * 100, 'REGRESSION' if regressed else ''))
+    sys.exit(1 if any(row[4] for row in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
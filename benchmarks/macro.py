@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.results import summarize_latencies, write_results
+from common.protocol import encode_message, read_message
+from server.server import MyTCPServer, MyTCPServerHandler
+
+
+def start_server(backend, workers=1):
+    # serves on a free localhost port from a background thread; more than
+    # one worker runs the threaded server in that many shard processes
+    if workers > 1:
+        from server.cluster import ShardedServer
+        cluster = ShardedServer(('127.0.0.1', 0), workers)
+        cluster.start_workers()
+        thread = threading.Thread(target=cluster.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            cluster.shutdown()
+            thread.join()
+            cluster.server_close()
+        return cluster.server_address, stop
+    if backend == 'asyncio':
+        from server.async_server import AsyncGameServer
+        server = AsyncGameServer('127.0.0.1', 0)
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        thread = threading.Thread(target=loop.run_forever)
+        thread.daemon = True
+        thread.start()
+
+        async def shutdown():
+            server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+        return server.server_address, stop
+    server = MyTCPServer(('127.0.0.1', 0), MyTCPServerHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    return server.server_address, stop
+
+
+def play_games(address, games, latencies):
+    # one simulated client: a single connection playing games back to back,
+    # always taking the first free cell
+    moves = 0
+    errors = 0
+    sock = socket.create_connection(address)
+    rfile = sock.makefile('rb')
+
+    def request(data):
+        started = time.perf_counter()
+        sock.sendall(encode_message(data))
+        result = read_message(rfile)
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    try:
+        for x in range(games):
+            result = request({'message': 'start'})
+            game_id = result['game_id']
+            result = request({'message': 'name', 'game_id': game_id, 'name': 'bench'})
+            marker = result['response']['marker']
+            while result and result['message'] not in ('gameover', 'error'):
+                area = result['response']['board'].index(None) + 1
+                result = request({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+                moves += 1
+            if result is None or result['message'] == 'error':
+                errors += 1
+    finally:
+        rfile.close()
+        sock.close()
+    return moves, errors
+
+
+def run(clients=20, games=20, backend='threading', workers=1):
+    (address, stop) = start_server(backend, workers)
+    latencies = []
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            outcomes = list(executor.map(lambda x: play_games(address, games, latencies), range(clients)))
+        elapsed = time.perf_counter() - started
+    finally:
+        stop()
+    moves = sum(moves for (moves, errors) in outcomes)
+    latency = summarize_latencies(latencies)
+    for key in ('p50', 'p95', 'p99', 'max'):
+        if latency[key] is not None:
+            latency[key] *= 1000
+    return {
+        'games': clients * games,
+        'moves': moves,
+        'errors': sum(errors for (moves, errors) in outcomes),
+        'seconds': elapsed,
+        'moves_per_second': moves / elapsed,
+        'requests_per_second': len(latencies) / elapsed,
+        'latency_ms': latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmark of the game server on localhost')
+    parser.add_argument('--clients', type=int, default=20, help='concurrent simulated clients')
+    parser.add_argument('--games', type=int, default=20, help='games played by every client')
+    parser.add_argument('--backend', choices=('threading', 'asyncio'), default='threading')
+    parser.add_argument('--workers', type=int, default=1, help='shard processes of the threaded server')
+    parser.add_argument('--output', default='-', help='JSON results file, - for stdout')
+    args = parser.parse_args()
+    if args.workers > 1 and args.backend != 'threading':
+        parser.error('--workers needs the threading backend')
+    parameters = {'clients': args.clients, 'games': args.games, 'backend': args.backend, 'workers': args.workers}
+    write_results(args.output, 'macro', parameters, run(args.clients, args.games, args.backend, args.workers))
+
+
+if __name__ == '__main__':
+    main()
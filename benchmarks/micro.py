@@ -0,0 +1,145 @@
+import argparse
+import json
+import random
+import io
+import timeit
+from benchmarks.results import write_results
+from common.protocol import BinaryCodec
+from server.matchmaking import Matchmaker
+from server.spectators import Spectators
+from server.server import Board, ComputerPlayer, Game
+
+
+def bench(function, repeat, number):
+    # best of repeat runs, in microseconds per call
+    timings = timeit.repeat(function, repeat=repeat, number=number)
+    return min(timings) / number * 1e6
+
+
+def mid_game_board(size=3, win_length=3, moves=4):
+    board = Board(size, win_length)
+    random.seed(size * 1000 + moves)
+    for (step, index) in enumerate(random.sample(range(board.cells), moves)):
+        board.put_marker_in_area(index, 'XO'[step % 2])
+    return board
+
+
+def bench_is_winner(repeat, number):
+    results = {}
+    for (size, win_length) in ((3, 3), (15, 5)):
+        board = mid_game_board(size, win_length, moves=6)
+        results['%sx%s' % (size, size)] = bench(lambda: board.is_winner('X'), repeat, number)
+    return results
+
+
+def bench_get_move(repeat, number):
+    results = {}
+    cases = (
+        ('bitboard', 3, 3),
+        ('deepcopy', 3, 3),
+        ('perfect', 3, 3),
+        ('search', 3, 3),
+        ('search', 15, 5),
+    )
+    ComputerPlayer.get_solver()
+    for (strategy, size, win_length) in cases:
+        board = mid_game_board(size, win_length, moves=4)
+        player = ComputerPlayer(name='Bot', marker='X', strategy=strategy)
+        method = getattr(player, ComputerPlayer.strategies[strategy])
+        calls = number if size == 3 else max(1, number // 100)
+        results['%s_%sx%s' % (strategy, size, size)] = bench(lambda: method(board), repeat, calls)
+    return results
+
+
+def play_game():
+    game = Game('bench')
+    game.register_player('bench')
+    marker = game.first_player.marker
+    while True:
+        area = game.board.get_free_indexes()[0] + 1
+        if game.turn(area, marker)['status'] == 'gameover':
+            return
+
+
+def bench_turn(repeat, number):
+    # a whole game of turns against the default computer player
+    return {'game_3x3': bench(play_game, repeat, max(1, number // 10))}
+
+
+def your_turn_response():
+    return {
+        'message': 'your_turn',
+        'game_id': 'aBcDeFgHiJkLmNoPqRsT',
+        'response': {'status': True, 'board': mid_game_board(moves=4).to_list()},
+    }
+
+
+def bench_json(repeat, number):
+    response = your_turn_response()
+    encoded = json.dumps(response)
+    return {
+        'encode': bench(lambda: json.dumps(response), repeat, number),
+        'decode': bench(lambda: json.loads(encoded), repeat, number),
+    }
+
+
+def bench_binary(repeat, number):
+    response = your_turn_response()
+    codec = BinaryCodec()
+    encoded = codec.encode(response)
+    return {
+        'encode': bench(lambda: codec.encode(response), repeat, number),
+        'decode': bench(lambda: codec.read(io.BytesIO(encoded)), repeat, number),
+    }
+
+
+def bench_matchmaking(repeat, number, waiting=10000):
+    # one queued player and one pairing per call, with a deep queue ahead
+    matchmaker = Matchmaker()
+    ids = iter(range(10 ** 9))
+    shape = (3, 3)
+    for x in range(waiting):
+        matchmaker.join(shape, next(ids), 'waiting', None)
+
+    def join_and_pair():
+        matchmaker.join(shape, next(ids), 'first', None)
+        matchmaker.join(shape, next(ids), 'second', None)
+    return {'join_and_pair_%s_waiting' % waiting: bench(join_and_pair, repeat, number)}
+
+
+def bench_fan_out(repeat, number, watchers=1000):
+    # one update encoded once and offered to every watcher of a game
+    spectators = Spectators(buffer=number * repeat + 1)
+    for x in range(watchers):
+        spectators.subscribe('game')
+    update = {'message': 'game_update', 'game_id': 'game', 'response': your_turn_response()['response']}
+    seqs = iter(range(10 ** 9))
+    return {'%s_watchers' % watchers: bench(lambda: spectators.fan_out('game', update, next(seqs), False),
+                                            repeat, number // 10 or 1)}
+
+
+def run(repeat=5, number=1000):
+    return {
+        'unit': 'usec_per_call',
+        'is_winner': bench_is_winner(repeat, number),
+        'get_move': bench_get_move(repeat, number),
+        'turn': bench_turn(repeat, number),
+        'json': bench_json(repeat, number),
+        'binary': bench_binary(repeat, number),
+        'matchmaking': bench_matchmaking(repeat, number),
+        'fan_out': bench_fan_out(repeat, number),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro benchmarks of the game engine')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=1000)
+    parser.add_argument('--output', default='-', help='JSON results file, - for stdout')
+    args = parser.parse_args()
+    write_results(args.output, 'micro', {'repeat': args.repeat, 'number': args.number},
+                  run(args.repeat, args.number))
+
+
+if __name__ == '__main__':
+    main()
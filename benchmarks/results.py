@@ -0,0 +1,42 @@
+import json
+import math
+import platform
+import sys
+import time
+
+
+def percentile(samples, fraction):
+    # nearest-rank percentile of an unsorted list
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = min(len(ordered), max(1, int(math.ceil(fraction * len(ordered)))))
+    return ordered[rank - 1]
+
+
+def summarize_latencies(samples):
+    return {
+        'count': len(samples),
+        'p50': percentile(samples, 0.50),
+        'p95': percentile(samples, 0.95),
+        'p99': percentile(samples, 0.99),
+        'max': max(samples) if samples else None,
+    }
+
+
+def write_results(path, kind, parameters, results):
+    document = {
+        'kind': kind,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+    if path == '-':
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(path, 'w') as results_file:
+            json.dump(document, results_file, indent=2, sort_keys=True)
+    return document
@@ -0,0 +1,60 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.results import summarize_latencies, write_results
+
+ENTRY_POINT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ticktacktoe.py')
+
+
+def time_server_start(backend, workers, log_file):
+    # wall clock ms from spawning the interpreter until the server is listening
+    command = [
+        sys.executable, ENTRY_POINT, '--log-file', log_file,
+        'server', '--port', '0', '--backend', backend, '--workers', str(workers),
+    ]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    try:
+        line = process.stdout.readline()
+        elapsed = (time.perf_counter() - started) * 1000
+        if not line.startswith(b'Server ready'):
+            raise RuntimeError('server did not start: %r' % line)
+        return elapsed
+    finally:
+        process.terminate()
+        process.wait()
+        process.stdout.close()
+
+
+def time_client_import():
+    # the client command must not pay for the server modules
+    command = [sys.executable, '-c', 'import client.client, sys; sys.exit("server.server" in sys.modules)']
+    started = time.perf_counter()
+    subprocess.run(command, check=True, cwd=os.path.dirname(ENTRY_POINT))
+    return (time.perf_counter() - started) * 1000
+
+
+def run(repeat=5):
+    results = {'unit': 'ms'}
+    with tempfile.TemporaryDirectory() as directory:
+        log_file = os.path.join(directory, 'startup.log')
+        for (backend, workers) in (('threading', 1), ('asyncio', 1), ('threading', 2)):
+            samples = [time_server_start(backend, workers, log_file) for x in range(repeat)]
+            results['server_%s_%s_workers_ms' % (backend, workers)] = summarize_latencies(samples)
+    results['client_import_ms'] = summarize_latencies([time_client_import() for x in range(repeat)])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the ticktacktoe commands')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='-', help='JSON results file, - for stdout')
+    args = parser.parse_args()
+    write_results(args.output, 'startup', {'repeat': args.repeat}, run(args.repeat))
+
+
+if __name__ == '__main__':
+    main()
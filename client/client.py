@@ -1,50 +1,210 @@
+import itertools
+import queue
 import socket
-import json
 import logging
+import threading
+import time
 from sys import exit
+from common.protocol import BinaryCodec, JsonCodec, encode_message, read_message
 
-logging.basicConfig(
-    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-    datefmt='%m/%d/%Y %I:%M:%S %p',
-    filename='logs.log',
-    level=logging.DEBUG
-)
 logger_ClientConnection = logging.getLogger('ClientConnection')
 logger_ClientGame = logging.getLogger('ClientGame')
 
 class Connection(object):
-    def __init__(self, IP, PORT):
+    def __init__(self, IP, PORT, exit_on_error=True):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((IP, PORT))
+            self.rfile = self.socket.makefile('rb')
+            self.codec = JsonCodec()
         except Exception as e:
-            print('Cannot connect to server. Try again.')
             logger_ClientConnection.exception(e)
+            if not exit_on_error:
+                self.socket.close()
+                raise
+            print('Cannot connect to server. Try again.')
             exit()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.rfile.close()
         self.socket.close()
 
     def send_message(self, data):
         # print(data)
         try:
-            self.socket.send(bytes(json.dumps(data), 'UTF-8'))
-            logger_ClientConnection.info('Client sent %s message' % data.get('message'))
+            self.socket.sendall(self.codec.encode(data))
+            logger_ClientConnection.info('Client sent %s message', data.get('message'))
         except Exception as e:
             logger_ClientConnection.exception(e)
 
     def retrieve_message(self):
         try:
-            result = json.loads(self.socket.recv(1024).decode('UTF-8'))
-            logger_ClientConnection.info('Client received %s message' % result.get('message'))
+            result = self.codec.read(self.rfile)
+            if result is None:
+                logger_ClientConnection.info('Server closed the connection')
+                return None
+            if result.get('encoding') == BinaryCodec.name and isinstance(self.codec, JsonCodec):
+                # the server accepted the binary encoding for what follows
+                self.codec = BinaryCodec()
+                self.codec.register(result['game_id'], result['session'])
+            logger_ClientConnection.info('Client received %s message', result.get('message'))
             return result
         except Exception as e:
             logger_ClientConnection.exception(e)
             return None
 
+class MultiplexedConnection(object):
+    # One connection carrying the requests of many sessions at once. Every
+    # request gets a request_id, a reader thread hands each reply to the
+    # channel that sent the request, so replies may arrive in any order.
+    # Pushed messages go to the channel that last sent a request for their
+    # game, or to on_message when there is none.
+    def __init__(self, IP, PORT, on_message=None):
+        self.socket = socket.create_connection((IP, PORT))
+        self.rfile = self.socket.makefile('rb')
+        self.on_message = on_message
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        # game_id -> replies of the channel playing it
+        self.games = {}
+        # guards pending and games, the reader needs it for every reply
+        self.lock = threading.Lock()
+        # held while writing, so a slow write never keeps the reader waiting
+        self.send_lock = threading.Lock()
+        self.closed = False
+        self.reader = threading.Thread(target=self.read_replies, name='MultiplexedConnection')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def channel(self):
+        return Channel(self)
+
+    def send(self, data, replies):
+        # sends data tagged with a new request_id, its reply goes to replies
+        request_id = next(self.request_ids)
+        data = dict(data, request_id=request_id)
+        with self.lock:
+            if self.closed:
+                replies.put(None)
+                return request_id
+            # registered first, the reply may come before sendall returns
+            self.pending[request_id] = replies
+            if 'game_id' in data:
+                self.games[data['game_id']] = replies
+        try:
+            with self.send_lock:
+                self.socket.sendall(encode_message(data))
+        except OSError as e:
+            logger_ClientConnection.exception(e)
+            with self.lock:
+                replies = self.pending.pop(request_id, None)
+            # unless the reader already woke it up on closing
+            if replies is not None:
+                replies.put(None)
+            return request_id
+        logger_ClientConnection.info('Client sent %s message', data.get('message'))
+        return request_id
+
+    def read_replies(self):
+        while True:
+            try:
+                result = read_message(self.rfile)
+            except Exception as e:
+                logger_ClientConnection.exception(e)
+                result = None
+            if result is None:
+                break
+            logger_ClientConnection.info('Client received %s message', result.get('message'))
+            with self.lock:
+                replies = self.pending.pop(result.pop('request_id', None), None)
+                if replies is None:
+                    replies = self.games.get(result.get('game_id'))
+                if result.get('message') == 'gameover':
+                    self.games.pop(result.get('game_id'), None)
+            if replies is not None:
+                replies.put(result)
+            elif self.on_message is not None:
+                self.on_message(result)
+        # wake up everyone still waiting for a reply
+        with self.lock:
+            self.closed = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for replies in pending:
+            replies.put(None)
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.reader.join()
+        self.rfile.close()
+        self.socket.close()
+
+
+class Channel(object):
+    # One session's view of a MultiplexedConnection, with the interface of
+    # Connection: retrieve_message returns the replies to this channel's
+    # requests in the order they arrive.
+    def __init__(self, connection):
+        self.connection = connection
+        self.replies = queue.Queue()
+
+    def send_message(self, data):
+        self.connection.send(data, self.replies)
+
+    def retrieve_message(self):
+        return self.replies.get()
+
+    def close(self):
+        # the shared connection stays open for the other channels
+        pass
+
+class BoardState(object):
+    # Local copy of the board. Full boards replace it, delta updates are
+    # applied on top of it when they start at the move the copy is at.
+    def __init__(self):
+        self.board = None
+        self.seq = None
+
+    def apply(self, response):
+        # returns False when moves are missing and the board needs a resync
+        if 'board' in response:
+            self.board = list(response['board'])
+            self.seq = response.get('seq')
+            return True
+        if self.board is None or response.get('since') != self.seq:
+            return False
+        for (index, marker) in response['changes']:
+            self.board[index] = marker
+        self.seq = response['seq']
+        return True
+
+    def turn_message(self, game_id, area, marker):
+        data = {
+            'message': 'turn',
+            'game_id': game_id,
+            'area': area,
+            'marker': marker,
+        }
+        if self.seq is not None:
+            # acknowledges the board the move was made on
+            data['seq'] = self.seq
+        return data
+
 class Interface(object):
     board_form = '''
         | %s | %s | %s |
@@ -58,53 +218,113 @@ class Interface(object):
         print('Welcome to Tic Tac Toe game.')
 
     def display_board(self, board):
+        print(self.render_board(board))
+
+    def render_board(self, board):
         board = [' ' if x is None else x for x in board]
-        print(Interface.board_form % tuple(board))
+        if len(board) == 9:
+            return Interface.board_form % tuple(board)
+        size = int(len(board) ** 0.5)
+        rows = []
+        for row in range(size):
+            rows.append('| %s |' % ' | '.join(board[row * size:(row + 1) * size]))
+        separator = '\n        %s\n        ' % ('-' * (size * 4 + 1))
+        return '\n        %s\n        ' % separator.join(rows)
 
 class Client(object):
-    def __init__(self, server, port):
+    def __init__(self, server, port, size=3, win_length=3, difficulty=None, encoding=None, updates=None,
+                 opponent=None):
         self.interface = Interface()
         self.interface.say_hello()
         self.server = server
         self.port = port
+        self.size = size
+        self.win_length = win_length
+        self.difficulty = difficulty
+        self.encoding = encoding
+        self.updates = updates
+        self.opponent = opponent
 
     def run(self):
+        # the whole game session uses a single connection
         with Connection(self.server, self.port) as connection:
-            print('Calling server')
+            self.play(connection)
+
+    def play(self, connection):
+        print('Calling server')
+        data = {
+            'message': 'start',
+            'size': self.size,
+            'win_length': self.win_length,
+        }
+        if self.difficulty:
+            data['difficulty'] = self.difficulty
+        if self.encoding:
+            data['encoding'] = self.encoding
+        if self.updates:
+            data['updates'] = self.updates
+        if self.opponent:
+            data['opponent'] = self.opponent
+        connection.send_message(data)
+        result = connection.retrieve_message()
+
+        if result and result['message'] == 'busy':
+            print('Server is busy. Try again later.')
+            return
+        if result and result['message'] == 'ok_give_name':
+            game_id = result['game_id']
+            name = input('Type your name: ')
             data = {
-                'message': 'start',
+                'message': 'name',
+                'game_id': game_id,
+                'name': name,
             }
             connection.send_message(data)
             result = connection.retrieve_message()
+        else:
+            print('Server problem occurred. Try again.')
+            return
 
-        with Connection(self.server, self.port) as connection:
-            if result['message'] == 'ok_give_name':
-                game_id = result['game_id']
-                name = input('Type your name: ')
-                data = {
-                    'message': 'name',
-                    'game_id': game_id,
-                    'name': name,
-                }
-                connection.send_message(data)
-                result = connection.retrieve_message()
-            else:
-                print('Server problem occurred. Try again.')
+        if result and result['message'] == 'waiting':
+            # the server pushes ok_start_game once an opponent joins
+            print('Waiting for an opponent')
+            result = connection.retrieve_message()
 
-            if result['message'] == 'ok_start_game':
-                response = result['response']
-                text = response['text']
-                marker = response['marker']
-                print(text)
-            else:
-                print('Server problem occurred. Try again.')
+        if result and result['message'] == 'ok_start_game':
+            response = result['response']
+            text = response['text']
+            marker = response['marker']
+            print(text)
+            state = BoardState()
+            if response.get('your_move') is False:
+                self.interface.display_board(response['board'])
+                print('Waiting for the opponent to move')
+                result = connection.retrieve_message()
+        else:
+            print('Server problem occurred. Try again.')
+            return
 
         while True:
+            if result is None:
+                print('Server problem occurred. Try again.')
+                return
             response_game_id = result.get('game_id')
-            if result and response_game_id != game_id:
+            if response_game_id != game_id:
+                result = connection.retrieve_message()
                 continue
             response = result['response']
 
+            if result['message'] == 'busy':
+                # over the turn rate, the same move is sent again a bit later
+                time.sleep(response.get('retry_after', 1))
+                connection.send_message(turn)
+                result = connection.retrieve_message()
+                continue
+
+            if result['message'] == 'error':
+                print('Server problem occurred. Try again.')
+                return
+
             if result['message'] == 'gameover':
                 board = response['board']
                 reason = response.get('reason')
@@ -113,32 +333,38 @@ class Client(object):
                     print('You WIN!')
                 elif reason == 'lose':
                     print('You LOSE!')
+                elif reason == 'abandoned':
+                    print('Your opponent left.')
                 if reason == 'draw':
                     print('DRAW!')
                 print('Game over.')
                 break
 
+            if result['message'] == 'opponent_turn':
+                self.interface.display_board(response['board'])
+                print('Waiting for the opponent to move')
+                result = connection.retrieve_message()
+                continue
+
+            if not state.apply(response):
+                connection.send_message({'message': 'sync', 'game_id': game_id})
+                result = connection.retrieve_message()
+                continue
+            board = state.board
             status = response['status']
             if status:
-                board = response['board']
                 self.interface.display_board(board)
                 try:
-                    area = int(input('Now your move. Type the empty area where you want to place %s (1-9): ' % marker))
+                    area = int(input('Now your move. Type the empty area where you want to place %s (1-%s): ' % (marker, len(board))))
                 except Exception as e:
                     logger_ClientGame.exception(e)
                     area = -1
             else:
                 try:
-                    area = int(input('Wrong choice!, Try again (1-9): '))
+                    area = int(input('Wrong choice!, Try again (1-%s): ' % len(board)))
                 except Exception as e:
                     logger_ClientGame.exception(e)
                     area = -1
-            data = {
-                'message': 'turn',
-                'game_id': game_id,
-                'area': area,
-                'marker': marker,
-            }
-            with Connection(self.server, self.port) as connection:
-                connection.send_message(data)
-                result = connection.retrieve_message()
\ No newline at end of file
+            turn = state.turn_message(game_id, area, marker)
+            connection.send_message(turn)
+            result = connection.retrieve_message()
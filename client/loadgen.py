@@ -0,0 +1,235 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from client.client import BoardState, Connection, MultiplexedConnection
+
+
+class ServerBusy(IOError):
+    # the server answered busy, over one of its admission limits
+    pass
+
+
+class RandomMovePicker(object):
+    def pick(self, board, marker, win_length):
+        return random.choice([index for (index, value) in enumerate(board) if value is None])
+
+
+class ComputerMovePicker(object):
+    # Plays with the server's own ComputerPlayer logic
+    def __init__(self, strategy='bitboard'):
+        from server.server import Board, ComputerPlayer
+        self.board_class = Board
+        self.player_class = ComputerPlayer
+        self.strategy = strategy
+
+    def pick(self, board, marker, win_length):
+        board_obj = self.board_class(int(round(len(board) ** 0.5)), win_length)
+        board_obj.board[:] = board
+        player = self.player_class(name='LoadBot', marker=marker, strategy=self.strategy)
+        return getattr(player, self.player_class.strategies[self.strategy])(board_obj)
+
+
+class HeadlessClient(object):
+    # Plays whole games over an open Connection without any user input
+    def __init__(self, picker, size=3, win_length=3, difficulty=None, name='LoadBot', encoding=None, updates=None):
+        self.picker = picker
+        self.size = size
+        self.win_length = win_length
+        self.difficulty = difficulty
+        self.encoding = encoding
+        self.updates = updates
+        self.name = name
+
+    def request(self, connection, data):
+        connection.send_message(data)
+        result = connection.retrieve_message()
+        if result is None:
+            raise IOError('no response to %s message' % data.get('message'))
+        if result['message'] == 'busy':
+            raise ServerBusy(result['response'].get('reason'))
+        if result['message'] == 'error':
+            raise IOError('%s message failed: %s' % (data.get('message'), result['response'].get('reason')))
+        return result
+
+    def play_game(self, connection):
+        # returns the outcome ('win', 'lose' or 'draw') and the number of moves
+        data = {'message': 'start', 'size': self.size, 'win_length': self.win_length}
+        if self.difficulty:
+            data['difficulty'] = self.difficulty
+        if self.encoding:
+            data['encoding'] = self.encoding
+        if self.updates:
+            data['updates'] = self.updates
+        result = self.request(connection, data)
+        game_id = result['game_id']
+        result = self.request(connection, {'message': 'name', 'game_id': game_id, 'name': self.name})
+        marker = result['response']['marker']
+        state = BoardState()
+        moves = 0
+        while result['message'] != 'gameover':
+            response = result['response']
+            if not response['status']:
+                raise ValueError('server rejected the move')
+            if not state.apply(response):
+                result = self.request(connection, {'message': 'sync', 'game_id': game_id})
+                continue
+            area = self.picker.pick(state.board, marker, self.win_length) + 1
+            result = self.request(connection, state.turn_message(game_id, area, marker))
+            moves += 1
+        return result['response'].get('reason'), moves
+
+
+class LoadGenerator(object):
+    # Runs many headless sessions in a thread pool, each keeping one
+    # connection and playing games back to back until the game count or the
+    # duration is reached. rate caps the number of games started per second.
+    # With connections set, the sessions share that many multiplexed
+    # connections instead, like a gateway with a connection pool.
+    def __init__(self, server, port, client, sessions=10, games=100, duration=None, rate=None, connections=None):
+        self.server = server
+        self.port = port
+        self.client = client
+        self.sessions = sessions
+        self.games = games
+        self.duration = duration
+        self.rate = rate
+        if connections and client.encoding == 'binary':
+            raise ValueError('multiplexed connections only speak JSON')
+        self.connections = connections
+        self.shared = []
+        self.lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.errors = 0
+        # games refused by the server's admission control, part of errors
+        self.busy = Counter()
+        self.moves = 0
+        self.outcomes = Counter()
+        self.game_seconds = []
+        self.deadline = None
+        self.next_start = None
+
+    def claim_game(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.games is not None and self.started >= self.games:
+                return False
+            if self.deadline is not None and now >= self.deadline:
+                return False
+            self.started += 1
+            if not self.rate:
+                return True
+            start = max(now, self.next_start or now)
+            self.next_start = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+        return True
+
+    def record(self, outcome, moves, seconds):
+        with self.lock:
+            self.completed += 1
+            self.moves += moves
+            self.outcomes[outcome] += 1
+            self.game_seconds.append(seconds)
+
+    def record_error(self, busy=None):
+        with self.lock:
+            self.errors += 1
+            if busy is not None:
+                self.busy[busy] += 1
+
+    def connect(self, session):
+        if self.shared:
+            return self.shared[session % len(self.shared)].channel()
+        return Connection(self.server, self.port, exit_on_error=False)
+
+    def run_session(self, session=0):
+        connection = None
+        try:
+            while self.claim_game():
+                try:
+                    if connection is None:
+                        connection = self.connect(session)
+                    started = time.perf_counter()
+                    (outcome, moves) = self.client.play_game(connection)
+                    self.record(outcome, moves, time.perf_counter() - started)
+                except Exception as e:
+                    self.record_error(str(e) if isinstance(e, ServerBusy) else None)
+                    # start over on a fresh connection
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def run(self):
+        started = time.monotonic()
+        if self.duration:
+            self.deadline = started + self.duration
+        if self.connections:
+            self.shared = [MultiplexedConnection(self.server, self.port) for x in range(self.connections)]
+        try:
+            with ThreadPoolExecutor(max_workers=self.sessions) as executor:
+                for session in range(self.sessions):
+                    executor.submit(self.run_session, session)
+        finally:
+            for connection in self.shared:
+                connection.close()
+        return self.report(time.monotonic() - started)
+
+    def report(self, elapsed):
+        attempted = self.completed + self.errors
+        seconds = sorted(self.game_seconds)
+        return {
+            'sessions': self.sessions,
+            'connections': self.connections or self.sessions,
+            'seconds': elapsed,
+            'games': self.completed,
+            'errors': self.errors,
+            'busy': dict(self.busy),
+            'error_rate': self.errors / attempted if attempted else 0.0,
+            'games_per_second': self.completed / elapsed if elapsed else 0.0,
+            'moves_per_second': self.moves / elapsed if elapsed else 0.0,
+            'outcomes': dict(self.outcomes),
+            'game_ms': {
+                'p50': seconds[len(seconds) // 2] * 1000 if seconds else None,
+                'p99': seconds[int(len(seconds) * 0.99)] * 1000 if seconds else None,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless load generator for the game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=13373)
+    parser.add_argument('--sessions', type=int, default=100, help='concurrent sessions')
+    parser.add_argument('--games', type=int, default=1000, help='stop after this many games, 0 for no limit')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--rate', type=float, help='target games started per second')
+    parser.add_argument('--picker', choices=('random', 'computer'), default='random')
+    parser.add_argument('--strategy', default='bitboard', help='ComputerPlayer strategy of the computer picker')
+    parser.add_argument('--size', type=int, default=3)
+    parser.add_argument('--win-length', type=int, default=3)
+    parser.add_argument('--difficulty')
+    parser.add_argument('--encoding', choices=('json', 'binary'), default='json')
+    parser.add_argument('--updates', choices=('full', 'delta'), default='full')
+    parser.add_argument('--connections', type=int, help='share this many multiplexed connections between sessions')
+    args = parser.parse_args()
+    picker = RandomMovePicker() if args.picker == 'random' else ComputerMovePicker(args.strategy)
+    client = HeadlessClient(picker, args.size, args.win_length, args.difficulty, encoding=args.encoding,
+                            updates=args.updates)
+    generator = LoadGenerator(
+        args.host, args.port, client,
+        sessions=args.sessions, games=args.games or None, duration=args.duration, rate=args.rate,
+        connections=args.connections,
+    )
+    print(json.dumps(generator.run(), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+LOG_FORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+# loggers writing one line per protocol message
+MESSAGE_LOGGERS = ('ServerConnection', 'AsyncServerConnection', 'ClientConnection')
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # Hands the record over untouched; formatting happens on the writer
+    # thread instead of the thread that logged it.
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    # Lets through only a fraction of the records below WARNING
+    def __init__(self, rate):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+def setup_logging(filename='logs.log', level=logging.DEBUG, message_level=None, sample_rate=1.0):
+    # Log records go through a queue to a background writer thread, so threads
+    # handling messages never wait on the log file. Returns the started
+    # QueueListener, which is also stopped at exit. Calling it again replaces
+    # the earlier setup; a forked process has to, as the listener thread of
+    # its parent does not run in it.
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        if isinstance(handler, DeferredQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    for name in MESSAGE_LOGGERS:
+        logger = logging.getLogger(name)
+        for sampling in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(sampling)
+        if message_level is not None:
+            logger.setLevel(message_level)
+        if sample_rate < 1:
+            logger.addFilter(SamplingFilter(sample_rate))
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,273 @@
+import json
+import struct
+import threading
+
+# Messages are newline delimited JSON documents. json.dumps never emits a raw
+# newline, so a line is always exactly one message.
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+def encode_message(data):
+    return bytes(json.dumps(data) + '\n', 'UTF-8')
+
+
+def read_line(rfile):
+    # returns b'' once the peer has closed the connection
+    line = rfile.readline(MAX_MESSAGE_SIZE + 1)
+    if line and not line.endswith(b'\n'):
+        if len(line) > MAX_MESSAGE_SIZE:
+            raise ValueError('message exceeds %s bytes' % MAX_MESSAGE_SIZE)
+        raise ValueError('connection closed in the middle of a message')
+    return line
+
+
+def read_message(rfile):
+    # returns None once the peer has closed the connection
+    line = read_line(rfile)
+    if not line:
+        return None
+    return json.loads(line.decode('UTF-8'))
+
+
+class JsonCodec(object):
+    # codecs remember the size of the last message they read in last_size
+    name = 'json'
+
+    def __init__(self):
+        self.last_size = 0
+
+    def encode(self, data):
+        return encode_message(data)
+
+    def read(self, rfile):
+        line = read_line(rfile)
+        self.last_size = len(line)
+        if not line:
+            return None
+        return json.loads(line.decode('UTF-8'))
+
+
+class BinaryCodec(object):
+    # Compact encoding negotiated with 'encoding': 'binary' on a start
+    # message. Every frame is a one byte opcode and a two byte payload length.
+    # Boards travel as the board size followed by one bit mask per marker,
+    # and games are named by small per connection session handles instead of
+    # their game_id. Messages without an opcode of their own are sent as JSON
+    # inside an OP_JSON frame.
+    name = 'binary'
+    header = struct.Struct('!BH')
+    session = struct.Struct('!I')
+    turn = struct.Struct('!HB')
+    # seq, since and number of changes of a delta update, then one change per move
+    delta = struct.Struct('!HHH')
+    change = struct.Struct('!HB')
+    OP_START = 0x01
+    OP_NAME = 0x02
+    OP_TURN = 0x03
+    OP_OK_GIVE_NAME = 0x81
+    OP_OK_START_GAME = 0x82
+    OP_YOUR_TURN = 0x83
+    OP_GAMEOVER = 0x84
+    OP_YOUR_TURN_DELTA = 0x85
+    OP_JSON = 0xFF
+    markers = (None, 'X', 'O')
+    reasons = (None, 'win', 'lose', 'draw')
+    difficulties = (None, 'normal', 'perfect', 'search')
+
+    def __init__(self):
+        self.last_size = 0
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.game_ids = {}
+        self.next_handle = 1
+
+    def register(self, game_id, handle=None):
+        # returns the session handle of game_id, allocating one when needed;
+        # the reader and the senders of a multiplexed connection share it
+        with self.lock:
+            if game_id in self.handles:
+                return self.handles[game_id]
+            if handle is None:
+                handle = self.next_handle
+                self.next_handle += 1
+            self.handles[game_id] = handle
+            self.game_ids[handle] = game_id
+            return handle
+
+    def game_id(self, handle):
+        # games first seen in binary form are known by their handle only
+        if handle not in self.game_ids:
+            self.register(handle, handle)
+        return self.game_ids[handle]
+
+    @staticmethod
+    def encode_board(board):
+        size = int(round(len(board) ** 0.5))
+        width = (len(board) + 7) // 8
+        masks = [0, 0]
+        for (index, value) in enumerate(board):
+            if value:
+                masks[BinaryCodec.markers.index(value) - 1] |= 1 << index
+        return bytes([size]) + masks[0].to_bytes(width, 'little') + masks[1].to_bytes(width, 'little')
+
+    @staticmethod
+    def decode_board(payload, offset):
+        # returns the board list and the offset just past it
+        size = payload[offset]
+        cells = size * size
+        width = (cells + 7) // 8
+        offset += 1
+        masks = []
+        for x in range(2):
+            masks.append(int.from_bytes(payload[offset:offset + width], 'little'))
+            offset += width
+        board = [None] * cells
+        for index in range(cells):
+            if masks[0] >> index & 1:
+                board[index] = 'X'
+            elif masks[1] >> index & 1:
+                board[index] = 'O'
+        return board, offset
+
+    def frame(self, opcode, payload):
+        if len(payload) > 0xFFFF:
+            raise ValueError('frame payload exceeds 65535 bytes')
+        return BinaryCodec.header.pack(opcode, len(payload)) + payload
+
+    def encode(self, data):
+        message = data.get('message')
+        response = data.get('response') or {}
+        if message == 'start' and set(data) <= {'message', 'size', 'win_length', 'difficulty', 'encoding'} \
+                and data.get('difficulty') in BinaryCodec.difficulties \
+                and all(isinstance(data.get(key, 3), int) and 0 <= data.get(key, 3) <= 0xFF
+                        for key in ('size', 'win_length')):
+            difficulty = BinaryCodec.difficulties.index(data.get('difficulty'))
+            payload = bytes([data.get('size', 3), data.get('win_length', 3), difficulty])
+            return self.frame(BinaryCodec.OP_START, payload)
+        if 'game_id' not in data:
+            return self.frame(BinaryCodec.OP_JSON, encode_message(data)[:-1])
+        handle = self.register(data['game_id'])
+        session = BinaryCodec.session.pack(handle)
+        if message == 'name' and set(data) == {'message', 'game_id', 'name'}:
+            return self.frame(BinaryCodec.OP_NAME, session + data['name'].encode('UTF-8'))
+        if message == 'turn' and set(data) - {'seq'} == {'message', 'game_id', 'area', 'marker'} \
+                and isinstance(data['area'], int) and 0 <= data['area'] <= 0xFFFF and data['marker'] in ('X', 'O') \
+                and isinstance(data.get('seq', 0), int) and 0 <= data.get('seq', 0) <= 0xFFFF:
+            payload = session + BinaryCodec.turn.pack(data['area'], BinaryCodec.markers.index(data['marker']))
+            if 'seq' in data:
+                payload += struct.pack('!H', data['seq'])
+            return self.frame(BinaryCodec.OP_TURN, payload)
+        if message == 'ok_give_name' and set(data) == {'message', 'game_id'}:
+            return self.frame(BinaryCodec.OP_OK_GIVE_NAME, session)
+        if message == 'ok_start_game' and set(response) == {'text', 'marker', 'board', 'size', 'win_length', 'status'}:
+            payload = (session + bytes([BinaryCodec.markers.index(response['marker']), response['win_length']]) +
+                       self.encode_board(response['board']) + response['text'].encode('UTF-8'))
+            return self.frame(BinaryCodec.OP_OK_START_GAME, payload)
+        if message == 'your_turn' and set(response) == {'status', 'board'}:
+            payload = session + bytes([1 if response['status'] else 0]) + self.encode_board(response['board'])
+            return self.frame(BinaryCodec.OP_YOUR_TURN, payload)
+        if message == 'your_turn' and set(response) == {'status', 'seq', 'since', 'changes'}:
+            changes = b''.join(
+                BinaryCodec.change.pack(index, BinaryCodec.markers.index(marker))
+                for (index, marker) in response['changes']
+            )
+            payload = (session + bytes([1 if response['status'] else 0]) +
+                       BinaryCodec.delta.pack(response['seq'], response['since'], len(response['changes'])) + changes)
+            return self.frame(BinaryCodec.OP_YOUR_TURN_DELTA, payload)
+        if message == 'gameover' and set(response) == {'status', 'reason', 'board'} \
+                and response['reason'] in BinaryCodec.reasons:
+            payload = session + bytes([BinaryCodec.reasons.index(response['reason'])]) + \
+                self.encode_board(response['board'])
+            return self.frame(BinaryCodec.OP_GAMEOVER, payload)
+        # the game still travels as its handle inside JSON frames
+        data = dict(data, game_id=handle)
+        return self.frame(BinaryCodec.OP_JSON, encode_message(data)[:-1])
+
+    def read(self, rfile):
+        header = rfile.read(BinaryCodec.header.size)
+        self.last_size = len(header)
+        if not header:
+            return None
+        if len(header) < BinaryCodec.header.size:
+            raise ValueError('connection closed in the middle of a message')
+        (opcode, length) = BinaryCodec.header.unpack(header)
+        payload = rfile.read(length)
+        if len(payload) < length:
+            raise ValueError('connection closed in the middle of a message')
+        self.last_size = BinaryCodec.header.size + length
+        return self.decode(opcode, payload)
+
+    def decode(self, opcode, payload):
+        if opcode == BinaryCodec.OP_JSON:
+            data = json.loads(payload.decode('UTF-8'))
+            if isinstance(data.get('game_id'), int):
+                data['game_id'] = self.game_id(data['game_id'])
+            return data
+        if opcode == BinaryCodec.OP_START:
+            data = {'message': 'start', 'size': payload[0], 'win_length': payload[1]}
+            if payload[2]:
+                data['difficulty'] = BinaryCodec.difficulties[payload[2]]
+            return data
+        (handle,) = BinaryCodec.session.unpack_from(payload)
+        game_id = self.game_id(handle)
+        offset = BinaryCodec.session.size
+        if opcode == BinaryCodec.OP_NAME:
+            return {'message': 'name', 'game_id': game_id, 'name': payload[offset:].decode('UTF-8')}
+        if opcode == BinaryCodec.OP_TURN:
+            (area, marker) = BinaryCodec.turn.unpack_from(payload, offset)
+            data = {'message': 'turn', 'game_id': game_id, 'area': area, 'marker': BinaryCodec.markers[marker]}
+            offset += BinaryCodec.turn.size
+            if len(payload) > offset:
+                (data['seq'],) = struct.unpack_from('!H', payload, offset)
+            return data
+        if opcode == BinaryCodec.OP_OK_GIVE_NAME:
+            return {'message': 'ok_give_name', 'game_id': game_id}
+        if opcode == BinaryCodec.OP_OK_START_GAME:
+            marker = BinaryCodec.markers[payload[offset]]
+            win_length = payload[offset + 1]
+            (board, offset) = self.decode_board(payload, offset + 2)
+            response = {
+                'text': payload[offset:].decode('UTF-8'),
+                'marker': marker,
+                'board': board,
+                'size': int(round(len(board) ** 0.5)),
+                'win_length': win_length,
+                'status': True,
+            }
+            return {'message': 'ok_start_game', 'game_id': game_id, 'response': response}
+        if opcode == BinaryCodec.OP_YOUR_TURN:
+            (board, offset) = self.decode_board(payload, offset + 1)
+            response = {'status': bool(payload[BinaryCodec.session.size]), 'board': board}
+            return {'message': 'your_turn', 'game_id': game_id, 'response': response}
+        if opcode == BinaryCodec.OP_YOUR_TURN_DELTA:
+            (seq, since, count) = BinaryCodec.delta.unpack_from(payload, offset + 1)
+            offset += 1 + BinaryCodec.delta.size
+            changes = []
+            for x in range(count):
+                (index, marker) = BinaryCodec.change.unpack_from(payload, offset)
+                changes.append([index, BinaryCodec.markers[marker]])
+                offset += BinaryCodec.change.size
+            response = {'status': bool(payload[BinaryCodec.session.size]), 'seq': seq, 'since': since,
+                        'changes': changes}
+            return {'message': 'your_turn', 'game_id': game_id, 'response': response}
+        if opcode == BinaryCodec.OP_GAMEOVER:
+            (board, offset) = self.decode_board(payload, offset + 1)
+            reason = BinaryCodec.reasons[payload[BinaryCodec.session.size]]
+            response = {'status': 'gameover', 'reason': reason, 'board': board}
+            return {'message': 'gameover', 'game_id': game_id, 'response': response}
+        raise ValueError('unknown opcode %s' % opcode)
+
+
+def negotiate(request, response, codec):
+    # Called with every request and its response on a connection. Returns the
+    # codec for the messages after this response; a start asking for the
+    # binary encoding switches the connection once the JSON reply, carrying
+    # the session handle, has been sent.
+    if request.get('encoding') != BinaryCodec.name or not isinstance(codec, JsonCodec):
+        return codec
+    if response is None or response.get('message') != 'ok_give_name':
+        return codec
+    binary = BinaryCodec()
+    response['encoding'] = BinaryCodec.name
+    response['session'] = binary.register(response['game_id'])
+    return binary
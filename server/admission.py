@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import threading
+import time
+from server import metrics
+
+
+class RateLimiter(object):
+    # Token buckets per client address: a bucket holds up to burst tokens,
+    # refills at rate tokens a second and every message takes one. Buckets
+    # are kept in least recently used order and the oldest is forgotten past
+    # max_clients, so memory stays bounded however many addresses show up.
+
+    def __init__(self, rate, burst=None, max_clients=100000, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError('rate should be positive')
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate)
+        self.max_clients = max_clients
+        self.clock = clock
+        # address -> [tokens, time of the last refill]
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, address):
+        # 0 when a token was taken, otherwise the seconds until there is one
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get(address)
+            if bucket is None:
+                bucket = self.buckets[address] = [self.burst, now]
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(address)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+
+class AdmissionControl(object):
+    # Limits of one server process, each off when None: concurrent
+    # connections, requests waiting for the worker pool, and start and turn
+    # messages per client address. Over a limit the server answers busy
+    # straight away instead of slowing down for everyone.
+
+    def __init__(self, max_connections=None, max_queue=None, start_rate=None, start_burst=None,
+                 turn_rate=None, turn_burst=None, clock=time.monotonic):
+        self.max_connections = max_connections
+        self.max_queue = max_queue
+        self.connections = 0
+        self.queued = 0
+        self.lock = threading.Lock()
+        # message -> RateLimiter
+        self.limiters = {}
+        if start_rate:
+            self.limiters['start'] = RateLimiter(start_rate, start_burst, clock=clock)
+        if turn_rate:
+            self.limiters['turn'] = RateLimiter(turn_rate, turn_burst, clock=clock)
+
+    def connect(self):
+        # counts a new connection, False when it is over the cap
+        with self.lock:
+            if self.max_connections is not None and self.connections >= self.max_connections:
+                return False
+            self.connections += 1
+            return True
+
+    def disconnect(self):
+        with self.lock:
+            self.connections -= 1
+
+    def enqueue(self):
+        # counts a request handed to the worker pool, False when the queue is full
+        with self.lock:
+            if self.max_queue is not None and self.queued >= self.max_queue:
+                return False
+            self.queued += 1
+        metrics.pool_queued.inc()
+        return True
+
+    def dequeue(self):
+        with self.lock:
+            self.queued -= 1
+        metrics.pool_queued.dec()
+
+    def check(self, address, data):
+        # the busy reply for a message over its client's rate, otherwise None
+        message = data.get('message')
+        limiter = self.limiters.get(message)
+        if limiter is None:
+            return None
+        retry_after = limiter.take(address)
+        if not retry_after:
+            return None
+        return self.busy('%s_rate' % message, data, retry_after)
+
+    def busy(self, reason, data=None, retry_after=None):
+        metrics.rejections.labels(reason).inc()
+        response = {
+            'message': 'busy',
+            'response': {
+                'status': False,
+                'reason': reason,
+            },
+        }
+        if retry_after:
+            response['response']['retry_after'] = round(retry_after, 3)
+        for key in ('game_id', 'request_id'):
+            if data and key in data:
+                response[key] = data[key]
+        return response
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from common.protocol import MAX_MESSAGE_SIZE, encode_message
+from server import metrics
+from server.admission import AdmissionControl
+from server.server import GameService
+
+logger_AsyncServerConnection = logging.getLogger('AsyncServerConnection')
+
+
+class AsyncGameServer(object):
+    # Serves the same messages as MyTCPServer from one event loop. Messages
+    # that make the computer move run in an executor so a slow search does
+    # not stall the other connections.
+    executor_messages = ('name', 'turn')
+    # requests of one connection being answered at the same time
+    max_in_flight = 256
+
+    def __init__(self, host, port, service=None, executor=None, admission=None):
+        self.host = host
+        self.port = port
+        self.service = service if service is not None else GameService()
+        self.admission = admission if admission is not None else AdmissionControl()
+        self.executor = executor if executor is not None else ThreadPoolExecutor()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, limit=MAX_MESSAGE_SIZE + 1
+        )
+        return self.server
+
+    @property
+    def server_address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        if not self.admission.connect():
+            self.write(writer, self.admission.busy('connections'))
+            writer.close()
+            return
+        peer = writer.get_extra_info('peername')
+        address = peer[0] if peer else ''
+        metrics.connections.inc()
+        metrics.connections_active.inc()
+        # answers of multiplexed requests, running next to the reading loop
+        in_flight = set()
+        # task streaming the game this connection watches, any message stops it
+        watching = None
+        loop = asyncio.get_running_loop()
+
+        def push(data):
+            # called from executor threads with the opponent's moves
+            loop.call_soon_threadsafe(self.write, writer, data)
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        logger_AsyncServerConnection.error('Connection closed in the middle of a message')
+                    break
+                except asyncio.LimitOverrunError:
+                    logger_AsyncServerConnection.error('Message exceeds %s bytes', MAX_MESSAGE_SIZE)
+                    break
+                metrics.bytes_received.inc(len(line))
+                try:
+                    data = json.loads(line.decode('UTF-8'))
+                except Exception as e:
+                    logger_AsyncServerConnection.exception(e)
+                    continue
+                if watching is not None:
+                    watching.cancel()
+                    watching = None
+                if not isinstance(data, dict):
+                    # valid JSON, but not a message
+                    self.write(writer, self.service.error({}, 'invalid'))
+                    continue
+                try:
+                    busy = self.admission.check(address, data)
+                    if busy is not None:
+                        self.write(writer, busy)
+                        continue
+                    if data.get('message') == 'watch':
+                        watching = self.watch(data, writer)
+                        continue
+                    if 'request_id' in data:
+                        if len(in_flight) >= AsyncGameServer.max_in_flight:
+                            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        task = asyncio.ensure_future(self.answer(data, writer, push))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+                    else:
+                        await self.answer(data, writer, push)
+                except (ConnectionError, OSError):
+                    raise
+                except Exception as e:
+                    # the connection goes on with the next message
+                    logger_AsyncServerConnection.exception(e)
+                    self.write(writer, self.service.error(data, 'internal'))
+            if in_flight:
+                await asyncio.wait(in_flight)
+        except (ConnectionError, OSError) as e:
+            logger_AsyncServerConnection.exception(e)
+        finally:
+            if watching is not None:
+                watching.cancel()
+            self.service.disconnect(push)
+            self.admission.disconnect()
+            metrics.connections_active.dec()
+            writer.close()
+
+    async def answer(self, data, writer, push=None):
+        loop = asyncio.get_running_loop()
+        try:
+            if data.get('message') in AsyncGameServer.executor_messages:
+                # the executor's queue is bounded by the admission control
+                if not self.admission.enqueue():
+                    self.write(writer, self.admission.busy('queue', data))
+                    return
+                try:
+                    response = await loop.run_in_executor(self.executor, self.service.handle_request, data, push)
+                finally:
+                    self.admission.dequeue()
+            else:
+                response = self.service.handle_request(data, push)
+            if response is not None:
+                self.write(writer, response)
+                await writer.drain()
+        except Exception as e:
+            logger_AsyncServerConnection.exception(e)
+
+    def watch(self, data, writer):
+        # replies to a watch message, returns the task streaming the updates
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        (response, subscriber) = self.service.watch(data, lambda: loop.call_soon_threadsafe(woken.set))
+        self.write(writer, response)
+        if subscriber is None:
+            return None
+        return asyncio.ensure_future(self.stream(subscriber, writer, woken))
+
+    async def stream(self, subscriber, writer, woken):
+        try:
+            while not subscriber.finished:
+                await woken.wait()
+                woken.clear()
+                payload = b''.join(subscriber.take(0))
+                if payload and not writer.is_closing():
+                    writer.write(payload)
+                    metrics.bytes_sent.inc(len(payload))
+                    await writer.drain()
+            if subscriber.closed:
+                logger_AsyncServerConnection.warning(
+                    'Disconnected a watcher too slow for game %s', subscriber.game_id
+                )
+                writer.close()
+        except (ConnectionError, OSError) as e:
+            logger_AsyncServerConnection.exception(e)
+        finally:
+            self.service.spectators.unsubscribe(subscriber)
+
+    def write(self, writer, data):
+        if writer.is_closing():
+            return
+        payload = encode_message(data)
+        writer.write(payload)
+        metrics.bytes_sent.inc(len(payload))
+        logger_AsyncServerConnection.info('Server sent %s message', data.get('message'))
+
+
+def run(host, port, service=None, admission=None):
+    server = AsyncGameServer(host, port, service, admission=admission)
+    try:
+        asyncio.run(server.serve_forever())
+    finally:
+        server.close()
@@ -0,0 +1,258 @@
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import selectors
+import socket
+import time
+from common.protocol import MAX_MESSAGE_SIZE
+from server.admission import AdmissionControl
+from server.profiler import SamplingProfiler, install_signal
+from server.server import Game, GameService, MyTCPServer, MyTCPServerHandler
+from server.session import shard_of
+
+logger_ClusterConnection = logging.getLogger('ClusterConnection')
+# the only worker pairing players against each other, so they all meet there
+MATCHMAKING_SHARD = 0
+
+
+class PrefixedSocketIO(io.RawIOBase):
+    # Raw socket reader that first returns the bytes the front listener
+    # already consumed while routing the connection.
+    def __init__(self, prefix, sock):
+        self.prefix = prefix
+        self.sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        return self.sock.recv_into(buffer)
+
+
+class ShardWorkerServer(MyTCPServer):
+    # Worker side of the cluster: connections arrive over a unix socket from
+    # the front listener instead of through accept(). limits are the
+    # AdmissionControl arguments, every worker enforces them on its own.
+    def __init__(self, shard, channel, journal=None, profiler=None, limits=None, history=None):
+        self.channel = channel
+        self.prefixes = {}
+        service = GameService(
+            shard=shard, journal=journal, profiler=profiler, admin_token=os.environ.get('TICKTACKTOE_ADMIN_TOKEN'),
+            history=history, matchmaking=shard == MATCHMAKING_SHARD,
+        )
+        admission = AdmissionControl(**(limits or {}))
+        super(ShardWorkerServer, self).__init__(
+            None, ShardWorkerHandler, bind_and_activate=False, service=service, admission=admission,
+        )
+
+    def serve_channel(self):
+        while True:
+            try:
+                (prefix, fds, flags, address) = socket.recv_fds(self.channel, 2 * MAX_MESSAGE_SIZE, 1)
+            except OSError as e:
+                logger_ClusterConnection.exception(e)
+                break
+            if not fds:
+                # the front listener went away
+                break
+            request = socket.socket(fileno=fds[0])
+            self.prefixes[request] = prefix
+            try:
+                client_address = request.getpeername()
+            except OSError:
+                client_address = None
+            self.process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        # the handler takes the prefix, a connection turned away never gets one
+        self.prefixes.pop(request, None)
+        super(ShardWorkerServer, self).shutdown_request(request)
+
+
+class ShardWorkerHandler(MyTCPServerHandler):
+    def make_rfile(self):
+        prefix = self.server.prefixes.pop(self.request, b'')
+        return io.BufferedReader(PrefixedSocketIO(prefix, self.request))
+
+
+def run_worker(shard, channel, inherited, journal_directory=None, metrics_port=None, limits=None, history_path=None,
+               log_options=None):
+    # drop the front's ends of the channels so the worker sees it go away
+    for sock in inherited:
+        sock.close()
+    if log_options is not None:
+        # the front's log writer thread is not forked with it, the worker needs its own
+        from common.logs import setup_logging
+        setup_logging(**log_options)
+    if metrics_port:
+        # every worker has its own numbers, on the port after the previous worker's
+        from server.metrics_http import serve
+        serve(metrics_port + shard)
+    journal = None
+    if journal_directory:
+        # every shard journals its own games
+        from server.persistence import GameJournal
+        journal = GameJournal.open(os.path.join(journal_directory, 'shard-%s' % shard))
+    history = None
+    if history_path:
+        # one file per shard, the reader takes them one after another
+        from server.history import GameHistory
+        history = GameHistory.open('%s.shard-%s' % (history_path, shard))
+    # SIGUSR1 to the worker's pid switches its profiler on and off
+    profiler = SamplingProfiler()
+    install_signal(profiler)
+    server = ShardWorkerServer(shard, channel, journal, profiler, limits, history)
+    try:
+        server.serve_channel()
+    finally:
+        if journal is not None:
+            journal.close()
+        if history is not None:
+            history.close()
+
+
+class ShardedServer(object):
+    # Front listener for N worker processes, each owning the games of one
+    # shard. The listener reads the first message of every connection, picks
+    # the worker from its game_id (new games go round robin) and passes the
+    # socket with the bytes read so far to that worker, which then serves
+    # the connection directly. A connection stays with the worker it was
+    # handed to, so all of its games have to live in that shard. Games
+    # against people are all played by the MATCHMAKING_SHARD worker: a
+    # connection whose first message starts one is handed there, and the
+    # other workers refuse them.
+    handshake_timeout = 10
+
+    def __init__(self, server_address, workers=None, journal_directory=None, metrics_port=None, limits=None,
+                 history_path=None, log_options=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.journal_directory = journal_directory
+        self.metrics_port = metrics_port
+        self.limits = limits
+        self.history_path = history_path
+        # setup_logging arguments for the workers, None leaves their logging alone
+        self.log_options = log_options
+        if self.workers > len(Game.chars):
+            raise ValueError('at most %s workers are supported' % len(Game.chars))
+        self.socket = socket.create_server(server_address, reuse_port=False)
+        self.server_address = self.socket.getsockname()[:2]
+        self.channels = []
+        self.processes = []
+        self.round_robin = itertools.cycle(range(self.workers))
+        self.pending = {}
+        self.running = False
+
+    def start_workers(self):
+        for shard in range(self.workers):
+            (parent, child) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            inherited = [self.socket, parent] + self.channels
+            process = multiprocessing.Process(target=run_worker, args=(
+                shard, child, inherited, self.journal_directory, self.metrics_port, self.limits, self.history_path,
+                self.log_options,
+            ))
+            process.daemon = True
+            process.start()
+            child.close()
+            self.channels.append(parent)
+            self.processes.append(process)
+
+    def serve_forever(self, poll_interval=0.5):
+        if not self.processes:
+            self.start_workers()
+        self.running = True
+        selector = selectors.DefaultSelector()
+        self.socket.setblocking(False)
+        selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while self.running:
+                for (key, events) in selector.select(poll_interval):
+                    if key.fileobj is self.socket:
+                        self.accept(selector)
+                    else:
+                        self.read_first_message(selector, key.fileobj)
+                self.drop_stale(selector)
+        finally:
+            selector.close()
+
+    def accept(self, selector):
+        try:
+            (request, client_address) = self.socket.accept()
+        except BlockingIOError:
+            return
+        request.setblocking(False)
+        self.pending[request] = [b'', time.monotonic() + ShardedServer.handshake_timeout]
+        selector.register(request, selectors.EVENT_READ)
+
+    def read_first_message(self, selector, request):
+        try:
+            data = request.recv(MAX_MESSAGE_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close_pending(selector, request)
+            return
+        self.pending[request][0] += data
+        buffered = self.pending[request][0]
+        if b'\n' in buffered or len(buffered) > MAX_MESSAGE_SIZE:
+            selector.unregister(request)
+            del self.pending[request]
+            self.hand_off(request, buffered)
+
+    def choose_shard(self, line):
+        try:
+            data = json.loads(line.decode('UTF-8'))
+            game_id = data.get('game_id')
+        except Exception:
+            data = {}
+            game_id = None
+        if data.get('message') == 'start' and data.get('opponent') == 'human':
+            # players looking for a person have to meet in one worker
+            return MATCHMAKING_SHARD
+        shard = shard_of(game_id, self.workers) if game_id else None
+        if shard is None:
+            shard = next(self.round_robin)
+        return shard
+
+    def hand_off(self, request, buffered):
+        shard = self.choose_shard(buffered.split(b'\n', 1)[0])
+        try:
+            request.setblocking(True)
+            socket.send_fds(self.channels[shard], [buffered], [request.fileno()])
+        except OSError as e:
+            logger_ClusterConnection.exception(e)
+        finally:
+            # the worker owns its own duplicate of the descriptor now
+            request.close()
+
+    def drop_stale(self, selector):
+        now = time.monotonic()
+        for (request, (buffered, deadline)) in list(self.pending.items()):
+            if deadline < now:
+                self.close_pending(selector, request)
+
+    def close_pending(self, selector, request):
+        selector.unregister(request)
+        del self.pending[request]
+        request.close()
+
+    def shutdown(self):
+        self.running = False
+
+    def server_close(self):
+        self.socket.close()
+        for channel in self.channels:
+            channel.close()
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
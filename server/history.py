@@ -0,0 +1,334 @@
+import argparse
+import atexit
+from array import array
+from collections import Counter, namedtuple
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+logger_GameHistory = logging.getLogger('GameHistory')
+
+# A history file is a sequence of chunks, each written at once by one batch:
+# magic, number of games, payload length and crc32 of the payload. The
+# payload stores every field of the batch's games as one column, the fixed
+# width columns first, so aggregate queries read only the columns they need.
+CHUNK_HEADER = struct.Struct('<4sIII')
+MAGIC = b'TTH1'
+# column name -> array typecode, in payload order, one value per game
+COLUMNS = (
+    ('reason', 'B'),
+    ('starter', 'B'),
+    ('marker', 'B'),
+    ('size', 'B'),
+    ('win_length', 'B'),
+    ('difficulty', 'B'),
+    ('opponent', 'B'),
+    ('finished', 'd'),
+    ('move_count', 'H'),
+    ('id_length', 'B'),
+)
+# codes of the enumerated columns, 0 is unknown
+REASONS = (None, 'win', 'lose', 'draw', 'abandoned')
+MARKERS = (None, 'X', 'O')
+DIFFICULTIES = (None, 'normal', 'perfect', 'search')
+OPPONENTS = (None, 'computer', 'human')
+
+# marker is the first player's, reason the outcome for them
+GameRecord = namedtuple('GameRecord', (
+    'reason', 'starter', 'marker', 'size', 'win_length', 'difficulty', 'opponent', 'finished', 'game_id', 'moves',
+))
+
+
+def code(values, value):
+    return values.index(value) if value in values else 0
+
+
+def little_endian(column):
+    # columns are stored little endian whatever the machine
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def encode_chunk(games):
+    # games are tuples in GameRecord order with the moves as board indexes
+    columns = {name: array(typecode) for (name, typecode) in COLUMNS}
+    ids = []
+    moves = array('H')
+    for game in games:
+        record = GameRecord(*game)
+        columns['reason'].append(code(REASONS, record.reason))
+        columns['starter'].append(code(MARKERS, record.starter))
+        columns['marker'].append(code(MARKERS, record.marker))
+        columns['size'].append(record.size)
+        columns['win_length'].append(record.win_length)
+        columns['difficulty'].append(code(DIFFICULTIES, record.difficulty))
+        columns['opponent'].append(code(OPPONENTS, record.opponent))
+        columns['finished'].append(record.finished)
+        columns['move_count'].append(len(record.moves))
+        game_id = record.game_id.encode('UTF-8')
+        columns['id_length'].append(len(game_id))
+        ids.append(game_id)
+        moves.extend(record.moves)
+    payload = b''.join(little_endian(columns[name]).tobytes() for (name, typecode) in COLUMNS)
+    payload += b''.join(ids) + little_endian(moves).tobytes()
+    return CHUNK_HEADER.pack(MAGIC, len(games), len(payload), zlib.crc32(payload)) + payload
+
+
+class GameHistory(object):
+    # Append-only record of every finished game for offline analysis. A turn
+    # that ends a game only appends a tuple to a list; a background thread
+    # encodes the pending games as one chunk once batch_size of them are
+    # waiting or flush_interval seconds have passed, and appends it with a
+    # single write. A crash loses at most the last batch: a chunk it cut
+    # short is cut off the file before new chunks are appended after it.
+
+    def __init__(self, path, batch_size=4096, flush_interval=1.0, clock=time.time):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.pending = []
+        self.recorded = 0
+        self.written = 0
+        self.flushing = False
+        self.file = None
+        self.thread = None
+        self.closed = False
+
+    @classmethod
+    def open(cls, path, **kwargs):
+        history = cls(path, **kwargs)
+        history.start()
+        atexit.register(history.close)
+        return history
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.truncate_damaged()
+        self.file = open(self.path, 'ab')
+        self.thread = threading.Thread(target=self.run, name='GameHistory')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def truncate_damaged(self):
+        # the reader stops at the first damaged chunk, chunks appended after
+        # one would never be read
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        with HistoryReader(self.path) as reader:
+            end = reader.valid_length()
+        if end < size:
+            logger_GameHistory.warning('Cutting %s damaged bytes off the end of %s', size - end, self.path)
+            os.truncate(self.path, end)
+
+    def record(self, game, reason):
+        # called with game.lock held when game is over; reason is the
+        # outcome for game.first_player
+        moves = game.board.moves
+        starter = getattr(game, 'starter', None) or (moves[0][1] if moves else None)
+        first_player = getattr(game, 'first_player', None)
+        if reason in ('win', 'lose') and moves and first_player is not None:
+            # the last mover won
+            reason = 'win' if moves[-1][1] == first_player.marker else 'lose'
+        entry = (
+            reason, starter, first_player.marker if first_player is not None else None,
+            game.board.size, game.board.win_length, game.difficulty, getattr(game, 'opponent', 'computer'),
+            self.clock(), game.game_id, [index for (index, marker) in moves],
+        )
+        with self.condition:
+            self.pending.append(entry)
+            self.recorded += 1
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.batch_size or self.flushing or self.closed, self.flush_interval
+                )
+                batch = self.pending
+                self.pending = []
+                self.flushing = False
+                closed = self.closed
+            if batch:
+                self.write(batch)
+            with self.condition:
+                self.written += len(batch)
+                self.condition.notify_all()
+            if closed:
+                return
+
+    def write(self, batch):
+        try:
+            self.file.write(encode_chunk(batch))
+            self.file.flush()
+        except (OSError, ValueError, OverflowError) as e:
+            logger_GameHistory.exception(e)
+
+    def flush(self, timeout=None):
+        # waits until everything recorded so far is in the file
+        with self.condition:
+            target = self.recorded
+            self.flushing = True
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.written >= target, timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        if self.file is not None:
+            self.file.close()
+
+
+class HistoryChunk(object):
+    # One chunk of a mapped history file. Columns are read from the mapping
+    # when asked for, the single byte ones without a copy.
+
+    def __init__(self, buffer, count, end=None):
+        self.buffer = buffer
+        self.count = count
+        # offset in the file just past the chunk
+        self.end = end
+        self.offsets = {}
+        offset = 0
+        for (name, typecode) in COLUMNS:
+            self.offsets[name] = offset
+            offset += count * array(typecode).itemsize
+        self.ids_offset = offset
+
+    def column(self, name):
+        typecode = dict(COLUMNS)[name]
+        start = self.offsets[name]
+        view = self.buffer[start:start + self.count * array(typecode).itemsize]
+        if typecode == 'B':
+            return view
+        return little_endian(array(typecode, view.tobytes()))
+
+    def records(self):
+        columns = {name: self.column(name) for (name, typecode) in COLUMNS}
+        id_offset = self.ids_offset
+        moves_offset = id_offset + sum(columns['id_length'])
+        moves = little_endian(array('H', self.buffer[moves_offset:].tobytes()))
+        move_offset = 0
+        for index in range(self.count):
+            id_length = columns['id_length'][index]
+            move_count = columns['move_count'][index]
+            yield GameRecord(
+                REASONS[columns['reason'][index]],
+                MARKERS[columns['starter'][index]],
+                MARKERS[columns['marker'][index]],
+                columns['size'][index],
+                columns['win_length'][index],
+                DIFFICULTIES[columns['difficulty'][index]],
+                OPPONENTS[columns['opponent'][index]],
+                columns['finished'][index],
+                bytes(self.buffer[id_offset:id_offset + id_length]).decode('UTF-8'),
+                moves[move_offset:move_offset + move_count].tolist(),
+            )
+            id_offset += id_length
+            move_offset += move_count
+
+
+class HistoryReader(object):
+    # Memory maps a history file and walks it one chunk at a time, so
+    # neither iterating the games nor an aggregate over a column loads more
+    # than the chunk at hand. Chunks appended after opening are not seen.
+
+    def __init__(self, path, verify=True):
+        self.verify = verify
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # chunks still in use keep the mapping alive until they go
+                pass
+        self.file.close()
+
+    def chunks(self, verify=None):
+        if self.map is None:
+            return
+        verify = self.verify if verify is None else verify
+        view = memoryview(self.map)
+        offset = 0
+        while offset + CHUNK_HEADER.size <= len(view):
+            (magic, count, length, crc) = CHUNK_HEADER.unpack_from(view, offset)
+            payload = view[offset + CHUNK_HEADER.size:offset + CHUNK_HEADER.size + length]
+            if magic != MAGIC or len(payload) < length or verify and zlib.crc32(payload) != crc:
+                logger_GameHistory.warning('Ignoring damaged chunks at the end of %s', self.file.name)
+                return
+            offset += CHUNK_HEADER.size + length
+            yield HistoryChunk(payload, count, offset)
+
+    def valid_length(self):
+        # bytes up to the end of the last chunk that is whole and intact
+        end = 0
+        for chunk in self.chunks(verify=True):
+            end = chunk.end
+        return end
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for record in chunk.records():
+                yield record
+
+    def outcomes(self, by='difficulty'):
+        # Counter of (value of the by column, reason) from two columns only
+        counts = Counter()
+        values = dict(COLUMNS)
+        names = {'difficulty': DIFFICULTIES, 'opponent': OPPONENTS, 'starter': MARKERS, 'marker': MARKERS}
+        for chunk in self.chunks():
+            for pair in zip(chunk.column(by), chunk.column('reason')):
+                counts[pair] += 1
+        decode = names.get(by)
+        return Counter({
+            (decode[value] if decode and values[by] == 'B' else value, REASONS[reason]): count
+            for ((value, reason), count) in counts.items()
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summary of a game history file')
+    parser.add_argument('path')
+    parser.add_argument('--by', default='difficulty', choices=('difficulty', 'opponent', 'starter', 'size'))
+    args = parser.parse_args()
+    with HistoryReader(args.path) as reader:
+        games = 0
+        moves = 0
+        for chunk in reader.chunks():
+            games += chunk.count
+            moves += sum(chunk.column('move_count'))
+        print('%s games, %.2f moves per game' % (games, moves / games if games else 0))
+        for ((value, reason), count) in sorted(reader.outcomes(args.by).items(), key=str):
+            print('%s=%s %s: %s' % (args.by, value, reason, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import threading
+import time
+from server import metrics
+
+
+class Seat(object):
+    # a player waiting for an opponent
+    __slots__ = ('game_id', 'name', 'push', 'joined')
+
+    def __init__(self, game_id, name, push, joined):
+        self.game_id = game_id
+        self.name = name
+        # sends a message to the player's connection
+        self.push = push
+        self.joined = joined
+
+
+class Matchmaker(object):
+    # First come first served queues of players waiting for a human opponent,
+    # one queue per board shape. Joining takes the player waiting longest for
+    # the same shape or queues the newcomer, and leaving drops a player by
+    # game_id; all of it is O(1) under one short lock, so the cost of a
+    # player does not grow with the number waiting.
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        # shape -> OrderedDict of game_id -> Seat, oldest first
+        self.queues = {}
+        # game_id -> shape of every waiting player
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __contains__(self, game_id):
+        return game_id in self.shapes
+
+    def join(self, shape, game_id, name, push):
+        # Returns the Seat of the opponent game_id is paired with, or None
+        # when game_id is queued until someone else joins.
+        now = self.clock()
+        with self.lock:
+            if game_id in self.shapes:
+                return None
+            queue = self.queues.get(shape)
+            if not queue:
+                self.queues.setdefault(shape, OrderedDict())[game_id] = Seat(game_id, name, push, now)
+                self.shapes[game_id] = shape
+                seat = None
+            else:
+                (waiting_id, seat) = queue.popitem(last=False)
+                del self.shapes[waiting_id]
+                if not queue:
+                    del self.queues[shape]
+        if seat is None:
+            metrics.matchmaking_waiting.inc()
+            return None
+        metrics.matchmaking_waiting.dec()
+        # the newcomer did not wait at all
+        metrics.matchmaking_wait_seconds.observe(now - seat.joined)
+        metrics.matchmaking_wait_seconds.observe(0)
+        metrics.matches.inc()
+        return seat
+
+    def leave(self, game_id):
+        # drops a waiting player, returns their Seat or None if not waiting
+        with self.lock:
+            shape = self.shapes.pop(game_id, None)
+            if shape is None:
+                return None
+            queue = self.queues[shape]
+            seat = queue.pop(game_id)
+            if not queue:
+                del self.queues[shape]
+        metrics.matchmaking_waiting.dec()
+        metrics.matchmaking_abandoned.inc()
+        return seat
@@ -0,0 +1,228 @@
+import bisect
+import logging
+import threading
+
+logger_Metrics = logging.getLogger('Metrics')
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# players wait for each other for seconds to minutes
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class ThreadCells(object):
+    # One list of numbers per thread. A thread only ever writes its own list,
+    # so recording takes no lock; the lock is only taken the first time a
+    # thread records. Idents of finished threads are reused by new threads,
+    # which then carry on with the old list.
+    def __init__(self, width):
+        self.width = width
+        self.cells = {}
+        self.lock = threading.Lock()
+
+    def cell(self):
+        ident = threading.get_ident()
+        cell = self.cells.get(ident)
+        if cell is None:
+            with self.lock:
+                cell = self.cells.setdefault(ident, [0] * self.width)
+        return cell
+
+    def totals(self):
+        totals = [0] * self.width
+        for cell in list(self.cells.values()):
+            for (index, value) in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self):
+        self.cells = ThreadCells(1)
+
+    def inc(self, amount=1):
+        self.cells.cell()[0] += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.cells.totals()[0])]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.cells.cell()[0] -= amount
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # a count per bucket and one for +Inf, then the sum
+        self.cells = ThreadCells(len(buckets) + 2)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def samples(self, name, labels):
+        totals = self.cells.totals()
+        samples = []
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + (float('inf'),), totals):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append((name + '_bucket', labels + (('le', le),), cumulative))
+        samples.append((name + '_sum', labels, totals[-1]))
+        samples.append((name + '_count', labels, cumulative))
+        return samples
+
+
+class Callback(object):
+    # value read from function at scrape time, for numbers kept elsewhere
+    def __init__(self, kind, function):
+        self.kind = kind
+        self.function = function
+
+    def samples(self, name, labels):
+        return [(name, labels, self.function())]
+
+
+class MetricFamily(object):
+    def __init__(self, name, help_text, factory, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.factory = factory
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        self.kind = factory().kind
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self.factory()
+        return child
+
+    # metrics without labels are used directly
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s %s' % (self.name, self.kind)]
+        for (values, child) in sorted(self.children.items()):
+            for (name, labels, value) in child.samples(self.name, tuple(zip(self.labelnames, values))):
+                lines.append('%s%s %s' % (name, format_labels(labels), value))
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for (key, value) in labels:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('%s="%s"' % (key, value))
+    return '{%s}' % ','.join(escaped)
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def register(self, family):
+        with self.lock:
+            if family.name in self.families:
+                raise ValueError('metric %s is already registered' % family.name)
+            self.families[family.name] = family
+        return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(MetricFamily(name, help_text, Counter, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(MetricFamily(name, help_text, Gauge, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(MetricFamily(name, help_text, lambda: Histogram(buckets), labelnames))
+
+    def callback(self, name, help_text, function, kind='gauge'):
+        # registering the same name again replaces the function
+        family = MetricFamily(name, help_text, lambda: Callback(kind, function))
+        family.labels()
+        with self.lock:
+            self.families[name] = family
+        return family
+
+    def render(self):
+        lines = []
+        for name in sorted(self.families):
+            try:
+                lines.extend(self.families[name].render())
+            except Exception as e:
+                logger_Metrics.exception(e)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+messages = REGISTRY.counter('ticktacktoe_messages_total', 'Messages handled by type', ('message',))
+message_seconds = REGISTRY.histogram(
+    'ticktacktoe_message_seconds', 'Time to answer a message by type', ('message',)
+)
+message_errors = REGISTRY.counter('ticktacktoe_message_errors_total', 'Messages that raised an error')
+get_move_seconds = REGISTRY.histogram(
+    'ticktacktoe_get_move_seconds', 'Time the computer player takes to move by strategy', ('strategy',)
+)
+games_started = REGISTRY.counter('ticktacktoe_games_started_total', 'Games started')
+game_id_collisions = REGISTRY.counter('ticktacktoe_game_id_collisions_total', 'Generated game ids already in use')
+games_finished = REGISTRY.counter('ticktacktoe_games_finished_total', 'Games finished by result', ('reason',))
+connections = REGISTRY.counter('ticktacktoe_connections_total', 'Connections accepted')
+connections_active = REGISTRY.gauge('ticktacktoe_connections_active', 'Connections open right now')
+bytes_received = REGISTRY.counter('ticktacktoe_received_bytes_total', 'Message bytes received')
+bytes_sent = REGISTRY.counter('ticktacktoe_sent_bytes_total', 'Message bytes sent')
+matchmaking_waiting = REGISTRY.gauge('ticktacktoe_matchmaking_waiting', 'Players queued for a human opponent')
+matchmaking_wait_seconds = REGISTRY.histogram(
+    'ticktacktoe_matchmaking_wait_seconds', 'Time players spent queued before being paired', buckets=WAIT_BUCKETS
+)
+matches = REGISTRY.counter('ticktacktoe_matches_total', 'Pairs of human players matched')
+matchmaking_abandoned = REGISTRY.counter(
+    'ticktacktoe_matchmaking_abandoned_total', 'Players that left the queue before being paired'
+)
+pushes = REGISTRY.counter('ticktacktoe_pushes_total', 'Messages pushed to players without a request')
+rejections = REGISTRY.counter('ticktacktoe_rejections_total', 'Connections and messages answered busy', ('reason',))
+pool_queued = REGISTRY.gauge('ticktacktoe_pool_queued', 'Requests waiting for or running in the worker pool')
+spectators = REGISTRY.gauge('ticktacktoe_spectators', 'Connections watching a game')
+spectator_updates = REGISTRY.counter('ticktacktoe_spectator_updates_total', 'Board updates fanned out to watchers')
+spectator_updates_dropped = REGISTRY.counter(
+    'ticktacktoe_spectator_updates_dropped_total', 'Updates dropped from the buffer of a slow watcher'
+)
+spectators_disconnected = REGISTRY.counter(
+    'ticktacktoe_spectators_disconnected_total', 'Slow watchers disconnected for a full buffer'
+)
+
+
+def register_games(games, registry=REGISTRY):
+    # exposes the registry numbers of a GameStore or GameRegistry
+    registry.callback('ticktacktoe_games_active', 'Games in the registry', lambda: games.stats()['active'])
+    for key in ('evicted', 'expired', 'reaped'):
+        registry.callback(
+            'ticktacktoe_games_%s_total' % key, 'Games %s from the registry' % key,
+            lambda key=key: games.stats()[key], kind='counter',
+        )
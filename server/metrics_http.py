@@ -0,0 +1,50 @@
+import http.server
+import logging
+import threading
+from server.metrics import REGISTRY, register_games
+
+# kept apart from server.metrics so recording does not import the HTTP stack
+logger_Metrics = logging.getLogger('Metrics')
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger_Metrics.debug(format, *args)
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    # Prometheus text endpoint on its own port, served from a daemon thread
+    daemon_threads = True
+
+    def __init__(self, server_address, registry=REGISTRY):
+        self.registry = registry
+        super(MetricsServer, self).__init__(server_address, MetricsHandler)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='MetricsServer')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def serve(port, host='127.0.0.1', games=None, registry=REGISTRY):
+    # starts the metrics endpoint, games defaults to the shared game registry
+    if games is None:
+        from server.server import Game
+        games = Game.game
+    register_games(games, registry)
+    server = MetricsServer((host, port), registry)
+    server.start()
+    logger_Metrics.info('Metrics on http://%s:%s/metrics', host, server.server_address[1])
+    return server
@@ -0,0 +1,281 @@
+import atexit
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from server.server import Game
+
+logger_GameJournal = logging.getLogger('GameJournal')
+
+RECORD_HEADER = struct.Struct('!II')
+MOVE = struct.Struct('!HHB')
+SEGMENT = struct.Struct('!I')
+# record types
+SNAPSHOT = b'S'
+CREATE = b'C'
+NAME = b'N'
+MOVES = b'M'
+END = b'E'
+MARKERS = ('X', 'O')
+
+
+def encode_record(kind, game_id=b'', body=b''):
+    # length and crc32 of the payload, then type, game_id length, game_id, body
+    if isinstance(game_id, str):
+        game_id = game_id.encode('UTF-8')
+    payload = kind + bytes([len(game_id)]) + game_id + body
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    # Yields (type, game_id, body) up to the end of the file or the first
+    # torn or corrupt record, which is where a crash cut the file short.
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        (length, crc) = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        payload = data[offset:offset + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger_GameJournal.warning('Ignoring damaged records at the end of %s', path)
+            return
+        offset += length
+        id_length = payload[1]
+        yield payload[:1], payload[2:2 + id_length].decode('UTF-8'), payload[2 + id_length:]
+
+
+def game_records(game):
+    # records that rebuild game as it is now
+    settings = {
+        'difficulty': game.difficulty,
+        'size': game.board.size,
+        'win_length': game.board.win_length,
+        'updates': game.updates,
+        'markers': list(game.markers),
+    }
+    records = [encode_record(CREATE, game.game_id, json.dumps(settings).encode('UTF-8'))]
+    if getattr(game, 'first_player', None) is not None:
+        records.append(encode_record(NAME, game.game_id, game.first_player.player_name.encode('UTF-8')))
+    for (seq, (index, marker)) in enumerate(game.board.moves):
+        records.append(encode_record(MOVES, game.game_id, MOVE.pack(seq, index, MARKERS.index(marker) + 1)))
+    return records
+
+
+class GameJournal(object):
+    # Durable game state: every created game, registered player and move is
+    # appended to a log segment, and a background thread writes the pending
+    # records with one fsync per batch (group commit), so a turn only pays
+    # for a list append. Every snapshot_records records the writer starts a
+    # new segment, writes a snapshot of the live games and deletes the older
+    # segments. Replaying the snapshot and the segments after it is
+    # idempotent, so the snapshot does not need to stop the games.
+    snapshot_name = 'snapshot'
+    segment_name = 'journal.%08d.log'
+
+    def __init__(self, directory, games=None, commit_interval=0.005, snapshot_records=100000):
+        self.directory = directory
+        self.games = games if games is not None else Game.game
+        self.commit_interval = commit_interval
+        self.snapshot_records = snapshot_records
+        self.condition = threading.Condition()
+        self.pending = []
+        self.appended = 0
+        self.committed = 0
+        self.since_snapshot = 0
+        self.segment = None
+        self.file = None
+        self.thread = None
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def open(cls, directory, games=None, **kwargs):
+        # recovers the games left in directory and starts journaling
+        journal = cls(directory, games, **kwargs)
+        journal.recover()
+        journal.start()
+        atexit.register(journal.close)
+        return journal
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, GameJournal.segment_name % segment)
+
+    def segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('journal.') and name.endswith('.log'):
+                numbers.append(int(name[len('journal.'):-len('.log')]))
+        return sorted(numbers)
+
+    # recovery
+
+    def recover(self):
+        # rebuilds the games of the last run into self.games, returns their number
+        first = 0
+        recovered = {}
+        snapshot = os.path.join(self.directory, GameJournal.snapshot_name)
+        for (kind, game_id, body) in read_records(snapshot):
+            if kind == SNAPSHOT:
+                (first,) = SEGMENT.unpack(body)
+            else:
+                self.replay(recovered, kind, game_id, body)
+        for segment in self.segments():
+            if segment >= first:
+                for (kind, game_id, body) in read_records(self.segment_path(segment)):
+                    self.replay(recovered, kind, game_id, body)
+        for (game_id, game) in recovered.items():
+            self.games[game_id] = game
+        logger_GameJournal.info('Recovered %s games', len(recovered))
+        return len(recovered)
+
+    def replay(self, games, kind, game_id, body):
+        game = games.get(game_id)
+        if kind == CREATE:
+            if game is None:
+                settings = json.loads(body.decode('UTF-8'))
+                game = Game(
+                    game_id,
+                    difficulty=settings['difficulty'],
+                    size=settings['size'],
+                    win_length=settings['win_length'],
+                    updates=settings['updates'],
+                )
+                game.markers = settings['markers']
+                games[game_id] = game
+        elif game is None:
+            return
+        elif kind == NAME:
+            if getattr(game, 'first_player', None) is None:
+                game.create_players(body.decode('UTF-8'))
+        elif kind == MOVES:
+            (seq, index, marker) = MOVE.unpack(body)
+            # moves the snapshot already has show up again in the segment after it
+            if seq == len(game.board.moves):
+                game.board.put_marker_in_area(index, MARKERS[marker - 1])
+                game.sent_seq = game.journaled = len(game.board.moves)
+        elif kind == END:
+            del games[game_id]
+
+    # writing
+
+    def start(self):
+        segments = self.segments()
+        self.segment = segments[-1] + 1 if segments else 0
+        self.file = open(self.segment_path(self.segment), 'ab')
+        # compact whatever the last run left behind, later snapshots are
+        # taken by the writer thread
+        self.snapshot()
+        self.thread = threading.Thread(target=self.run, name='GameJournal')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, records):
+        with self.condition:
+            self.pending.extend(records)
+            self.appended += len(records)
+            self.condition.notify()
+
+    def created(self, game):
+        self.append(game_records(game))
+        game.journaled = len(game.board.moves)
+
+    def named(self, game):
+        self.append([encode_record(NAME, game.game_id, game.first_player.player_name.encode('UTF-8'))])
+        self.moved(game)
+
+    def moved(self, game):
+        # logs the moves made since the last call, callers hold game.lock
+        moves = game.board.moves
+        records = []
+        for seq in range(game.journaled, len(moves)):
+            (index, marker) = moves[seq]
+            records.append(encode_record(MOVES, game.game_id, MOVE.pack(seq, index, MARKERS.index(marker) + 1)))
+        game.journaled = len(moves)
+        if records:
+            self.append(records)
+
+    def ended(self, game_id):
+        self.append([encode_record(END, game_id)])
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.pending:
+                    return
+            # let more records arrive, they share the next fsync
+            time.sleep(self.commit_interval)
+            with self.condition:
+                batch = self.pending
+                self.pending = []
+            self.write(batch)
+            with self.condition:
+                self.committed += len(batch)
+                self.condition.notify_all()
+            self.since_snapshot += len(batch)
+            if self.since_snapshot >= self.snapshot_records:
+                self.snapshot()
+
+    def write(self, batch):
+        try:
+            self.file.write(b''.join(batch))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            logger_GameJournal.exception(e)
+
+    def snapshot(self):
+        # Switches to a new segment first, so every record of the old ones is
+        # already part of the games read below.
+        with self.condition:
+            batch = self.pending
+            self.pending = []
+            self.write(batch)
+            self.committed += len(batch)
+            self.condition.notify_all()
+            self.file.close()
+            self.segment += 1
+            self.file = open(self.segment_path(self.segment), 'ab')
+            first = self.segment
+        self.since_snapshot = 0
+        records = [encode_record(SNAPSHOT, body=SEGMENT.pack(first))]
+        for (game_id, game) in self.games.items():
+            # games against people last only as long as their connections
+            if getattr(game, 'opponent', 'computer') != 'computer':
+                continue
+            with game.lock:
+                records.extend(game_records(game))
+        path = os.path.join(self.directory, GameJournal.snapshot_name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(b''.join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        for segment in self.segments():
+            if segment < first:
+                os.remove(self.segment_path(segment))
+
+    def flush(self, timeout=None):
+        # waits until everything appended so far is on disk
+        with self.condition:
+            target = self.appended
+            return self.condition.wait_for(lambda: self.committed >= target, timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,110 @@
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+logger_Profiler = logging.getLogger('Profiler')
+
+
+def collapse(frame):
+    # root first 'file:function;file:function' line of a stack
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler(object):
+    # Wall clock sampling of every thread's stack, switched on and off while
+    # the server runs. Nothing runs while it is off; while on, a thread wakes
+    # up every interval seconds and counts the current stacks. Stopping
+    # writes the counts as collapsed stacks ('frame;frame count' lines), the
+    # input of flamegraph.pl, speedscope and similar tools.
+
+    def __init__(self, directory='.', interval=0.005):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.deadline = None
+        self.stacks = None
+        self.samples = 0
+        self.last_path = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds=None):
+        # returns False if it was already running; stops by itself after seconds
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = collections.Counter()
+            self.samples = 0
+            self.deadline = time.monotonic() + seconds if seconds else None
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='SamplingProfiler')
+            self.thread.daemon = True
+            self.thread.start()
+            logger_Profiler.info('Profiler started')
+            return True
+
+    def stop(self):
+        # returns the path of the written profile, None if it was not running
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return None
+            self.stopping.set()
+            if thread is not threading.current_thread():
+                thread.join()
+            self.thread = None
+            return self.last_path
+
+    def toggle(self):
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[collapse(frame)] += 1
+            self.samples += 1
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                break
+        self.last_path = self.dump()
+
+    def dump(self):
+        path = os.path.join(
+            self.directory, 'profile-%s-%s.collapsed' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        )
+        try:
+            with open(path, 'w') as f:
+                for (stack, count) in self.stacks.most_common():
+                    f.write('%s %s\n' % (stack, count))
+        except OSError as e:
+            logger_Profiler.exception(e)
+            return None
+        logger_Profiler.info('Profiler wrote %s samples to %s', self.samples, path)
+        return path
+
+
+def install_signal(profiler, signum=None):
+    # the signal (SIGUSR1 by default) starts the profiler and stops it again
+    if signum is None:
+        signum = getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return False
+    signal.signal(signum, lambda received, frame: profiler.toggle())
+    return True
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class GameRegistry(object):
+    # Live games by game_id, bounded in size and idle time. Games are kept in
+    # least recently used order, so both the LRU victim and the games past
+    # their idle TTL are always at the front.
+
+    def __init__(self, max_size=10000, ttl=30 * 60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.games = OrderedDict()
+        self.lock = threading.RLock()
+        self.evicted = 0
+        self.expired = 0
+        self.reaped = 0
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, game_id):
+        with self.lock:
+            self.expire()
+            return game_id in self.games
+
+    def __setitem__(self, game_id, game):
+        self.add(game_id, game)
+
+    def __getitem__(self, game_id):
+        game = self.get(game_id)
+        if game is None:
+            raise KeyError(game_id)
+        return game
+
+    def add(self, game_id, game):
+        with self.lock:
+            now = self.clock()
+            self.expire(now)
+            self.games.pop(game_id, None)
+            while len(self.games) >= self.max_size:
+                self.games.popitem(last=False)
+                self.evicted += 1
+            self.games[game_id] = (game, now)
+
+    def insert(self, game_id, game):
+        # adds game unless game_id is taken, returns whether it was added
+        with self.lock:
+            now = self.clock()
+            self.expire(now)
+            if game_id in self.games:
+                return False
+            self.add(game_id, game)
+            return True
+
+    def get(self, game_id, default=None):
+        with self.lock:
+            now = self.clock()
+            self.expire(now)
+            entry = self.games.get(game_id)
+            if entry is None:
+                return default
+            self.games[game_id] = (entry[0], now)
+            self.games.move_to_end(game_id)
+            return entry[0]
+
+    def items(self):
+        # (game_id, game) pairs of the live games, without touching LRU order
+        with self.lock:
+            self.expire()
+            return [(game_id, entry[0]) for (game_id, entry) in self.games.items()]
+
+    def remove(self, game_id):
+        # drops a finished game, returns it or None if it was not registered
+        with self.lock:
+            entry = self.games.pop(game_id, None)
+            if entry is None:
+                return None
+            self.reaped += 1
+            return entry[0]
+
+    def expire(self, now=None):
+        with self.lock:
+            if now is None:
+                now = self.clock()
+            deadline = now - self.ttl
+            while self.games:
+                (game_id, (game, last_seen)) = next(iter(self.games.items()))
+                if last_seen > deadline:
+                    break
+                self.games.popitem(last=False)
+                self.expired += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'active': len(self.games),
+                'evicted': self.evicted,
+                'expired': self.expired,
+                'reaped': self.reaped,
+            }
+
+
+class GameStore(object):
+    # Lock striped registry: game ids are spread over independent registries,
+    # each behind its own lock, so lookups for different games rarely contend.
+    # Turns on one game are serialized by the game's own lock.
+
+    def __init__(self, stripes=16, max_size=10000, ttl=30 * 60, clock=time.monotonic):
+        per_stripe = max(1, -(-max_size // stripes))
+        self.stripes = tuple(GameRegistry(per_stripe, ttl, clock) for x in range(stripes))
+
+    def stripe(self, game_id):
+        return self.stripes[hash(game_id) % len(self.stripes)]
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self.stripes)
+
+    def __contains__(self, game_id):
+        return game_id in self.stripe(game_id)
+
+    def __setitem__(self, game_id, game):
+        self.stripe(game_id).add(game_id, game)
+
+    def __getitem__(self, game_id):
+        return self.stripe(game_id)[game_id]
+
+    def add(self, game_id, game):
+        self.stripe(game_id).add(game_id, game)
+
+    def insert(self, game_id, game):
+        return self.stripe(game_id).insert(game_id, game)
+
+    def get(self, game_id, default=None):
+        return self.stripe(game_id).get(game_id, default)
+
+    def items(self):
+        return [item for stripe in self.stripes for item in stripe.items()]
+
+    def remove(self, game_id):
+        return self.stripe(game_id).remove(game_id)
+
+    def expire(self):
+        for stripe in self.stripes:
+            stripe.expire()
+
+    def stats(self):
+        totals = {'active': 0, 'evicted': 0, 'expired': 0, 'reaped': 0}
+        for stripe in self.stripes:
+            for (key, value) in stripe.stats().items():
+                totals[key] += value
+        return totals
@@ -0,0 +1,92 @@
+WIN_SCORE = 10 ** 9
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+class BoundedSearch(object):
+    # Depth limited negamax with alpha-beta pruning for k-in-a-row boards of
+    # any size. Only free cells next to a taken cell are searched, and the
+    # evaluation is kept incrementally: taking a cell only changes the score
+    # of the lines through it.
+
+    def __init__(self, geometry, depth=2, max_candidates=12):
+        self.geometry = geometry
+        self.depth = depth
+        self.max_candidates = max_candidates
+        # weights[count] is the value of a line holding count cells of one
+        # side and none of the other
+        self.weights = [0] + [4 ** count for count in range(geometry.win_length)]
+
+    def gain(self, own, opponent, index):
+        # change of own's evaluation after own takes index
+        weights = self.weights
+        gain = 0
+        for line in self.geometry.lines_through[index]:
+            own_line = own & line
+            opponent_line = opponent & line
+            if not opponent_line:
+                count = popcount(own_line)
+                gain += weights[count + 1] - weights[count]
+            if not own_line:
+                gain += weights[popcount(opponent_line)]
+        return gain
+
+    def candidates(self, own, opponent, limit=None):
+        occupied = own | opponent
+        free = ~occupied & self.geometry.full_mask
+        near = self.geometry.neighbours(occupied) if occupied else self.geometry.center_mask
+        if free & near:
+            free &= near
+        moves = []
+        while free:
+            low = free & -free
+            index = low.bit_length() - 1
+            free ^= low
+            # cells good for both sides are tried first
+            order = self.gain(own, opponent, index) + self.gain(opponent, own, index)
+            moves.append((order, index))
+        moves.sort(reverse=True)
+        return [index for (order, index) in moves[:limit]]
+
+    def negamax(self, own, opponent, score, depth, alpha, beta):
+        moves = self.candidates(own, opponent, self.max_candidates)
+        if not moves:
+            return 0
+        for index in moves:
+            bit = 1 << index
+            if self.geometry.is_winning_move(own | bit, index):
+                return WIN_SCORE + depth
+        if not depth:
+            return score
+        best = -WIN_SCORE * 2
+        for index in moves:
+            child_score = score + self.gain(own, opponent, index)
+            value = -self.negamax(opponent, own | 1 << index, -child_score, depth - 1, -beta, -alpha)
+            if value > best:
+                best = value
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        return best
+
+    def get_move(self, own, opponent):
+        moves = self.candidates(own, opponent)
+        # take a win, otherwise block an immediate threat
+        for mask in (own, opponent):
+            for index in moves:
+                if self.geometry.is_winning_move(mask | 1 << index, index):
+                    return index
+        best = None
+        best_move = moves[0]
+        alpha = -WIN_SCORE * 2
+        for index in moves[:self.max_candidates]:
+            child_score = self.gain(own, opponent, index)
+            value = -self.negamax(opponent, own | 1 << index, -child_score, self.depth - 1, -WIN_SCORE * 2, -alpha)
+            if best is None or value > best:
+                best = value
+                best_move = index
+                alpha = max(alpha, value)
+        return best_move
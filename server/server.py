@@ -1,108 +1,851 @@
 from abc import ABCMeta
 import random
+import selectors
+import socket
 import socketserver
-import json
-import string
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import logging
+import os
+import queue
+import time
+from common.protocol import JsonCodec, encode_message, negotiate
+from server import metrics
+from server.admission import AdmissionControl
+from server.registry import GameStore
+from server.matchmaking import Matchmaker
+from server.search import BoundedSearch
+from server.session import SHARD_TAGS, SessionIds
+from server.spectators import Spectators
+from server.solver import PerfectPlaySolver, DEFAULT_TABLE_PATH
 
-logging.basicConfig(
-    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-    datefmt='%m/%d/%Y %I:%M:%S %p',
-    filename='logs.log',
-    level=logging.DEBUG
-)
 logger_ServerConnection = logging.getLogger('ServerConnection')
 logger_ServerGame = logging.getLogger('ServerGame')
 
+class GameService(object):
+    # Turns a request message into its response, independent of the transport
+    handlers = ('start', 'name', 'turn', 'sync', 'profile', 'watch')
+
+    def __init__(self, games=None, shard=None, journal=None, profiler=None, admin_token=None, history=None,
+                 matchmaking=True):
+        self.games = games if games is not None else Game.game
+        # when set, every game id starts with the character for this shard
+        self.shard = shard
+        self.ids = SessionIds(shard)
+        # optional server.persistence.GameJournal recording every change
+        self.journal = journal
+        # optional server.history.GameHistory recording every finished game
+        self.history = history
+        # admin messages need a profiler and carry admin_token as their token
+        self.profiler = profiler
+        self.admin_token = admin_token
+        # players waiting for a human opponent, None when games against
+        # people are played in another process
+        self.matchmaker = Matchmaker() if matchmaking else None
+        # push callable of a connection -> ids of its games against people
+        self.peers = {}
+        self.peers_lock = threading.Lock()
+        # connections watching games
+        self.spectators = Spectators()
+
+    def handle_message(self, data, push=None):
+        message = data.get('message')
+        if message:
+            logger_ServerConnection.info('Server received %s message', message)
+        label = message if message in GameService.handlers else 'other'
+        metrics.messages.labels(label).inc()
+        started = time.perf_counter()
+        try:
+            return self.dispatch(message, data, push)
+        except Exception:
+            metrics.message_errors.inc()
+            raise
+        finally:
+            metrics.message_seconds.labels(label).observe(time.perf_counter() - started)
+
+    def handle_request(self, data, push=None):
+        # handle_message for a connection. Every request gets a reply, an
+        # error when it could not be answered, so a peer waiting for it never
+        # hangs; requests carrying a request_id get it back in their reply, so
+        # a multiplexing peer can match every request to its answer. push
+        # sends messages to the connection outside of replies.
+        try:
+            response = self.handle_message(data, push)
+        except (ValueError, TypeError, KeyError) as e:
+            # a start with an unsupported board or difficulty, a message missing a field
+            logger_ServerConnection.exception(e)
+            response = self.error(data, 'invalid')
+        except Exception as e:
+            logger_ServerConnection.exception(e)
+            response = self.error(data, 'internal')
+        if response is None:
+            game_id = data.get('game_id')
+            # unknown, expired, evicted or finished games are gone from self.games
+            known = isinstance(game_id, str) and self.games.get(game_id) is not None
+            response = self.error(data, 'invalid' if known or 'game_id' not in data else 'unknown_game')
+        if 'request_id' in data:
+            response['request_id'] = data['request_id']
+        return response
+
+    def error(self, data, reason):
+        response = {
+            'message': 'error',
+            'response': {
+                'status': False,
+                'reason': reason,
+            },
+        }
+        for key in ('game_id', 'request_id'):
+            if key in data:
+                response[key] = data[key]
+        return response
+
+    def dispatch(self, message, data, push=None):
+        if message == 'start':
+            return self.start(data)
+        if message == 'name':
+            return self.name(data, push)
+        if message == 'turn':
+            return self.turn(data)
+        if message == 'sync':
+            return self.sync(data)
+        if message == 'profile':
+            return self.profile(data)
+        return None
+
+    def new_game_id(self):
+        return self.ids.new_id()
+
+    def start(self, data):
+        if data.get('opponent') == 'human' and self.matchmaker is None:
+            return self.error(data, 'no_matchmaking')
+        game = Game(
+            None,
+            difficulty=data.get('difficulty'),
+            size=data.get('size', 3),
+            win_length=data.get('win_length', 3),
+            updates=data.get('updates'),
+            opponent=data.get('opponent'),
+        )
+        (game_id, collisions) = self.ids.insert(self.games, game)
+        if collisions:
+            metrics.game_id_collisions.inc(collisions)
+        metrics.games_started.inc()
+        if self.journal is not None and game.opponent == 'computer':
+            self.journal.created(game)
+        return {
+            'message': 'ok_give_name',
+            'game_id': game_id,
+        }
+
+    def name(self, data, push=None):
+        game_id = data['game_id']
+        name = data['name']
+        game = self.games.get(game_id)
+        if game and game.opponent == 'human':
+            return self.match(game, game_id, name, push)
+        if game:
+            with game.lock:
+                response = game.register_player(name)
+                if self.journal is not None:
+                    self.journal.named(game)
+            return {
+                'message': 'ok_start_game',
+                'game_id': game_id,
+                'response': response,
+            }
+
+    def turn(self, data):
+        game_id = data.get('game_id')
+        area = data.get('area')
+        marker = data.get('marker')
+        game = self.games.get(game_id)
+        if not game:
+            return None
+        if game.opponent == 'human':
+            return self.human_turn(game, game_id, area)
+        with game.lock:
+            # another turn may have finished the game while this one waited
+            if game_id not in self.games:
+                return None
+            response = game.turn(area, marker, data.get('seq'))
+            self.broadcast(game, response['status'])
+            if response['status'] == 'gameover':
+                # finished games are not needed once the result is sent
+                self.games.remove(game_id)
+                metrics.games_finished.labels(response.get('reason')).inc()
+                if self.history is not None:
+                    self.history.record(game, response.get('reason'))
+                if self.journal is not None:
+                    self.journal.ended(game_id)
+            elif self.journal is not None:
+                self.journal.moved(game)
+        if response['status'] == 'gameover':
+            return {
+                'message': 'gameover',
+                'game_id': game_id,
+                'response': response,
+            }
+        return {
+            'message': 'your_turn',
+            'game_id': game_id,
+            'response': response,
+        }
+
+    def match(self, game, game_id, name, push):
+        # Queues the player for a human opponent, or seats them with the
+        # player of the same board shape waiting longest. The waiting player
+        # learns about the match from a pushed ok_start_game.
+        if push is None or game.seats:
+            return None
+        shape = (game.board.size, game.board.win_length)
+        with self.peers_lock:
+            self.peers.setdefault(push, set()).add(game_id)
+        while True:
+            seat = self.matchmaker.join(shape, game_id, name, push)
+            if seat is None:
+                return {
+                    'message': 'waiting',
+                    'game_id': game_id,
+                    'response': {
+                        'status': True,
+                        'queue_depth': len(self.matchmaker),
+                    },
+                }
+            # the newcomer joins the game of the waiting player
+            shared = self.games.get(seat.game_id)
+            with self.peers_lock:
+                connected = seat.push in self.peers
+            if shared is not None and connected:
+                break
+            # gone while waiting, the next one in the queue is tried
+        with shared.lock:
+            (first, second) = shared.seat_players(((seat.game_id, seat.name, seat.push), (game_id, name, push)))
+        self.games.add(game_id, shared)
+        self.push(seat.push, {
+            'message': 'ok_start_game',
+            'game_id': seat.game_id,
+            'response': first,
+        })
+        return {
+            'message': 'ok_start_game',
+            'game_id': game_id,
+            'response': second,
+        }
+
+    def human_turn(self, game, game_id, area):
+        # A move against a human opponent: the mover is told to wait, the
+        # opponent gets your_turn pushed, or both get gameover.
+        with game.lock:
+            player = game.seats.get(game_id)
+            if player is None or game_id not in self.games:
+                return None
+            response = game.play(player, area)
+            self.broadcast(game, response['status'])
+            opponent = game.opponent_of(player)
+            if response['status'] == 'gameover':
+                self.end_human_game(game, response['reason'])
+        if response['status'] == 'gameover':
+            reason = 'lose' if response['reason'] == 'win' else response['reason']
+            self.push(opponent.push, {
+                'message': 'gameover',
+                'game_id': opponent.game_id,
+                'response': dict(response, reason=reason),
+            })
+            return {
+                'message': 'gameover',
+                'game_id': game_id,
+                'response': response,
+            }
+        if not response['status']:
+            return {
+                'message': 'your_turn',
+                'game_id': game_id,
+                'response': response,
+            }
+        self.push(opponent.push, {
+            'message': 'your_turn',
+            'game_id': opponent.game_id,
+            'response': response,
+        })
+        return {
+            'message': 'opponent_turn',
+            'game_id': game_id,
+            'response': response,
+        }
+
+    def end_human_game(self, game, reason):
+        # called with the game lock held
+        for (game_id, player) in game.seats.items():
+            self.games.remove(game_id)
+            with self.peers_lock:
+                game_ids = self.peers.get(player.push)
+                if game_ids is not None:
+                    game_ids.discard(game_id)
+        metrics.games_finished.labels(reason).inc()
+        if self.history is not None:
+            self.history.record(game, reason)
+
+    def disconnect(self, push):
+        # The connection behind push is gone: its players leave the queue,
+        # and their opponents win the games still running.
+        with self.peers_lock:
+            game_ids = self.peers.pop(push, ())
+        for game_id in game_ids:
+            if self.matchmaker.leave(game_id) is not None:
+                self.games.remove(game_id)
+                continue
+            game = self.games.get(game_id)
+            if game is None:
+                continue
+            with game.lock:
+                player = game.seats.get(game_id)
+                if player is None or game_id not in self.games:
+                    continue
+                opponent = game.opponent_of(player)
+                self.end_human_game(game, 'abandoned')
+                self.broadcast(game, 'gameover', 'abandoned')
+            self.push(opponent.push, {
+                'message': 'gameover',
+                'game_id': opponent.game_id,
+                'response': {
+                    'status': 'gameover',
+                    'reason': 'abandoned',
+                    'board': game.board.to_list(),
+                },
+            })
+
+    def watch(self, data, wake=None):
+        # Subscribes a connection to the updates of a game. Returns the reply
+        # with the board so far and the Subscriber to stream, the transport
+        # writes the stream; wake is passed on to the Subscriber.
+        metrics.messages.labels('watch').inc()
+        game_id = data.get('game_id')
+        # game ids are strings, anything else names no game
+        game = self.games.get(game_id) if isinstance(game_id, str) else None
+        response = subscriber = None
+        if game:
+            with game.lock:
+                # under the game lock no turn falls between the board and the subscription
+                if game_id in self.games:
+                    seq = len(game.board.moves)
+                    subscriber = self.spectators.subscribe(game.game_id, seq, wake)
+                    response = {
+                        'message': 'watching',
+                        'game_id': game.game_id,
+                        'response': {
+                            'status': True,
+                            'board': game.board.to_list(),
+                            'size': game.board.size,
+                            'win_length': game.board.win_length,
+                            'seq': seq,
+                        },
+                    }
+        if response is None:
+            response = self.error(data, 'unknown_game')
+        if 'request_id' in data:
+            response['request_id'] = data['request_id']
+        return response, subscriber
+
+    def broadcast(self, game, status, reason=None):
+        # Board after a turn for the game's watchers, called with the game
+        # lock held; games nobody watches cost a dict lookup.
+        if game.game_id not in self.spectators or status is False:
+            return
+        moves = game.board.moves
+        update = {
+            'status': status,
+            'board': game.board.to_list(),
+            'seq': len(moves),
+        }
+        if status == 'gameover':
+            # the last mover won unless the board is full
+            update['winner'] = moves[-1][1] if moves and Player.is_winner(game.board, moves[-1][1]) else None
+        if reason is not None:
+            update['reason'] = reason
+        self.spectators.publish(game.game_id, {
+            'message': 'game_update',
+            'game_id': game.game_id,
+            'response': update,
+        }, len(moves), last=status == 'gameover')
+
+    def push(self, push, data):
+        try:
+            push(data)
+            metrics.pushes.inc()
+        except Exception as e:
+            logger_ServerConnection.exception(e)
+
+    def profile(self, data):
+        # admin message switching the sampling profiler on or off
+        if self.profiler is None or not self.admin_token:
+            return None
+        token = data.get('token')
+        if not isinstance(token, str) or not hmac.compare_digest(token, self.admin_token):
+            logger_ServerConnection.warning('Rejected profile message with a wrong token')
+            return None
+        action = data.get('action')
+        path = None
+        if action == 'start':
+            seconds = data.get('seconds')
+            self.profiler.start(seconds if isinstance(seconds, (int, float)) and seconds > 0 else None)
+        elif action == 'stop':
+            path = self.profiler.stop()
+        return {
+            'message': 'profile',
+            'response': {
+                'status': True,
+                'running': self.profiler.running,
+                'path': path,
+            },
+        }
+
+    def sync(self, data):
+        # full board for a delta client that lost track of the moves
+        game_id = data.get('game_id')
+        game = self.games.get(game_id)
+        if not game:
+            return None
+        with game.lock:
+            response = game.sync()
+        return {
+            'message': 'board',
+            'game_id': game_id,
+            'response': response,
+        }
+
+
 class MyTCPServer(socketserver.ThreadingTCPServer):
     allow_reuse_address = True
+    daemon_threads = True
+    # threads answering the requests of multiplexed connections
+    multiplex_workers = 32
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True, service=None, admission=None):
+        self.service = service if service is not None else GameService()
+        # without an AdmissionControl nothing is limited
+        self.admission = admission if admission is not None else AdmissionControl()
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        super(MyTCPServer, self).__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+    def get_executor(self):
+        # created with the first multiplexed request
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(MyTCPServer.multiplex_workers, 'Multiplex')
+            return self.executor
+
+    def process_request(self, request, client_address):
+        # over the connection cap the peer is told busy and the socket is
+        # closed here, before a thread is started for it
+        if not self.admission.connect():
+            try:
+                request.sendall(encode_message(self.admission.busy('connections')))
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        try:
+            super(MyTCPServer, self).process_request(request, client_address)
+        except Exception:
+            self.admission.disconnect()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super(MyTCPServer, self).process_request_thread(request, client_address)
+        finally:
+            self.admission.disconnect()
+
+    def server_close(self):
+        super(MyTCPServer, self).server_close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
 
 class MyTCPServerHandler(socketserver.BaseRequestHandler):
+    # requests of one connection being answered at the same time
+    max_in_flight = 256
+    # seconds between checks for a message from a watcher
+    watch_poll = 0.5
+
+    def setup(self):
+        self.rfile = self.make_rfile()
+        self.codec = JsonCodec()
+        self.send_lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(MyTCPServerHandler.max_in_flight)
+        # messages sent from other threads, written by a thread of this
+        # connection started with the first of them
+        self.outbox = queue.SimpleQueue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.finished = False
+        # rate limits are per client address
+        self.address = self.client_address[0] if self.client_address else ''
+        metrics.connections.inc()
+        metrics.connections_active.inc()
+
+    def make_rfile(self):
+        return self.request.makefile('rb')
+
+    def finish(self):
+        self.rfile.close()
+        self.server.service.disconnect(self.push)
+        with self.writer_lock:
+            self.finished = True
+            if self.writer is not None:
+                self.outbox.put(None)
+        metrics.connections_active.dec()
+
     def handle(self):
+        # One connection carries any number of messages, until the peer closes it
+        while True:
+            try:
+                data = self.codec.read(self.rfile)
+            except Exception as e:
+                logger_ServerConnection.exception(e)
+                break
+            metrics.bytes_received.inc(self.codec.last_size)
+            if data is None:
+                break
+            if not isinstance(data, dict):
+                # valid JSON, but not a message
+                self.send_message(self.server.service.error({}, 'invalid'))
+                continue
+            try:
+                self.process(data)
+            except Exception as e:
+                # the connection goes on with the next message
+                logger_ServerConnection.exception(e)
+                self.send_message(self.server.service.error(data, 'internal'))
+        # wait for the pool to answer and the writer to send everything before the socket closes
+        for x in range(MyTCPServerHandler.max_in_flight):
+            self.in_flight.acquire()
+
+    def process(self, data):
+        busy = self.server.admission.check(self.address, data)
+        if busy is not None:
+            self.send_message(busy)
+            return
+        if data.get('message') == 'watch':
+            self.watch(data)
+            return
+        if 'request_id' in data and 'encoding' not in data:
+            # multiplexed: answered by the pool, replies may overtake each other
+            if not self.server.admission.enqueue():
+                self.send_message(self.server.admission.busy('queue', data))
+                return
+            self.in_flight.acquire()
+            self.server.get_executor().submit(self.answer, data)
+            return
+        response = self.server.service.handle_request(data, self.push)
+        # the reply that negotiates an encoding still goes out in the old one
+        codec = negotiate(data, response, self.codec)
+        self.send_message(response)
+        self.codec = codec
+
+    def watch(self, data):
+        # Streams the updates of a game until it ends or the watcher sends
+        # anything. This thread is the only one writing them, so a slow
+        # watcher holds up nobody but itself; updates wait in its bounded
+        # Subscriber buffer meanwhile.
+        service = self.server.service
+        if not isinstance(self.codec, JsonCodec):
+            # updates are encoded once as JSON for every watcher
+            self.send_message(service.error(data, 'unsupported'))
+            return
+        spectators = service.spectators
+        (response, subscriber) = service.watch(data)
+        self.send_message(response)
+        if subscriber is None:
+            return
+        # select() cannot watch descriptors past FD_SETSIZE, the default selector can
+        selector = selectors.DefaultSelector()
         try:
-            data = json.loads(self.request.recv(1024).decode('UTF-8').strip())
-            message = data.get('message')
-            if message:
-                logger_ServerConnection.info('Server received %s message' % message)
-            if message == 'start':
-                game_id = ''.join(random.sample(Game.chars, 20))
-                data = {
-                    'message': 'ok_give_name',
-                    'game_id': game_id,
-                }
-                self.send_message(data)
-                Game.game[game_id] = Game(game_id)
-            if message == 'name':
-                game_id = data['game_id']
-                name = data['name']
-                game = Game.game.get(game_id)
-                if game:
-                    response = game.register_player(name)
-                    data = {
-                        'message': 'ok_start_game',
-                        'game_id': game_id,
-                        'response': response,
-                    }
-                    self.send_message(data)
-            if message == 'turn':
-                game_id = data.get('game_id')
-                area = data.get('area')
-                marker = data.get('marker')
-                game = Game.game.get(game_id)
-                if game:
-                    response = game.turn(area, marker)
-                    if response['status'] == 'gameover':
-                        data = {
-                            'message': 'gameover',
-                            'game_id': game_id,
-                            'response': response,
-                        }
-                    else:
-                        data = {
-                            'message': 'your_turn',
-                            'game_id': game_id,
-                            'response': response,
-                        }
-                    self.send_message(data)
+            selector.register(self.request, selectors.EVENT_READ)
+            while not subscriber.finished:
+                payload = b''.join(subscriber.take(MyTCPServerHandler.watch_poll))
+                if payload:
+                    with self.send_lock:
+                        self.request.sendall(payload)
+                    metrics.bytes_sent.inc(len(payload))
+                # readable means a message or the end of the connection
+                if selector.select(0):
+                    break
+            if subscriber.closed:
+                logger_ServerConnection.warning('Disconnected a watcher too slow for game %s', subscriber.game_id)
+                self.request.shutdown(socket.SHUT_RDWR)
+        except OSError as e:
+            logger_ServerConnection.exception(e)
+        finally:
+            selector.close()
+            spectators.unsubscribe(subscriber)
+
+    def answer(self, data):
+        # Runs on the shared pool. The reply is left to the connection's
+        # writer, so a peer that stops reading holds up its own writer only;
+        # its request slot is freed once the reply is written.
+        try:
+            response = self.server.service.handle_request(data, self.push)
         except Exception as e:
             logger_ServerConnection.exception(e)
+            self.in_flight.release()
+            return
+        finally:
+            self.server.admission.dequeue()
+        self.post(response, self.in_flight.release)
+
+    def push(self, data):
+        # messages for this connection outside of its replies, such as an
+        # opponent's move, come from other connections' threads
+        self.post(data)
+
+    def post(self, data, done=None):
+        with self.writer_lock:
+            if not self.finished:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self.write_outbox, name='ConnectionWriter')
+                    self.writer.daemon = True
+                    self.writer.start()
+                self.outbox.put((data, done))
+                return
+        # the connection is gone
+        if done is not None:
+            done()
+
+    def write_outbox(self):
+        while True:
+            item = self.outbox.get()
+            if item is None:
+                break
+            (data, done) = item
+            try:
+                self.send_message(data)
+            finally:
+                if done is not None:
+                    done()
 
     def send_message(self, data):
         try:
-            self.request.sendall(bytes(json.dumps(data), 'UTF-8'))
-            logger_ServerConnection.info('Server sent %s message' % data.get('message'))
+            with self.send_lock:
+                payload = self.codec.encode(data)
+                self.request.sendall(payload)
+            metrics.bytes_sent.inc(len(payload))
+            logger_ServerConnection.info('Server sent %s message', data.get('message'))
         except Exception as e:
             logger_ServerConnection.exception(e)
 
-class Board(object):
-    winning_combos = (
-            # horizontal combos
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],
-            # vertical combos
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],
-            # diagonal combos
-            [0, 4, 8], [2, 4, 6],
+def winning_table(winning_masks, cells):
+    return bytes(
+        any(mask & win == win for win in winning_masks) for mask in range(1 << cells)
     )
-    def __init__(self):
-        # create empty board
-        self.board = [None] * 9
+
+
+def mask_indexes(mask):
+    indexes = []
+    while mask:
+        low = mask & -mask
+        indexes.append(low.bit_length() - 1)
+        mask ^= low
+    return indexes
+
+
+class BoardGeometry(object):
+    # Precomputed masks for a size x size board won by win_length in a row,
+    # shared by every board with the same shape.
+    geometries = {}
+    # boards up to this many cells also get a full mask -> winner table
+    table_cells = 9
+
+    def __init__(self, size, win_length):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full_mask = (1 << self.cells) - 1
+        last = size - 1
+        self.corners_mask = sum(1 << index for index in {0, last, last * size, self.cells - 1})
+        middle = {size // 2} if size % 2 else {size // 2 - 1, size // 2}
+        self.center_mask = sum(1 << (row * size + col) for row in middle for col in middle)
+        first_col = sum(1 << (row * size) for row in range(size))
+        self.not_first_col = self.full_mask & ~first_col
+        self.not_last_col = self.full_mask & ~(first_col << last)
+        self.winning_combos = self.build_combos()
+        self.winning_masks = tuple(sum(1 << index for index in combo) for combo in self.winning_combos)
+        lines_through = [[] for index in range(self.cells)]
+        for (combo, mask) in zip(self.winning_combos, self.winning_masks):
+            for index in combo:
+                lines_through[index].append(mask)
+        self.lines_through = tuple(tuple(lines) for lines in lines_through)
+        self.winning = None
+        if self.cells <= BoardGeometry.table_cells:
+            self.winning = winning_table(self.winning_masks, self.cells)
+
+    def __deepcopy__(self, memo):
+        # never changes once built, copies of a board share it like the board does
+        return self
+
+    @classmethod
+    def get(cls, size, win_length):
+        key = (size, win_length)
+        geometry = cls.geometries.get(key)
+        if geometry is None:
+            geometry = cls.geometries[key] = cls(size, win_length)
+        return geometry
+
+    def build_combos(self):
+        combos = []
+        length = self.win_length
+        # horizontal, vertical and both diagonal directions
+        for (d_row, d_col) in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            for row in range(self.size):
+                for col in range(self.size):
+                    end_row = row + d_row * (length - 1)
+                    end_col = col + d_col * (length - 1)
+                    if 0 <= end_row < self.size and 0 <= end_col < self.size:
+                        combos.append([(row + d_row * step) * self.size + col + d_col * step
+                                       for step in range(length)])
+        return tuple(combos)
+
+    def is_winning_move(self, mask, index):
+        # only the lines through the cell just taken can have been completed
+        if self.winning is not None:
+            return bool(self.winning[mask])
+        for line in self.lines_through[index]:
+            if mask & line == line:
+                return True
+        return False
+
+    def neighbours(self, mask):
+        # cells within one step of mask in any direction, mask included
+        mask |= (mask << 1 & self.not_first_col) | (mask >> 1 & self.not_last_col)
+        mask |= (mask << self.size) | (mask >> self.size)
+        return mask & self.full_mask
+
+
+class BoardView(list):
+    # List view of the board masks, writes go back to the owning board
+    def __init__(self, board_obj):
+        super(BoardView, self).__init__(board_obj.to_list())
+        self.board_obj = board_obj
+
+    def __setitem__(self, index, marker):
+        if isinstance(index, slice):
+            for (i, value) in zip(range(*index.indices(len(self))), marker):
+                self.board_obj.set_cell(i, value)
+            return
+        if index < 0:
+            index += len(self)
+        self.board_obj.set_cell(index, marker)
+
+
+class Board(object):
+    classic = BoardGeometry.get(3, 3)
+    winning_combos = classic.winning_combos
+    winning_masks = classic.winning_masks
+    # winning[mask] tells if the cells in mask contain any winning combo
+    winning = classic.winning
+
+    def __init__(self, size=3, win_length=3):
+        # create empty board, one bit mask per marker
+        self.geometry = BoardGeometry.get(size, win_length)
+        self.masks = {}
+        self.last_moves = {}
+        # (index, marker) of every marker put in an area, in order
+        self.moves = []
+        self.view = None
+
+    def __deepcopy__(self, memo):
+        # masks and moves hold immutable values, the geometry is shared and
+        # the list view is built again when the copy is asked for it
+        copy = self.__class__.__new__(self.__class__)
+        copy.geometry = self.geometry
+        copy.masks = dict(self.masks)
+        copy.last_moves = dict(self.last_moves)
+        copy.moves = list(self.moves)
+        copy.view = None
+        return copy
+
+    @property
+    def board(self):
+        if self.view is None:
+            self.view = BoardView(self)
+        return self.view
+
+    @property
+    def size(self):
+        return self.geometry.size
+
+    @property
+    def win_length(self):
+        return self.geometry.win_length
+
+    @property
+    def cells(self):
+        return self.geometry.cells
+
+    def to_list(self):
+        cells = [None] * self.geometry.cells
+        for (marker, mask) in self.masks.items():
+            for index in mask_indexes(mask):
+                cells[index] = marker
+        return cells
+
+    def set_cell(self, index, marker):
+        if not 0 <= index < self.geometry.cells:
+            raise IndexError('board index out of range')
+        bit = 1 << index
+        for key in self.masks:
+            self.masks[key] &= ~bit
+        if marker:
+            self.masks[marker] = self.masks.get(marker, 0) | bit
+            self.last_moves[marker] = index
+        if self.view is not None:
+            list.__setitem__(self.view, index, marker or None)
+
+    def get_mask(self, marker):
+        return self.masks.get(marker, 0)
+
+    def get_occupied_mask(self):
+        occupied = 0
+        for mask in self.masks.values():
+            occupied |= mask
+        return occupied
+
+    def get_free_mask(self):
+        return ~self.get_occupied_mask() & self.geometry.full_mask
+
+    def get_free_indexes(self):
+        return mask_indexes(self.get_free_mask())
 
     def get_free_corners(self):
-            return [index for (index, val) in enumerate(self.board) if self.is_free(index) and index in [0, 2, 6, 8]]
+        return mask_indexes(self.get_free_mask() & self.geometry.corners_mask)
 
     def get_free_center(self):
-        return [4] if self.is_free(4) else []
+        return mask_indexes(self.get_free_mask() & self.geometry.center_mask)
 
     def is_free(self, index):
-        return not self.board[index]
+        return not self.get_occupied_mask() >> index & 1
+
+    def is_full(self):
+        return self.get_occupied_mask() == self.geometry.full_mask
+
+    def is_winner(self, marker):
+        # checks the lines through the last cell taken by marker
+        index = self.last_moves.get(marker)
+        if index is None:
+            return False
+        return self.geometry.is_winning_move(self.get_mask(marker), index)
 
     def put_marker_in_area(self, area, marker):
         try:
-            self.board[area] = marker
+            self.set_cell(area, marker)
         except Exception as e:
             logger_ServerGame.exception(e)
-            raise ValueError('area value should be between 0 and 8')
+            raise ValueError('area value should be between 0 and %s' % (self.geometry.cells - 1))
+        self.moves.append((area, marker))
 
 class Player(object):
     markers = ('X', 'O')
@@ -114,28 +857,83 @@ class Player(object):
 
     @classmethod
     def is_winner(cls, board_obj, marker):
-        for combo in Board.winning_combos:
-            if board_obj.board[combo[0]] == board_obj.board[combo[1]] == board_obj.board[combo[2]] == marker:
-                return True
-        return False
+        return board_obj.is_winner(marker)
 
     def get_opponent_marker(self):
         return [x for x in Player.markers if x != self.marker][0]
 
 class HumanPlayer(Player):
-    # For now unused
+    # Plays from a client connection, so moves arrive in turn messages. In
+    # games against people the player sits at game_id and push sends them
+    # the opponent's moves.
+    def __init__(self, name, marker, game_id=None, push=None):
+        super(HumanPlayer, self).__init__(name, marker)
+        self.game_id = game_id
+        self.push = push
+
     def get_move(self, board):
         pass
-        # area = int(input('Type empty area where you want to place %s (0-8): ' % self.marker))
-        # while True:
-        #     if 0 <= area <= 8 and board.is_free(area):
-        #         return area
-        #     area = int(input('Wrong choice!, Try again (0-8): '))
 
 
 class ComputerPlayer(Player):
+    # strategy name -> method choosing the index of the next move
+    strategies = {
+        'bitboard': 'find_move_bitboard',
+        'deepcopy': 'find_move_deepcopy',
+        'perfect': 'find_move_perfect',
+        'search': 'find_move_search',
+    }
+    solver = None
+
+    def __init__(self, name, marker, strategy='bitboard', search_depth=2):
+        super(ComputerPlayer, self).__init__(name, marker)
+        if strategy not in ComputerPlayer.strategies:
+            raise ValueError('unknown computer strategy %s' % strategy)
+        self.strategy = strategy
+        self.search_depth = search_depth
+
     def get_move(self, board_obj):
         logger_ServerGame.info('Computer makes move')
+        started = time.perf_counter()
+        index = getattr(self, ComputerPlayer.strategies[self.strategy])(board_obj)
+        metrics.get_move_seconds.labels(self.strategy).observe(time.perf_counter() - started)
+        board_obj.put_marker_in_area(index, self.marker)
+
+    def find_move_bitboard(self, board_obj):
+        free = board_obj.get_free_indexes()
+
+        # Check if the computer can win in the next move, then if the player
+        # could win on their next move and block them.
+        for marker in (self.marker, self.get_opponent_marker()):
+            mask = board_obj.get_mask(marker)
+            for index in free:
+                if board_obj.geometry.is_winning_move(mask | 1 << index, index):
+                    return index
+
+        return self.find_fallback_move(board_obj, free)
+
+    def find_move_search(self, board_obj):
+        search = BoundedSearch(board_obj.geometry, depth=self.search_depth)
+        return search.get_move(board_obj.get_mask(self.marker), board_obj.get_mask(self.get_opponent_marker()))
+
+    def find_move_perfect(self, board_obj):
+        if board_obj.geometry is not Board.classic:
+            raise ValueError('perfect play is only available on the 3x3 board')
+        solver = ComputerPlayer.get_solver()
+        return solver.get_move(board_obj.get_mask(self.marker), board_obj.get_mask(self.get_opponent_marker()))
+
+    @classmethod
+    def get_solver(cls):
+        # Loads the table generated by `python -m server.solver` when present,
+        # otherwise solves the game once for the whole process.
+        if cls.solver is None:
+            if os.path.exists(DEFAULT_TABLE_PATH):
+                cls.solver = PerfectPlaySolver.load(Board.winning, DEFAULT_TABLE_PATH)
+            else:
+                cls.solver = PerfectPlaySolver(Board.winning)
+        return cls.solver
+
+    def find_move_deepcopy(self, board_obj):
         indexes = [index for (index, value) in enumerate(board_obj.board) if value is None]
 
         # Check if the computer can win in the next move
@@ -144,8 +942,7 @@ class ComputerPlayer(Player):
             if copy_board.is_free(index):
                 copy_board.board[index] = self.marker
                 if Player.is_winner(copy_board, self.marker):
-                    board_obj.board[index] = self.marker
-                    return
+                    return index
 
         # Check if the player could win on their next move, and block them.
         opponent_marker = self.get_opponent_marker()
@@ -154,59 +951,116 @@ class ComputerPlayer(Player):
             if copy_board.is_free(index):
                 copy_board.board[index] = opponent_marker
                 if Player.is_winner(copy_board, opponent_marker):
-                    board_obj.board[index] = self.marker
-                    return
+                    return index
+
+        return self.find_fallback_move(board_obj, indexes)
 
+    def find_fallback_move(self, board_obj, indexes):
         corners = board_obj.get_free_corners()
         if corners:
-            index = random.choice(corners)
-            board_obj.board[index] = self.marker
-            return
+            return random.choice(corners)
 
         center = board_obj.get_free_center()
         if center:
-            index = random.choice(center)
-            board_obj.board[index] = self.marker
-            return
+            return random.choice(center)
 
-        index = random.choice(indexes)
-        board_obj.board[index] = self.marker
+        return random.choice(indexes)
 
 
 class Game(object):
-    chars = string.ascii_uppercase + string.digits + string.ascii_lowercase
-    game = {}
+    chars = SHARD_TAGS
+    game = GameStore()
+    # difficulty level -> ComputerPlayer strategy
+    difficulties = {
+        'normal': 'bitboard',
+        'perfect': 'perfect',
+        'search': 'search',
+    }
+    max_size = 19
+    # 'full' sends the whole board with every turn, 'delta' only the moves
+    # made since the last board the client acknowledged
+    update_modes = ('full', 'delta')
+    # 'human' games are played by two clients paired by the matchmaker
+    opponents = ('computer', 'human')
 
-    def __init__(self, game_id):
+    def __init__(self, game_id, difficulty=None, size=3, win_length=3, updates=None, opponent=None):
+        if not 3 <= size <= Game.max_size:
+            raise ValueError('board size should be between 3 and %s' % Game.max_size)
+        if not 3 <= win_length <= size:
+            raise ValueError('win length should be between 3 and %s' % size)
+        if difficulty is None:
+            # the corner/center heuristic only makes sense on the classic board
+            difficulty = 'normal' if size == 3 else 'search'
+        if difficulty not in Game.difficulties:
+            raise ValueError('unknown difficulty %s' % difficulty)
+        if difficulty == 'perfect' and (size, win_length) != (3, 3):
+            raise ValueError('perfect difficulty is only available on the 3x3 board')
+        if updates is None:
+            updates = 'full'
+        if updates not in Game.update_modes:
+            raise ValueError('unknown updates mode %s' % updates)
+        if opponent is None:
+            opponent = 'computer'
+        if opponent not in Game.opponents:
+            raise ValueError('unknown opponent %s' % opponent)
+        if opponent == 'human' and updates == 'delta':
+            raise ValueError('delta updates are only available against the computer')
         self.game_id = game_id
-        self.board = Board()
+        self.opponent = opponent
+        # game_id -> HumanPlayer of both players of a game against people
+        self.seats = {}
+        self.whose_turn = None
+        # marker of the player drawn to move first
+        self.starter = None
+        self.updates = updates
+        # sequence number of the last board sent to the client
+        self.sent_seq = 0
+        self.difficulty = difficulty
+        self.board = Board(size, win_length)
         self.markers = self.draw_marker()
+        # serializes messages for this game across handler threads
+        self.lock = threading.Lock()
+        # number of moves already handed to the journal, if there is one
+        self.journaled = 0
 
-    def register_player(self, name):
-        computer_name = 'ComputerBot'
+    def create_players(self, name):
         self.first_player = HumanPlayer(name=name, marker=self.markers[0])
-        self.second_player = ComputerPlayer(name=computer_name, marker=self.markers[1])
+        self.second_player = ComputerPlayer(
+            name='ComputerBot',
+            marker=self.markers[1],
+            strategy=Game.difficulties[self.difficulty],
+        )
         self.players = (self.first_player, self.second_player)
+
+    def register_player(self, name):
+        self.create_players(name)
+        computer_name = self.second_player.player_name
         whose_turn = self.draw_first_player(self.players)
+        self.starter = whose_turn.marker
         if whose_turn == self.second_player:
             self.second_player.get_move(self.board)
         data = {
             'text': '%s vs %s - %s starts' % (name, computer_name, whose_turn.player_name),
             'marker': self.first_player.marker,
-            'board': self.board.board,
+            'board': self.board.to_list(),
+            'size': self.board.size,
+            'win_length': self.board.win_length,
             'status': True,
         }
+        if self.updates == 'delta':
+            data['seq'] = self.sent_seq = len(self.board.moves)
         return data
 
-    def turn(self, area, marker):
+    def turn(self, area, marker, seq=None):
         result = False
         gameover = False
-        if 1 <= area <= 9 and self.board.is_free(area-1):
+        # the marker comes from the client, anything but X or O is refused
+        # before it reaches the board
+        if marker in Player.markers and 1 <= area <= self.board.cells and self.board.is_free(area-1):
             self.board.put_marker_in_area(area-1, marker)
             result = True
         data = {
             'status': result,
-            'board': self.board.board,
         }
         if result:
             if Player.is_winner(self.board, marker):
@@ -225,14 +1079,84 @@ class Game(object):
                 if self.is_draw():
                     data['status'] = 'gameover'
                     data['reason'] = 'draw'
+        if self.updates == 'delta' and data['status'] != 'gameover':
+            self.add_changes(data, seq)
+        else:
+            # snapshot taken after the computer's reply
+            data['board'] = self.board.to_list()
+        return data
+
+    def seat_players(self, seats):
+        # Seats the (game_id, name, push) of two people, the waiting one
+        # first, and returns the ok_start_game response of each.
+        self.players = tuple(
+            HumanPlayer(name, marker, game_id, push) for ((game_id, name, push), marker) in zip(seats, self.markers)
+        )
+        (self.first_player, self.second_player) = self.players
+        self.seats = {player.game_id: player for player in self.players}
+        self.whose_turn = self.draw_first_player(self.players)
+        self.starter = self.whose_turn.marker
+        return [self.start_response(player) for player in self.players]
+
+    def start_response(self, player):
+        return {
+            'text': '%s vs %s - %s starts' % (
+                player.player_name, self.opponent_of(player).player_name, self.whose_turn.player_name
+            ),
+            'marker': player.marker,
+            'board': self.board.to_list(),
+            'size': self.board.size,
+            'win_length': self.board.win_length,
+            'status': True,
+            'your_move': player is self.whose_turn,
+        }
+
+    def opponent_of(self, player):
+        return self.players[1] if player is self.players[0] else self.players[0]
+
+    def play(self, player, area):
+        # move of one of two people, refused unless it is their turn
+        data = {
+            'status': False,
+        }
+        if player is self.whose_turn and isinstance(area, int) and 1 <= area <= self.board.cells \
+                and self.board.is_free(area - 1):
+            self.board.put_marker_in_area(area - 1, player.marker)
+            data['status'] = True
+            if Player.is_winner(self.board, player.marker):
+                data['status'] = 'gameover'
+                data['reason'] = 'win'
+            elif self.is_draw():
+                data['status'] = 'gameover'
+                data['reason'] = 'draw'
+            else:
+                self.whose_turn = self.opponent_of(player)
+        data['board'] = self.board.to_list()
+        return data
+
+    def add_changes(self, data, seq):
+        # Moves after the client's seq, or after the last board sent when the
+        # client did not say; changes are [board index, marker] pairs.
+        moves = self.board.moves
+        if not isinstance(seq, int) or not 0 <= seq <= len(moves):
+            seq = self.sent_seq
+        data['since'] = seq
+        data['seq'] = self.sent_seq = len(moves)
+        data['changes'] = [[index, marker] for (index, marker) in moves[seq:]]
+
+    def sync(self):
+        data = {
+            'status': True,
+            'board': self.board.to_list(),
+        }
+        data['seq'] = self.sent_seq = len(self.board.moves)
         return data
 
     def draw_first_player(self, players):
          return random.choice(players)
 
     def is_draw(self):
-        if all(self.board.board):
-            return True
+        return self.board.is_full()
 
     def draw_marker(self):
         return random.sample(Player.markers, 2)
\ No newline at end of file
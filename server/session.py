@@ -0,0 +1,45 @@
+import base64
+import os
+import string
+
+# characters that tag the shard of a game id, the first of the id
+SHARD_TAGS = string.ascii_uppercase + string.digits + string.ascii_lowercase
+ID_LENGTH = 20
+
+
+def shard_of(game_id, workers):
+    # shard of a tagged game id, None for ids without a known tag
+    try:
+        return SHARD_TAGS.index(game_id[0]) % workers
+    except (TypeError, IndexError, ValueError):
+        return None
+
+
+class SessionIds(object):
+    # Game ids from the operating system's CSPRNG. 15 random bytes encode to
+    # 20 URL safe base64 characters (120 bits); with a shard the first
+    # character is the shard's tag instead, leaving 114 random bits. The
+    # generator holds no state, so handler threads share it without a lock.
+
+    def __init__(self, shard=None):
+        if shard is not None and not 0 <= shard < len(SHARD_TAGS):
+            raise ValueError('shard should be between 0 and %s' % (len(SHARD_TAGS) - 1))
+        self.shard = shard
+        self.prefix = SHARD_TAGS[shard] if shard is not None else ''
+
+    def new_id(self):
+        random_id = base64.urlsafe_b64encode(os.urandom(ID_LENGTH * 3 // 4)).decode('ascii')
+        if self.prefix:
+            return self.prefix + random_id[1:]
+        return random_id
+
+    def insert(self, games, game):
+        # Stores game under a fresh id and returns the id and the number of
+        # collisions met on the way. games.insert refuses ids that are taken,
+        # so two games never share an id even if the generator repeats one.
+        collisions = 0
+        while True:
+            game.game_id = self.new_id()
+            if games.insert(game.game_id, game):
+                return game.game_id, collisions
+            collisions += 1
@@ -0,0 +1,185 @@
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from server.server import Board, ComputerPlayer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CELLS = 9
+FULL_MASK = (1 << CELLS) - 1
+CORNERS = (0, 2, 6, 8)
+CENTER = 4
+X_WINS = 1
+O_WINS = 2
+
+
+class BatchSimulator(object):
+    # Plays many 3x3 bot games in lockstep. Every board is a pair of 9-bit
+    # masks in NumPy arrays; each ply moves the side to move on every
+    # unfinished board at once and finished boards are masked out.
+    strategies = ('random', 'bitboard', 'perfect')
+
+    def __init__(self, seed=None):
+        if np is None:
+            raise ImportError('the batch simulator needs numpy')
+        self.rng = np.random.default_rng(seed)
+        self.winning = np.frombuffer(Board.winning, dtype=np.uint8).astype(bool)
+        self.bits = (1 << np.arange(CELLS)).astype(np.int32)
+        self.perfect = None
+
+    def perfect_table(self):
+        # best move for every (own, opponent) pair, indexed by own | opponent << 9
+        if self.perfect is None:
+            solver = ComputerPlayer.get_solver()
+            table = np.full(1 << (2 * CELLS), -1, dtype=np.int8)
+            for position in range(3 ** CELLS):
+                own = opponent = 0
+                for index in range(CELLS):
+                    (position, cell) = divmod(position, 3)
+                    if cell == 1:
+                        own |= 1 << index
+                    elif cell == 2:
+                        opponent |= 1 << index
+                own_count = bin(own).count('1')
+                opponent_count = bin(opponent).count('1')
+                if own_count not in (opponent_count, opponent_count - 1):
+                    continue
+                if (own | opponent) == FULL_MASK or self.winning[own] or self.winning[opponent]:
+                    continue
+                table[own | opponent << CELLS] = solver.get_move(own, opponent)
+            self.perfect = table
+        return self.perfect
+
+    def free_cells(self, own, opponent):
+        return ((own | opponent)[:, None] & self.bits) == 0
+
+    def random_choice(self, candidates):
+        # uniformly random True column of every row; rows need one True
+        scores = self.rng.random(candidates.shape)
+        scores[~candidates] = -1
+        return scores.argmax(axis=1)
+
+    def move_random(self, own, opponent):
+        return self.random_choice(self.free_cells(own, opponent))
+
+    def move_bitboard(self, own, opponent):
+        # same priority as ComputerPlayer.find_move_bitboard: win, block,
+        # random free corner, center, random free cell
+        free = self.free_cells(own, opponent)
+        wins = free & self.winning[own[:, None] | self.bits]
+        blocks = free & self.winning[opponent[:, None] | self.bits]
+        corners = np.zeros_like(free)
+        corners[:, CORNERS] = free[:, CORNERS]
+        center = np.zeros_like(free)
+        center[:, CENTER] = free[:, CENTER]
+
+        moves = self.random_choice(free)
+        for (candidates, random_pick) in ((center, False), (corners, True), (blocks, False), (wins, False)):
+            # later rules override earlier ones, so wins end up on top
+            has = candidates.any(axis=1)
+            picked = self.random_choice(candidates) if random_pick else candidates.argmax(axis=1)
+            moves = np.where(has, picked, moves)
+        return moves
+
+    def move_perfect(self, own, opponent):
+        return self.perfect_table()[own | opponent << CELLS].astype(np.int64)
+
+    def play(self, strategy_x, strategy_o, games):
+        # returns the result of every game: 0 draw, X_WINS or O_WINS
+        moves = {'X': getattr(self, 'move_' + strategy_x), 'O': getattr(self, 'move_' + strategy_o)}
+        masks = {'X': np.zeros(games, dtype=np.int32), 'O': np.zeros(games, dtype=np.int32)}
+        # True where X moves next, the first player is drawn at random
+        x_to_move = self.rng.random(games) < 0.5
+        active = np.ones(games, dtype=bool)
+        results = np.zeros(games, dtype=np.int8)
+        for ply in range(CELLS):
+            for (marker, other, winner, to_move) in (('X', 'O', X_WINS, x_to_move), ('O', 'X', O_WINS, ~x_to_move)):
+                playing = np.flatnonzero(active & to_move)
+                if not playing.size:
+                    continue
+                own = masks[marker][playing]
+                opponent = masks[other][playing]
+                own = own | self.bits[moves[marker](own, opponent)]
+                masks[marker][playing] = own
+                won = self.winning[own]
+                results[playing[won]] = winner
+                finished = won | ((own | opponent) == FULL_MASK)
+                active[playing[finished]] = False
+            x_to_move = ~x_to_move
+        return results
+
+    def simulate(self, strategy_a, strategy_b, games, batch_size=100000):
+        # strategy_a takes X in a random half of the games
+        counts = {'wins': 0, 'draws': 0, 'losses': 0}
+        remaining = games
+        while remaining:
+            size = min(batch_size, remaining)
+            remaining -= size
+            a_is_x = self.rng.random(size) < 0.5
+            for (a_x, strategy_x, strategy_o) in ((True, strategy_a, strategy_b), (False, strategy_b, strategy_a)):
+                count = int(np.count_nonzero(a_is_x == a_x))
+                if not count:
+                    continue
+                results = self.play(strategy_x, strategy_o, count)
+                (a_wins, b_wins) = (X_WINS, O_WINS) if a_x else (O_WINS, X_WINS)
+                counts['wins'] += int(np.count_nonzero(results == a_wins))
+                counts['losses'] += int(np.count_nonzero(results == b_wins))
+                counts['draws'] += int(np.count_nonzero(results == 0))
+        return counts
+
+
+def simulate_chunk(strategy_a, strategy_b, games, seed, batch_size):
+    return BatchSimulator(seed).simulate(strategy_a, strategy_b, games, batch_size)
+
+
+def simulate(strategy_a, strategy_b, games, processes=1, seed=None, batch_size=100000):
+    for strategy in (strategy_a, strategy_b):
+        if strategy not in BatchSimulator.strategies:
+            raise ValueError('strategy %s cannot be simulated' % strategy)
+    started = time.perf_counter()
+    if processes > 1:
+        seeds = np.random.SeedSequence(seed).spawn(processes)
+        chunks = [games // processes + (1 if x < games % processes else 0) for x in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parts = list(executor.map(
+                simulate_chunk, [strategy_a] * processes, [strategy_b] * processes, chunks, seeds,
+                [batch_size] * processes,
+            ))
+        counts = {key: sum(part[key] for part in parts) for key in parts[0]}
+    else:
+        counts = BatchSimulator(seed).simulate(strategy_a, strategy_b, games, batch_size)
+    elapsed = time.perf_counter() - started
+    return {
+        'strategy': strategy_a,
+        'opponent': strategy_b,
+        'games': games,
+        'wins': counts['wins'],
+        'draws': counts['draws'],
+        'losses': counts['losses'],
+        'win_rate': counts['wins'] / games if games else 0.0,
+        'draw_rate': counts['draws'] / games if games else 0.0,
+        'loss_rate': counts['losses'] / games if games else 0.0,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch bot versus bot self-play on the 3x3 board')
+    parser.add_argument('strategy', choices=BatchSimulator.strategies)
+    parser.add_argument('opponent', choices=BatchSimulator.strategies)
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=100000)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    result = simulate(args.strategy, args.opponent, args.games, args.processes, args.seed, args.batch_size)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
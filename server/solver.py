@@ -0,0 +1,133 @@
+from array import array
+import os
+import sys
+
+SIZE = 9
+FULL_MASK = (1 << SIZE) - 1
+DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perfect_play.table')
+
+
+def symmetries():
+    # the 8 rotations and reflections of the 3x3 grid as index permutations,
+    # permutation[index] is where the cell at index lands
+    cells = [(row, col) for row in range(3) for col in range(3)]
+    transforms = (
+        lambda r, c: (r, c),
+        lambda r, c: (c, 2 - r),
+        lambda r, c: (2 - r, 2 - c),
+        lambda r, c: (2 - c, r),
+        lambda r, c: (r, 2 - c),
+        lambda r, c: (2 - r, c),
+        lambda r, c: (c, r),
+        lambda r, c: (2 - c, 2 - r),
+    )
+    result = []
+    for transform in transforms:
+        permutation = []
+        for (row, col) in cells:
+            (new_row, new_col) = transform(row, col)
+            permutation.append(new_row * 3 + new_col)
+        result.append(tuple(permutation))
+    return tuple(result)
+
+
+class PerfectPlaySolver(object):
+    # Negamax solver for 3x3 tic-tac-toe. Positions are keyed by the mask of
+    # the side to move and the mask of its opponent, so the same table serves
+    # both marker assignments. Keys are reduced by the 8 board symmetries and
+    # the table maps every reachable canonical position to its best move.
+    symmetries = symmetries()
+
+    def __init__(self, winning, table=None):
+        self.winning = winning
+        self.inverse = [
+            tuple(permutation.index(index) for index in range(SIZE))
+            for permutation in PerfectPlaySolver.symmetries
+        ]
+        self.mask_maps = [self.build_mask_map(permutation) for permutation in PerfectPlaySolver.symmetries]
+        self.scores = {}
+        self.table = {}
+        if table is None:
+            self.solve(0, 0)
+        else:
+            self.table = table
+
+    @staticmethod
+    def build_mask_map(permutation):
+        mask_map = array('H', bytes(2 << SIZE))
+        for mask in range(1 << SIZE):
+            mapped = 0
+            for index in range(SIZE):
+                if mask >> index & 1:
+                    mapped |= 1 << permutation[index]
+            mask_map[mask] = mapped
+        return mask_map
+
+    def canonical(self, own, opponent):
+        best_key = None
+        best_symmetry = 0
+        for (symmetry, mask_map) in enumerate(self.mask_maps):
+            key = mask_map[own] | mask_map[opponent] << SIZE
+            if best_key is None or key < best_key:
+                best_key = key
+                best_symmetry = symmetry
+        return best_key, best_symmetry
+
+    def solve(self, own, opponent):
+        # returns the score of the position for the side to move: positive wins,
+        # faster wins score higher, 0 is a draw
+        (key, symmetry) = self.canonical(own, opponent)
+        if key in self.scores:
+            return self.scores[key]
+        own = self.mask_maps[symmetry][own]
+        opponent = self.mask_maps[symmetry][opponent]
+        free = ~(own | opponent) & FULL_MASK
+        best_score = None
+        best_move = None
+        for index in range(SIZE):
+            bit = 1 << index
+            if not free & bit:
+                continue
+            remaining = bin(free & ~bit).count('1')
+            if self.winning[own | bit]:
+                score = remaining + 1
+            elif not remaining:
+                score = 0
+            else:
+                score = -self.solve(opponent, own | bit)
+            if best_score is None or score > best_score:
+                best_score = score
+                best_move = index
+        self.scores[key] = best_score
+        self.table[key] = best_move
+        return best_score
+
+    def get_move(self, own, opponent):
+        (key, symmetry) = self.canonical(own, opponent)
+        move = self.table.get(key)
+        if move is None:
+            self.solve(own, opponent)
+            move = self.table[key]
+        return self.inverse[symmetry][move]
+
+    def save(self, path=DEFAULT_TABLE_PATH):
+        # every entry packs the 18-bit canonical key and the 4-bit move
+        entries = array('I', sorted(key << 4 | move for (key, move) in self.table.items()))
+        with open(path, 'wb') as table_file:
+            entries.tofile(table_file)
+
+    @classmethod
+    def load(cls, winning, path=DEFAULT_TABLE_PATH):
+        entries = array('I')
+        with open(path, 'rb') as table_file:
+            entries.frombytes(table_file.read())
+        return cls(winning, table={entry >> 4: entry & 0xF for entry in entries})
+
+
+if __name__ == '__main__':
+    # Generates the on-disk table: python -m server.solver [path]
+    from server.server import Board
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TABLE_PATH
+    solver = PerfectPlaySolver(Board.winning)
+    solver.save(path)
+    print('Saved %s positions to %s' % (len(solver.table), path))
@@ -0,0 +1,148 @@
+from collections import deque
+import logging
+import queue
+import threading
+from common.protocol import encode_message
+from server import metrics
+
+logger_Spectators = logging.getLogger('Spectators')
+
+
+class Subscriber(object):
+    # Encoded updates of one game waiting to be written to one watcher. The
+    # buffer is bounded: once it holds buffer updates a new one either drops
+    # the oldest ('drop', harmless as every update carries the whole board)
+    # or closes the subscription ('disconnect').
+    policies = ('drop', 'disconnect')
+
+    def __init__(self, game_id, since=0, buffer=64, policy='drop', wake=None):
+        if policy not in Subscriber.policies:
+            raise ValueError('unknown slow watcher policy %s' % policy)
+        self.game_id = game_id
+        # seq of the board the watcher already has
+        self.since = since
+        self.buffer = buffer
+        self.policy = policy
+        # called after every change, for watchers not waiting on the condition
+        self.wake = wake
+        self.messages = deque()
+        self.condition = threading.Condition()
+        self.ended = False
+        self.closed = False
+        self.dropped = 0
+
+    @property
+    def finished(self):
+        return self.closed or self.ended and not self.messages
+
+    def offer(self, payload, seq):
+        # never waits, whatever the watcher's socket is doing
+        with self.condition:
+            # updates queued before the subscription are older than its board
+            if self.closed or seq < self.since:
+                return
+            self.since = seq
+            if len(self.messages) >= self.buffer:
+                if self.policy == 'disconnect':
+                    self.closed = True
+                    self.messages.clear()
+                    metrics.spectators_disconnected.inc()
+                else:
+                    self.messages.popleft()
+                    self.dropped += 1
+                    metrics.spectator_updates_dropped.inc()
+            if not self.closed:
+                self.messages.append(payload)
+            self.condition.notify()
+        if self.wake is not None:
+            self.wake()
+
+    def end(self):
+        # the game is over, the stream ends after the buffered updates
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+        if self.wake is not None:
+            self.wake()
+
+    def take(self, timeout=None):
+        # every buffered update, waiting up to timeout seconds for one
+        with self.condition:
+            if timeout != 0:
+                self.condition.wait_for(lambda: self.messages or self.ended or self.closed, timeout)
+            messages = list(self.messages)
+            self.messages.clear()
+            return messages
+
+
+class Spectators(object):
+    # Watchers of live games. Turns only put their update on a queue; one
+    # fan-out thread encodes each update once and offers the same bytes to
+    # every subscriber of the game, so neither the number of watchers nor a
+    # slow one adds to the time of a turn.
+
+    def __init__(self, buffer=64, policy='drop'):
+        self.buffer = buffer
+        self.policy = policy
+        # game_id -> set of Subscriber
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.updates = queue.SimpleQueue()
+        self.thread = None
+
+    def __contains__(self, game_id):
+        return game_id in self.subscribers
+
+    def subscribe(self, game_id, since=0, wake=None):
+        subscriber = Subscriber(game_id, since, self.buffer, self.policy, wake)
+        with self.lock:
+            self.subscribers.setdefault(game_id, set()).add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='Spectators')
+                self.thread.daemon = True
+                self.thread.start()
+        metrics.spectators.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.game_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.game_id]
+        metrics.spectators.dec()
+
+    def publish(self, game_id, data, seq, last=False):
+        # called on the turn path, never waits
+        self.updates.put((game_id, data, seq, last))
+
+    def run(self):
+        while True:
+            update = self.updates.get()
+            if update is None:
+                break
+            try:
+                self.fan_out(*update)
+            except Exception as e:
+                logger_Spectators.exception(e)
+
+    def fan_out(self, game_id, data, seq, last):
+        with self.lock:
+            subscribers = list(self.subscribers.get(game_id, ()))
+        if not subscribers:
+            return
+        payload = encode_message(data)
+        metrics.spectator_updates.inc()
+        for subscriber in subscribers:
+            try:
+                subscriber.offer(payload, seq)
+                if last:
+                    subscriber.end()
+            except Exception as e:
+                logger_Spectators.exception(e)
+
+    def close(self):
+        if self.thread is not None:
+            self.updates.put(None)
@@ -0,0 +1,91 @@
+import socket
+import threading
+from unittest import TestCase, mock
+from common.protocol import encode_message, read_message
+from server.admission import AdmissionControl, RateLimiter
+from server.server import MyTCPServer, MyTCPServerHandler
+
+
+class RateLimiterTest(TestCase):
+    def test_burst_then_rate(self):
+        clock = mock.Mock(return_value=100.0)
+        limiter = RateLimiter(2, burst=3, clock=clock)
+        self.assertEqual([0, 0, 0], [limiter.take('1.2.3.4') for x in range(3)])
+        self.assertAlmostEqual(0.5, limiter.take('1.2.3.4'))
+        # every address has its own bucket
+        self.assertEqual(0, limiter.take('5.6.7.8'))
+        clock.return_value = 100.5
+        self.assertEqual(0, limiter.take('1.2.3.4'))
+        self.assertGreater(limiter.take('1.2.3.4'), 0)
+        clock.return_value = 200.0
+        # refills up to the burst only
+        self.assertEqual([0, 0, 0], [limiter.take('1.2.3.4') for x in range(3)])
+        self.assertGreater(limiter.take('1.2.3.4'), 0)
+
+    def test_buckets_are_bounded(self):
+        limiter = RateLimiter(1, max_clients=10)
+        for address in range(100):
+            limiter.take(address)
+        self.assertEqual(list(range(90, 100)), list(limiter.buckets))
+
+
+class AdmissionControlTest(TestCase):
+    def test_connection_cap(self):
+        admission = AdmissionControl(max_connections=2)
+        self.assertTrue(admission.connect())
+        self.assertTrue(admission.connect())
+        self.assertFalse(admission.connect())
+        admission.disconnect()
+        self.assertTrue(admission.connect())
+
+    def test_queue_limit(self):
+        admission = AdmissionControl(max_queue=1)
+        self.assertTrue(admission.enqueue())
+        self.assertFalse(admission.enqueue())
+        admission.dequeue()
+        self.assertTrue(admission.enqueue())
+
+    def test_no_limits_by_default(self):
+        admission = AdmissionControl()
+        self.assertTrue(all(admission.connect() and admission.enqueue() for x in range(1000)))
+        self.assertIsNone(admission.check('1.2.3.4', {'message': 'start'}))
+
+    def test_busy_reply(self):
+        admission = AdmissionControl(turn_rate=1, turn_burst=1)
+        data = {'message': 'turn', 'game_id': 'game', 'request_id': 3}
+        self.assertIsNone(admission.check('1.2.3.4', data))
+        busy = admission.check('1.2.3.4', data)
+        self.assertEqual(('busy', 'game', 3), (busy['message'], busy['game_id'], busy['request_id']))
+        self.assertEqual('turn_rate', busy['response']['reason'])
+        self.assertGreater(busy['response']['retry_after'], 0)
+        # start messages are not limited
+        self.assertIsNone(admission.check('1.2.3.4', {'message': 'start'}))
+
+
+class AdmissionServerTest(TestCase):
+    def setUp(self):
+        admission = AdmissionControl(max_connections=1, start_rate=1, start_burst=2)
+        self.server = MyTCPServer(('127.0.0.1', 0), MyTCPServerHandler, admission=admission)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_limits(self):
+        with socket.create_connection(self.server.server_address) as first:
+            rfile = first.makefile('rb')
+            first.sendall(encode_message({'message': 'start'}) * 3)
+            results = [read_message(rfile) for x in range(3)]
+            self.assertEqual(['ok_give_name', 'ok_give_name', 'busy'], [result['message'] for result in results])
+            self.assertEqual('start_rate', results[2]['response']['reason'])
+
+            # over the connection cap the server answers busy and hangs up
+            with socket.create_connection(self.server.server_address) as second:
+                second_rfile = second.makefile('rb')
+                self.assertEqual('connections', read_message(second_rfile)['response']['reason'])
+                self.assertIsNone(read_message(second_rfile))
+                second_rfile.close()
+            rfile.close()
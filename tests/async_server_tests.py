@@ -0,0 +1,114 @@
+import asyncio
+import json
+from unittest import TestCase
+from common.protocol import encode_message
+from server.async_server import AsyncGameServer
+
+
+class AsyncGameServerTest(TestCase):
+    def run_client(self, client):
+        async def main():
+            server = AsyncGameServer('127.0.0.1', 0)
+            await server.start()
+            try:
+                return await client(*server.server_address)
+            finally:
+                server.close()
+        return asyncio.run(main())
+
+    def test_whole_game(self):
+        async def client(host, port):
+            (reader, writer) = await asyncio.open_connection(host, port)
+
+            async def request(data):
+                writer.write(encode_message(data))
+                return json_line(await reader.readline())
+
+            result = await request({'message': 'start'})
+            game_id = result['game_id']
+            result = await request({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            self.assertEqual('ok_start_game', result['message'])
+            marker = result['response']['marker']
+            for area in range(1, 10):
+                if result['message'] == 'gameover':
+                    break
+                if result['response']['board'][area - 1] is None:
+                    result = await request({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+            writer.close()
+            return result
+
+        self.assertEqual('gameover', self.run_client(client)['message'])
+
+    def test_failed_requests_get_error_replies(self):
+        async def client(host, port):
+            (reader, writer) = await asyncio.open_connection(host, port)
+            replies = []
+            for data in ({'message': 'start', 'size': 25}, {'message': 'turn', 'game_id': 'unknown', 'area': 1}):
+                writer.write(encode_message(data))
+                replies.append(json_line(await asyncio.wait_for(reader.readline(), 5)))
+            writer.close()
+            return replies
+
+        replies = self.run_client(client)
+        self.assertEqual(['error', 'error'], [result['message'] for result in replies])
+        self.assertEqual(['invalid', 'unknown_game'], [result['response']['reason'] for result in replies])
+
+    def test_message_that_is_not_an_object(self):
+        async def client(host, port):
+            (reader, writer) = await asyncio.open_connection(host, port)
+            writer.write(b'[1, 2]\n' + encode_message({'message': 'start'}))
+            replies = [json_line(await asyncio.wait_for(reader.readline(), 5)) for x in range(2)]
+            writer.close()
+            return replies
+
+        replies = self.run_client(client)
+        self.assertEqual(('error', 'invalid'), (replies[0]['message'], replies[0]['response']['reason']))
+        self.assertEqual('ok_give_name', replies[1]['message'])
+
+    def test_concurrent_connections(self):
+        async def client(host, port):
+            async def start():
+                (reader, writer) = await asyncio.open_connection(host, port)
+                writer.write(encode_message({'message': 'start'}) * 2)
+                game_ids = [json_line(await reader.readline())['game_id'] for x in range(2)]
+                writer.close()
+                return game_ids
+            results = await asyncio.gather(*[start() for x in range(50)])
+            return set(game_id for game_ids in results for game_id in game_ids)
+
+        self.assertEqual(100, len(self.run_client(client)))
+
+    def test_watch(self):
+        async def client(host, port):
+            (reader, writer) = await asyncio.open_connection(host, port)
+            (watch_reader, watch_writer) = await asyncio.open_connection(host, port)
+
+            async def request(data):
+                writer.write(encode_message(data))
+                return json_line(await reader.readline())
+
+            game_id = (await request({'message': 'start'}))['game_id']
+            watch_writer.write(encode_message({'message': 'watch', 'game_id': game_id}))
+            self.assertEqual('watching', json_line(await watch_reader.readline())['message'])
+            result = await request({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            marker = result['response']['marker']
+            updates = []
+            for area in range(1, 10):
+                if result['message'] == 'gameover':
+                    break
+                if result['response']['board'][area - 1] is None:
+                    result = await request({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+                    updates.append(json_line(await asyncio.wait_for(watch_reader.readline(), 5)))
+            writer.close()
+            watch_writer.close()
+            return result, updates
+
+        (result, updates) = self.run_client(client)
+        self.assertEqual(result['response']['board'], updates[-1]['response']['board'])
+        self.assertEqual('gameover', updates[-1]['response']['status'])
+        seqs = [update['response']['seq'] for update in updates]
+        self.assertEqual(sorted(seqs), seqs)
+
+
+def json_line(line):
+    return json.loads(line.decode('UTF-8'))
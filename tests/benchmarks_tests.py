@@ -0,0 +1,45 @@
+from unittest import TestCase
+from benchmarks import macro
+from benchmarks.compare import compare
+from benchmarks.results import percentile, summarize_latencies
+
+
+class ResultsTest(TestCase):
+    def test_percentile(self):
+        samples = list(range(100, 0, -1))
+        self.assertEqual(50, percentile(samples, 0.50))
+        self.assertEqual(95, percentile(samples, 0.95))
+        self.assertEqual(99, percentile(samples, 0.99))
+        self.assertEqual(7, percentile([7], 0.99))
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_summarize_latencies(self):
+        summary = summarize_latencies([3, 1, 2])
+        self.assertEqual(3, summary['count'])
+        self.assertEqual(2, summary['p50'])
+        self.assertEqual(3, summary['max'])
+
+
+class CompareTest(TestCase):
+    def test_direction_of_regressions(self):
+        baseline = {'results': {'get_move': {'bitboard': 10.0}, 'moves_per_second': 100.0, 'games': 5}}
+        current = {'results': {'get_move': {'bitboard': 12.0}, 'moves_per_second': 120.0, 'games': 9}}
+        rows = {row[0]: row for row in compare(baseline, current, 0.1)}
+        self.assertNotIn('games', rows)
+        self.assertTrue(rows['get_move.bitboard'][4])
+        self.assertFalse(rows['moves_per_second'][4])
+
+
+class MacroTest(TestCase):
+    def test_full_games(self):
+        for backend in ('threading', 'asyncio'):
+            results = macro.run(clients=3, games=2, backend=backend)
+            self.assertEqual(6, results['games'])
+            self.assertEqual(0, results['errors'])
+            self.assertGreater(results['moves'], 0)
+            self.assertEqual(6 * 2 + results['moves'], results['latency_ms']['count'])
+
+    def test_sharded_server(self):
+        results = macro.run(clients=4, games=2, workers=2)
+        self.assertEqual(8, results['games'])
+        self.assertEqual(0, results['errors'])
@@ -0,0 +1,67 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, mock
+from common.protocol import encode_message, read_message
+from ticktacktoe import DEFAULT_PORT, build_parser, log_options, main, run_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ParserTest(TestCase):
+    def test_server_options(self):
+        args = build_parser().parse_args(['server', '--port', '0', '--workers', '2', '--backend', 'asyncio'])
+        self.assertEqual(('server', '127.0.0.1', 0, 2, 'asyncio'),
+                         (args.command, args.host, args.port, args.workers, args.backend))
+        self.assertIsNone(args.journal)
+
+    def test_log_options(self):
+        args = build_parser().parse_args(['--message-log-level', 'WARNING', '--message-sample-rate', '0.1', 'server'])
+        self.assertEqual(
+            {'filename': 'logs.log', 'level': 'DEBUG', 'message_level': 'WARNING', 'sample_rate': 0.1},
+            log_options(args),
+        )
+
+    def test_workers_need_threading_backend(self):
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            main(['server', '--workers', '2', '--backend', 'asyncio'])
+
+    def test_metrics_stay_on_localhost(self):
+        args = build_parser().parse_args(['server', '--host', '0.0.0.0', '--metrics-port', '9100'])
+        with mock.patch('server.metrics_http.serve', side_effect=KeyboardInterrupt) as serve:
+            with self.assertRaises(KeyboardInterrupt):
+                run_server(args)
+        serve.assert_called_once_with(9100)
+
+    def test_client_options(self):
+        args = build_parser().parse_args(['client', '--host', '10.0.0.1', '--encoding', 'binary'])
+        self.assertEqual(('client', '10.0.0.1', DEFAULT_PORT, 'binary'),
+                         (args.command, args.host, args.port, args.encoding))
+
+
+class EntryPointTest(TestCase):
+    def test_client_does_not_import_server(self):
+        code = 'import ticktacktoe, client.client, sys; sys.exit(any(m.startswith("server") for m in sys.modules))'
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+    def test_server_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            command = [
+                sys.executable, os.path.join(ROOT, 'ticktacktoe.py'), '--log-file', os.path.join(directory, 'logs.log'),
+                'server', '--port', '0',
+            ]
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+            try:
+                line = process.stdout.readline().decode('UTF-8')
+                self.assertTrue(line.startswith('Server ready on 127.0.0.1:'), line)
+                port = int(line.split(':')[1].split()[0])
+                with socket.create_connection(('127.0.0.1', port)) as sock:
+                    sock.sendall(encode_message({'message': 'start'}))
+                    with sock.makefile('rb') as rfile:
+                        self.assertEqual('ok_give_name', read_message(rfile)['message'])
+            finally:
+                process.terminate()
+                process.wait()
+                process.stdout.close()
@@ -1,5 +1,8 @@
+import socket
+import threading
 from unittest import TestCase, mock
-from client.client import Interface, Client
+from client.client import BoardState, Connection, Interface, Client, MultiplexedConnection
+from common.protocol import encode_message, read_message
 
 
 class ClientTest(TestCase):
@@ -9,12 +12,132 @@ class ClientTest(TestCase):
     def test_object_initialize(self):
         self.assertEqual('127.0.0.1', self.client.server)
         self.assertEqual(11111, self.client.port)
+        self.assertEqual(3, self.client.size)
         self.assertTrue(isinstance(self.client.interface, Interface))
 
 
+class BoardStateTest(TestCase):
+    def test_apply_delta(self):
+        state = BoardState()
+        self.assertFalse(state.apply({'status': True, 'seq': 2, 'since': 0, 'changes': [[0, 'X'], [4, 'O']]}))
+        self.assertTrue(state.apply({'status': True, 'board': [None] * 9, 'seq': 0}))
+        self.assertTrue(state.apply({'status': True, 'seq': 2, 'since': 0, 'changes': [[0, 'X'], [4, 'O']]}))
+        self.assertEqual(['X', None, None, None, 'O', None, None, None, None], state.board)
+        self.assertEqual(2, state.turn_message('abc', 3, 'X')['seq'])
+        # a gap in the moves asks for a resync
+        self.assertFalse(state.apply({'status': True, 'seq': 6, 'since': 4, 'changes': [[1, 'X'], [2, 'O']]}))
+
+    def test_full_boards(self):
+        state = BoardState()
+        self.assertTrue(state.apply({'status': True, 'board': ['X'] * 9}))
+        self.assertNotIn('seq', state.turn_message('abc', 3, 'X'))
+
+
 class ConnectionTest(TestCase):
-    pass
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.connection = Connection(*self.listener.getsockname())
+        (self.peer, address) = self.listener.accept()
+
+    def tearDown(self):
+        self.connection.close()
+        self.peer.close()
+        self.listener.close()
+
+    def test_messages_share_one_connection(self):
+        rfile = self.peer.makefile('rb')
+        self.connection.send_message({'message': 'start'})
+        self.connection.send_message({'message': 'turn'})
+        self.assertEqual('start', read_message(rfile)['message'])
+        self.assertEqual('turn', read_message(rfile)['message'])
+        rfile.close()
+
+    def test_retrieve_message(self):
+        self.peer.sendall(encode_message({'message': 'ok_give_name'}) + encode_message({'message': 'gameover'}))
+        self.assertEqual('ok_give_name', self.connection.retrieve_message()['message'])
+        self.assertEqual('gameover', self.connection.retrieve_message()['message'])
+        self.peer.close()
+        self.assertIsNone(self.connection.retrieve_message())
+
+
+class MultiplexedConnectionTest(TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.pushed = []
+        self.connection = MultiplexedConnection(*self.listener.getsockname(), on_message=self.pushed.append)
+        (self.peer, address) = self.listener.accept()
+        self.rfile = self.peer.makefile('rb')
+
+    def tearDown(self):
+        self.rfile.close()
+        self.peer.close()
+        self.connection.close()
+        self.listener.close()
+
+    def close_peer(self):
+        self.rfile.close()
+        self.peer.close()
+
+    def test_replies_out_of_order(self):
+        first = self.connection.channel()
+        second = self.connection.channel()
+        first.send_message({'message': 'start'})
+        second.send_message({'message': 'start'})
+        requests = [read_message(self.rfile) for x in range(2)]
+        self.assertNotEqual(requests[0]['request_id'], requests[1]['request_id'])
+        # answer the second request first, and push one untagged message
+        for (request, game_id) in ((requests[1], 'b'), (requests[0], 'a')):
+            self.peer.sendall(encode_message({'message': 'ok_give_name', 'game_id': game_id,
+                                              'request_id': request['request_id']}))
+        self.peer.sendall(encode_message({'message': 'your_turn', 'game_id': 'c'}))
+        self.assertEqual('a', first.retrieve_message()['game_id'])
+        self.assertEqual('b', second.retrieve_message()['game_id'])
+        self.close_peer()
+        self.connection.reader.join(1)
+        self.assertEqual([{'message': 'your_turn', 'game_id': 'c'}], self.pushed)
+
+    def test_replies_arrive_while_a_send_blocks(self):
+        first = self.connection.channel()
+        first.send_message({'message': 'start'})
+        request = read_message(self.rfile)
+        # a send stuck on a full socket buffer
+        real_socket = self.connection.socket
+        release = threading.Event()
+        self.connection.socket = mock.Mock()
+        self.connection.socket.sendall.side_effect = lambda payload: release.wait(10)
+        sender = threading.Thread(target=self.connection.channel().send_message, args=({'message': 'start'},))
+        sender.start()
+        try:
+            self.peer.sendall(encode_message({'message': 'ok_give_name', 'game_id': 'a',
+                                              'request_id': request['request_id']}))
+            self.assertEqual('a', first.replies.get(timeout=2)['game_id'])
+        finally:
+            release.set()
+            sender.join()
+            self.connection.socket = real_socket
+
+    def test_close_wakes_waiting_channels(self):
+        channel = self.connection.channel()
+        channel.send_message({'message': 'start'})
+        self.close_peer()
+        self.assertIsNone(channel.retrieve_message())
 
 
 class InterfaceTest(TestCase):
-    pass
\ No newline at end of file
+    def setUp(self):
+        self.interface = Interface()
+
+    def test_render_classic_board(self):
+        rendered = self.interface.render_board(['X', None, None, None, 'O', None, None, None, None])
+        self.assertEqual(Interface.board_form % ('X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' '), rendered)
+
+    def test_render_larger_board(self):
+        board = [None] * 16
+        board[5] = 'X'
+        rows = [line.strip() for line in self.interface.render_board(board).splitlines() if '|' in line]
+        self.assertEqual(4, len(rows))
+        self.assertEqual('|   | X |   |   |', rows[1])
\ No newline at end of file
@@ -0,0 +1,170 @@
+import atexit
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from common.logs import setup_logging
+from common.protocol import encode_message, read_message
+from server.cluster import MATCHMAKING_SHARD, ShardedServer, ShardWorkerServer, shard_of
+from server.server import Game, GameService
+
+
+class ShardOfTest(TestCase):
+    def test_game_ids_route_to_their_shard(self):
+        for shard in range(4):
+            service = GameService(games={}, shard=shard)
+            for x in range(10):
+                self.assertEqual(shard, shard_of(service.new_game_id(), 4))
+
+    def test_invalid_game_id(self):
+        self.assertIsNone(shard_of('', 4))
+        self.assertIsNone(shard_of('-abc', 4))
+        self.assertEqual(Game.chars.index('C') % 4, shard_of('Cabc', 4))
+
+
+class ShardedServerTest(TestCase):
+    def setUp(self):
+        self.server = ShardedServer(('127.0.0.1', 0), workers=2)
+        self.server.start_workers()
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.connections = []
+
+    def tearDown(self):
+        for (sock, rfile) in self.connections:
+            rfile.close()
+            sock.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def connect(self):
+        sock = socket.create_connection(self.server.server_address)
+        rfile = sock.makefile('rb')
+        self.connections.append((sock, rfile))
+
+        def request(data):
+            sock.sendall(encode_message(data))
+            return read_message(rfile)
+        return request
+
+    def test_games_spread_over_workers(self):
+        game_ids = [self.connect()({'message': 'start'})['game_id'] for x in range(4)]
+        self.assertEqual({0, 1}, set(shard_of(game_id, 2) for game_id in game_ids))
+
+    def test_new_connection_reaches_owning_worker(self):
+        game_ids = [self.connect()({'message': 'start'})['game_id'] for x in range(4)]
+        for game_id in game_ids:
+            result = self.connect()({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            self.assertEqual('ok_start_game', result['message'])
+            self.assertEqual(game_id, result['game_id'])
+
+    def test_connection_keeps_its_worker(self):
+        request = self.connect()
+        game_id = request({'message': 'start'})['game_id']
+        result = request({'message': 'name', 'game_id': game_id, 'name': 'test'})
+        self.assertEqual('ok_start_game', result['message'])
+        other_game_id = request({'message': 'start'})['game_id']
+        self.assertEqual(shard_of(game_id, 2), shard_of(other_game_id, 2))
+
+
+    def test_human_opponents_meet_in_one_worker(self):
+        # the front deals out connections round robin, yet both land in one worker
+        first = self.connect()
+        first_id = first({'message': 'start', 'opponent': 'human'})['game_id']
+        second = self.connect()
+        second_id = second({'message': 'start', 'opponent': 'human'})['game_id']
+        self.assertEqual('waiting', first({'message': 'name', 'game_id': first_id, 'name': 'first'})['message'])
+        result = second({'message': 'name', 'game_id': second_id, 'name': 'second'})
+        self.assertEqual('ok_start_game', result['message'])
+
+    def test_other_workers_refuse_human_opponents(self):
+        while True:
+            request = self.connect()
+            if shard_of(request({'message': 'start'})['game_id'], 2) != MATCHMAKING_SHARD:
+                break
+        result = request({'message': 'start', 'opponent': 'human'})
+        self.assertEqual(('error', 'no_matchmaking'), (result['message'], result['response']['reason']))
+
+class ShardWorkerServerTest(TestCase):
+    def test_turned_away_connections_leave_no_prefix(self):
+        (front, channel) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        server = ShardWorkerServer(0, channel, limits={'max_connections': 1})
+        thread = threading.Thread(target=server.serve_channel)
+        thread.daemon = True
+        thread.start()
+        listener = socket.create_server(('127.0.0.1', 0))
+        clients = []
+        try:
+            for x in range(5):
+                client = socket.create_connection(listener.getsockname())
+                clients.append(client)
+                (request, address) = listener.accept()
+                with request:
+                    socket.send_fds(front, [encode_message({'message': 'start'})], [request.fileno()])
+                rfile = client.makefile('rb')
+                reply = read_message(rfile)
+                if x:
+                    # over the cap: busy, then the connection is closed
+                    self.assertEqual('busy', reply['message'])
+                    self.assertIsNone(read_message(rfile))
+                else:
+                    self.assertEqual('ok_give_name', reply['message'])
+                rfile.close()
+            self.assertEqual({}, server.prefixes)
+        finally:
+            for client in clients:
+                client.close()
+            listener.close()
+            front.close()
+            thread.join()
+            channel.close()
+
+
+class ShardedServerLoggingTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'logs.log')
+        self.root = logging.getLogger()
+        self.handlers = self.root.handlers[:]
+        self.level = self.root.level
+
+    def tearDown(self):
+        self.root.handlers[:] = self.handlers
+        self.root.setLevel(self.level)
+        self.directory.cleanup()
+
+    def test_worker_logs_reach_file(self):
+        # as in main, the front sets up logging before the workers fork
+        listener = setup_logging(self.filename)
+        atexit.unregister(listener.stop)
+        server = ShardedServer(('127.0.0.1', 0), workers=2, log_options={'filename': self.filename})
+        server.start_workers()
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        try:
+            for x in range(2):
+                with socket.create_connection(server.server_address) as sock:
+                    sock.sendall(encode_message({'message': 'start'}))
+                    with sock.makefile('rb') as rfile:
+                        self.assertEqual('ok_give_name', read_message(rfile)['message'])
+            deadline = time.monotonic() + 5
+            lines = []
+            while time.monotonic() < deadline:
+                with open(self.filename) as log_file:
+                    lines = [line for line in log_file if 'Server received start message' in line]
+                if len(lines) == 2:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(2, len(lines))
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            listener.stop()
+            listener.handlers[0].close()
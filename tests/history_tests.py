@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from server.history import GameHistory, GameRecord, HistoryReader, encode_chunk
+from server.registry import GameStore
+from server.server import GameService
+
+
+def record(game_id, reason='win', difficulty='normal', moves=(4, 0, 8)):
+    return GameRecord(reason, 'X', 'X', 3, 3, difficulty, 'computer', 1700000000.5, game_id, list(moves))
+
+
+def play_games(history, count):
+    # plays count games against perfect play, returns their ids
+    service = GameService(games=GameStore(), history=history)
+    game_ids = []
+    for x in range(count):
+        game_id = service.handle_message({'message': 'start', 'difficulty': 'perfect'})['game_id']
+        result = service.handle_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+        marker = result['response']['marker']
+        while result['message'] != 'gameover':
+            area = result['response']['board'].index(None) + 1
+            result = service.handle_message({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+        game_ids.append(game_id)
+    return game_ids
+
+
+class HistoryFileTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'history.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chunks_round_trip(self):
+        first = [record('a'), record('b', 'lose', 'search', range(30))]
+        second = [record('c', 'draw', 'perfect', range(9))]
+        with open(self.path, 'wb') as f:
+            f.write(encode_chunk(first) + encode_chunk(second))
+        with HistoryReader(self.path) as reader:
+            self.assertEqual([2, 1], [chunk.count for chunk in reader.chunks()])
+            self.assertEqual(first + second, list(reader))
+            outcomes = reader.outcomes()
+        self.assertEqual({('normal', 'win'): 1, ('search', 'lose'): 1, ('perfect', 'draw'): 1}, dict(outcomes))
+
+    def test_torn_chunk_is_skipped(self):
+        with open(self.path, 'wb') as f:
+            f.write(encode_chunk([record('a')]) + encode_chunk([record('b')])[:-3])
+        with HistoryReader(self.path) as reader:
+            self.assertEqual(['a'], [game.game_id for game in reader])
+
+    def test_appends_after_torn_chunk_are_read(self):
+        with open(self.path, 'wb') as f:
+            f.write(encode_chunk([record('a')]) + encode_chunk([record('b'), record('c')])[:-3])
+        history = GameHistory.open(self.path, flush_interval=60)
+        game_ids = play_games(history, 3)
+        self.assertTrue(history.flush(5))
+        history.close()
+        with HistoryReader(self.path) as reader:
+            # the torn chunk is gone, the new one follows the last whole chunk
+            self.assertEqual(['a'] + game_ids, [game.game_id for game in reader])
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        with HistoryReader(self.path) as reader:
+            self.assertEqual([], list(reader))
+
+    def test_background_writer(self):
+        history = GameHistory.open(self.path, batch_size=3, flush_interval=60)
+        game_id = play_games(history, 4)[-1]
+        self.assertTrue(history.flush(5))
+        history.close()
+        with HistoryReader(self.path) as reader:
+            # a full batch wakes the writer, which takes what is pending by then
+            counts = [chunk.count for chunk in reader.chunks()]
+            self.assertEqual(4, sum(counts))
+            self.assertGreaterEqual(counts[0], 3)
+            games = list(reader)
+        for game in games:
+            # perfect play never loses
+            self.assertIn(game.reason, ('lose', 'draw'))
+            self.assertEqual(('perfect', 'computer'), (game.difficulty, game.opponent))
+            self.assertIn(game.starter, ('X', 'O'))
+            self.assertEqual(len(game.moves), len(set(game.moves)))
+        self.assertEqual(game_id, games[-1].game_id)
@@ -0,0 +1,77 @@
+import threading
+from unittest import TestCase
+from client.loadgen import ComputerMovePicker, HeadlessClient, LoadGenerator, RandomMovePicker
+from server.server import MyTCPServer, MyTCPServerHandler
+
+
+class MovePickerTest(TestCase):
+    def test_random_picks_free_cell(self):
+        board = ['X', 'O', None, 'X', 'O', 'X', 'O', 'X', 'O']
+        self.assertEqual(2, RandomMovePicker().pick(board, 'X', 3))
+
+    def test_computer_blocks(self):
+        board = ['O', 'O', None, 'X', None, None, None, None, None]
+        self.assertEqual(2, ComputerMovePicker().pick(board, 'X', 3))
+
+
+class LoadGeneratorTest(TestCase):
+    def setUp(self):
+        self.server = MyTCPServer(('127.0.0.1', 0), MyTCPServerHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_plays_requested_games(self):
+        for picker in (RandomMovePicker(), ComputerMovePicker()):
+            generator = LoadGenerator(
+                self.server.server_address[0], self.server.server_address[1],
+                HeadlessClient(picker), sessions=4, games=20,
+            )
+            report = generator.run()
+            self.assertEqual(20, report['games'])
+            self.assertEqual(0, report['errors'])
+            self.assertEqual(20, sum(report['outcomes'].values()))
+            self.assertTrue(set(report['outcomes']) <= {'win', 'lose', 'draw'})
+
+    def test_delta_updates_over_binary(self):
+        generator = LoadGenerator(
+            self.server.server_address[0], self.server.server_address[1],
+            HeadlessClient(ComputerMovePicker(), size=7, win_length=4, encoding='binary', updates='delta'),
+            sessions=2, games=4,
+        )
+        report = generator.run()
+        self.assertEqual(4, report['games'])
+        self.assertEqual(0, report['errors'])
+
+    def test_multiplexed_connections(self):
+        generator = LoadGenerator(
+            self.server.server_address[0], self.server.server_address[1],
+            HeadlessClient(ComputerMovePicker(), updates='delta'), sessions=8, games=40, connections=2,
+        )
+        report = generator.run()
+        self.assertEqual(40, report['games'])
+        self.assertEqual(0, report['errors'])
+        self.assertEqual(2, report['connections'])
+
+    def test_rate_limit(self):
+        generator = LoadGenerator(
+            self.server.server_address[0], self.server.server_address[1],
+            HeadlessClient(RandomMovePicker()), sessions=4, games=6, rate=50,
+        )
+        report = generator.run()
+        self.assertEqual(6, report['games'])
+        self.assertGreaterEqual(report['seconds'], 5 / 50.0)
+
+    def test_unreachable_server_counts_errors(self):
+        port = self.server.server_address[1]
+        self.tearDown()
+        generator = LoadGenerator('127.0.0.1', port, HeadlessClient(RandomMovePicker()), sessions=2, games=4)
+        report = generator.run()
+        self.assertEqual(0, report['games'])
+        self.assertEqual(4, report['errors'])
+        self.assertEqual(1.0, report['error_rate'])
+        self.setUp()
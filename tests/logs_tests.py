@@ -0,0 +1,54 @@
+import atexit
+import logging
+import os
+import tempfile
+from unittest import TestCase, mock
+from common.logs import DeferredQueueHandler, SamplingFilter, setup_logging
+
+
+class SamplingFilterTest(TestCase):
+    def record(self, level):
+        return logging.LogRecord('ServerConnection', level, __file__, 1, 'Server sent %s message', ('x',), None)
+
+    def test_keeps_warnings(self):
+        sampling = SamplingFilter(0)
+        self.assertFalse(sampling.filter(self.record(logging.INFO)))
+        self.assertTrue(sampling.filter(self.record(logging.ERROR)))
+
+    @mock.patch('common.logs.random.random')
+    def test_samples_rate(self, random):
+        sampling = SamplingFilter(0.25)
+        random.return_value = 0.2
+        self.assertTrue(sampling.filter(self.record(logging.INFO)))
+        random.return_value = 0.3
+        self.assertFalse(sampling.filter(self.record(logging.INFO)))
+
+
+class SetupLoggingTest(TestCase):
+    def setUp(self):
+        (handle, self.filename) = tempfile.mkstemp()
+        os.close(handle)
+        self.root = logging.getLogger()
+        self.handlers = self.root.handlers[:]
+        self.level = self.root.level
+        self.message_logger = logging.getLogger('ServerConnection')
+
+    def tearDown(self):
+        self.root.handlers[:] = self.handlers
+        self.root.setLevel(self.level)
+        self.message_logger.setLevel(logging.NOTSET)
+        self.message_logger.filters[:] = []
+        os.remove(self.filename)
+
+    def test_records_are_written_by_listener(self):
+        listener = setup_logging(self.filename, level=logging.INFO, message_level=logging.WARNING)
+        self.assertTrue(any(isinstance(handler, DeferredQueueHandler) for handler in self.root.handlers))
+        logging.getLogger('ServerGame').info('Computer makes move %s', 3)
+        self.message_logger.info('Server sent %s message', 'turn')
+        atexit.unregister(listener.stop)
+        listener.stop()
+        with open(self.filename) as log_file:
+            lines = log_file.read().splitlines()
+        self.assertEqual(1, len(lines))
+        self.assertIn('Computer makes move 3', lines[0])
+        listener.handlers[0].close()
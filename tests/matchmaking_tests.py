@@ -0,0 +1,106 @@
+from unittest import TestCase, mock
+from server.matchmaking import Matchmaker
+from server.registry import GameStore
+from server.server import GameService
+
+
+class MatchmakerTest(TestCase):
+    def test_pairs_players_of_the_same_shape(self):
+        clock = mock.Mock(return_value=10.0)
+        matchmaker = Matchmaker(clock)
+        self.assertIsNone(matchmaker.join((3, 3), 'a', 'Ann', None))
+        self.assertIsNone(matchmaker.join((5, 4), 'b', 'Bob', None))
+        self.assertIsNone(matchmaker.join((5, 5), 'c', 'Cid', None))
+        self.assertEqual(3, len(matchmaker))
+        clock.return_value = 12.5
+        seat = matchmaker.join((3, 3), 'd', 'Dan', None)
+        self.assertEqual(('a', 'Ann', 10.0), (seat.game_id, seat.name, seat.joined))
+        self.assertEqual('c', matchmaker.join((5, 5), 'e', 'Eve', None).game_id)
+        self.assertEqual(['b'], list(matchmaker.shapes))
+
+    def test_joining_twice_does_not_pair_with_itself(self):
+        matchmaker = Matchmaker()
+        self.assertIsNone(matchmaker.join((3, 3), 'a', 'Ann', None))
+        self.assertIsNone(matchmaker.join((3, 3), 'a', 'Ann', None))
+        self.assertEqual(1, len(matchmaker))
+
+    def test_leave(self):
+        matchmaker = Matchmaker()
+        matchmaker.join((3, 3), 'a', 'Ann', None)
+        self.assertEqual('a', matchmaker.leave('a').game_id)
+        self.assertIsNone(matchmaker.leave('a'))
+        self.assertEqual({}, matchmaker.queues)
+        self.assertIsNone(matchmaker.join((3, 3), 'b', 'Bob', None))
+
+
+class HumanGameTest(TestCase):
+    def setUp(self):
+        self.service = GameService(games=GameStore())
+        self.pushed = {'a': [], 'b': []}
+        # one push callable per connection, as the servers keep them
+        self.push = {
+            player: (lambda data, player=player: self.pushed[player].append(data)) for player in self.pushed
+        }
+
+    def join(self, player):
+        game_id = self.service.handle_message({'message': 'start', 'opponent': 'human'})['game_id']
+        result = self.service.handle_message(
+            {'message': 'name', 'game_id': game_id, 'name': player}, self.push[player]
+        )
+        return game_id, result
+
+    def test_players_are_paired_and_moves_pushed(self):
+        (first_id, result) = self.join('a')
+        self.assertEqual('waiting', result['message'])
+        self.assertEqual(1, result['response']['queue_depth'])
+        (second_id, result) = self.join('b')
+        self.assertEqual('ok_start_game', result['message'])
+        self.assertEqual(1, len(self.pushed['a']))
+        pushed = self.pushed['a'][0]
+        self.assertEqual(('ok_start_game', first_id), (pushed['message'], pushed['game_id']))
+        self.assertNotEqual(pushed['response']['marker'], result['response']['marker'])
+        self.assertNotEqual(pushed['response']['your_move'], result['response']['your_move'])
+
+        seats = {first_id: ('a', pushed['response']), second_id: ('b', result['response'])}
+        mover = first_id if pushed['response']['your_move'] else second_id
+        other = second_id if mover == first_id else first_id
+        # the player who does not start may not move
+        result = self.service.handle_message({'message': 'turn', 'game_id': other, 'area': 1})
+        self.assertEqual(('your_turn', False), (result['message'], result['response']['status']))
+
+        # the mover takes the top row, the other player the middle row
+        for (mover_area, other_area) in ((1, 4), (2, 5)):
+            result = self.service.handle_message({'message': 'turn', 'game_id': mover, 'area': mover_area})
+            self.assertEqual('opponent_turn', result['message'])
+            pushed = self.pushed[seats[other][0]][-1]
+            self.assertEqual(('your_turn', other), (pushed['message'], pushed['game_id']))
+            self.assertEqual(seats[mover][1]['marker'], pushed['response']['board'][mover_area - 1])
+            result = self.service.handle_message({'message': 'turn', 'game_id': other, 'area': other_area})
+            self.assertEqual('opponent_turn', result['message'])
+        result = self.service.handle_message({'message': 'turn', 'game_id': mover, 'area': 3})
+        self.assertEqual(('gameover', 'win'), (result['message'], result['response']['reason']))
+        pushed = self.pushed[seats[other][0]][-1]
+        self.assertEqual(('gameover', 'lose'), (pushed['message'], pushed['response']['reason']))
+        self.assertNotIn(first_id, self.service.games)
+        self.assertNotIn(second_id, self.service.games)
+
+    def test_disconnect(self):
+        (first_id, result) = self.join('a')
+        self.service.disconnect(self.push['a'])
+        self.assertEqual(0, len(self.service.matchmaker))
+        self.assertNotIn(first_id, self.service.games)
+
+        (first_id, result) = self.join('a')
+        (second_id, result) = self.join('b')
+        self.service.disconnect(self.push['b'])
+        pushed = self.pushed['a'][-1]
+        self.assertEqual(('gameover', 'abandoned'), (pushed['message'], pushed['response']['reason']))
+        self.assertNotIn(first_id, self.service.games)
+
+    def test_name_needs_a_connection(self):
+        game_id = self.service.handle_message({'message': 'start', 'opponent': 'human'})['game_id']
+        self.assertIsNone(self.service.handle_message({'message': 'name', 'game_id': game_id, 'name': 'a'}))
+
+    def test_delta_updates_are_refused(self):
+        with self.assertRaises(ValueError):
+            self.service.handle_message({'message': 'start', 'opponent': 'human', 'updates': 'delta'})
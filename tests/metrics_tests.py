@@ -0,0 +1,104 @@
+import threading
+import urllib.error
+import urllib.request
+from unittest import TestCase
+from client.client import Connection
+from server.metrics import MetricsRegistry, register_games
+from server.metrics_http import MetricsServer
+from server.registry import GameStore
+from server.server import MyTCPServer, MyTCPServerHandler
+
+
+class MetricsRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_across_threads(self):
+        counter = self.registry.counter('test_total', 'Test counter', ('kind',))
+
+        def work():
+            for x in range(1000):
+                counter.labels('a').inc()
+                counter.labels('b').inc(2)
+        threads = [threading.Thread(target=work) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        text = self.registry.render()
+        self.assertIn('# TYPE test_total counter', text)
+        self.assertIn('test_total{kind="a"} 8000', text)
+        self.assertIn('test_total{kind="b"} 16000', text)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'Test histogram', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertIn('test_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count 4', lines)
+        self.assertIn('test_seconds_sum 3.65', lines)
+
+    def test_gauge_and_callbacks(self):
+        gauge = self.registry.gauge('test_active', 'Test gauge')
+        gauge.inc(3)
+        gauge.dec()
+        games = GameStore()
+        games['a'] = 'game'
+        register_games(games, self.registry)
+        text = self.registry.render()
+        self.assertIn('test_active 2', text)
+        self.assertIn('ticktacktoe_games_active 1', text)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('test_active', 'Registered twice')
+
+
+class MetricsServerTest(TestCase):
+    def setUp(self):
+        self.server = MyTCPServer(('127.0.0.1', 0), MyTCPServerHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.metrics = MetricsServer(('127.0.0.1', 0))
+        self.metrics.start()
+
+    def tearDown(self):
+        self.metrics.shutdown()
+        self.metrics.server_close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def scrape(self):
+        url = 'http://%s:%s/metrics' % self.metrics.server_address[:2]
+        with urllib.request.urlopen(url) as response:
+            self.assertIn('text/plain', response.headers['Content-Type'])
+            return response.read().decode('UTF-8')
+
+    def sample(self, text, name):
+        for line in text.splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split()[-1])
+        return 0.0
+
+    def test_scrape_after_messages(self):
+        before = self.scrape()
+        with Connection(*self.server.server_address, exit_on_error=False) as connection:
+            connection.send_message({'message': 'start'})
+            game_id = connection.retrieve_message()['game_id']
+            connection.send_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            connection.retrieve_message()
+        after = self.scrape()
+        for name in ('ticktacktoe_messages_total{message="start"}', 'ticktacktoe_messages_total{message="name"}',
+                     'ticktacktoe_connections_total'):
+            self.assertEqual(1, self.sample(after, name) - self.sample(before, name))
+        self.assertGreater(
+            self.sample(after, 'ticktacktoe_sent_bytes_total'), self.sample(before, 'ticktacktoe_sent_bytes_total')
+        )
+        self.assertIn('ticktacktoe_message_seconds_bucket{message="name",le="+Inf"}', after)
+
+    def test_unknown_path(self):
+        url = 'http://%s:%s/other' % self.metrics.server_address[:2]
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(url)
@@ -0,0 +1,111 @@
+import shutil
+import tempfile
+from unittest import TestCase, mock
+from server.persistence import GameJournal
+from server.registry import GameStore
+from server.server import GameService
+
+
+class GameJournalTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journals = []
+
+    def tearDown(self):
+        for journal in self.journals:
+            journal.close()
+        shutil.rmtree(self.directory)
+
+    def open_journal(self, **kwargs):
+        games = GameStore()
+        journal = GameJournal(self.directory, games, commit_interval=0.001, **kwargs)
+        journal.recover()
+        journal.start()
+        self.journals.append(journal)
+        return GameService(games, journal=journal)
+
+    def play(self, service, size=7, turns=2):
+        start = {'message': 'start', 'size': size, 'win_length': min(size, 4)}
+        game_id = service.handle_message(start)['game_id']
+        result = service.handle_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+        marker = result['response']['marker']
+        for x in range(turns):
+            area = service.games[game_id].board.to_list().index(None) + 1
+            service.handle_message({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+        return game_id
+
+    def restart(self, **kwargs):
+        self.journals[-1].close()
+        return self.open_journal(**kwargs)
+
+    def test_recovers_games(self):
+        service = self.open_journal()
+        game_ids = [self.play(service, turns=x) for x in range(3)]
+        before = [service.games[game_id] for game_id in game_ids]
+        recovered = self.restart()
+        self.assertEqual(3, len(recovered.games))
+        for (game_id, game) in zip(game_ids, before):
+            copy = recovered.games[game_id]
+            self.assertEqual(game.board.to_list(), copy.board.to_list())
+            self.assertEqual(game.markers, copy.markers)
+            self.assertEqual('test', copy.first_player.player_name)
+        # recovered games go on where they stopped
+        game_id = game_ids[2]
+        marker = recovered.games[game_id].first_player.marker
+        area = recovered.games[game_id].board.to_list().index(None) + 1
+        result = recovered.handle_message({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+        self.assertIn(result['message'], ('your_turn', 'gameover'))
+
+    def test_unknown_marker_keeps_game_journaled(self):
+        service = self.open_journal()
+        game_id = self.play(service, turns=0)
+        game = service.games[game_id]
+        area = game.board.to_list().index(None) + 1
+        result = service.handle_message({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': 'Z'})
+        self.assertFalse(result['response']['status'])
+        service.handle_message({'message': 'turn', 'game_id': game_id, 'area': area,
+                                'marker': game.first_player.marker})
+        board = game.board.to_list()
+        self.assertNotIn('Z', board)
+        self.assertEqual(board, self.restart().games[game_id].board.to_list())
+
+    def test_finished_games_are_not_recovered(self):
+        service = self.open_journal()
+        game_id = self.play(service, size=3, turns=0)
+        game = service.games[game_id]
+        while game_id in service.games:
+            area = game.board.to_list().index(None) + 1
+            service.handle_message({'message': 'turn', 'game_id': game_id, 'area': area,
+                                    'marker': game.first_player.marker})
+        self.assertEqual(0, len(self.restart().games))
+
+    def test_snapshot_compacts_log(self):
+        service = self.open_journal(snapshot_records=5)
+        game_ids = [self.play(service) for x in range(5)]
+        self.journals[-1].flush()
+        self.assertLessEqual(len(self.journals[-1].segments()), 2)
+        recovered = self.restart()
+        for game_id in game_ids:
+            self.assertEqual(service.games[game_id].board.to_list(), recovered.games[game_id].board.to_list())
+
+    def test_ignores_torn_tail(self):
+        service = self.open_journal()
+        game_id = self.play(service)
+        journal = self.journals[-1]
+        journal.flush()
+        with open(journal.segment_path(journal.segment), 'ab') as f:
+            f.write(b'\x00\x00\x00\x30garbage')
+        recovered = self.restart()
+        self.assertEqual(service.games[game_id].board.to_list(), recovered.games[game_id].board.to_list())
+
+    def test_group_commit(self):
+        service = self.open_journal()
+        journal = self.journals[-1]
+        journal.flush()
+        with mock.patch('server.persistence.os.fsync') as fsync:
+            with journal.condition:
+                # held so every record below lands in one batch
+                for x in range(20):
+                    service.handle_message({'message': 'start'})
+            journal.flush()
+        self.assertEqual(1, fsync.call_count)
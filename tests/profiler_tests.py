@@ -0,0 +1,70 @@
+import os
+import shutil
+import signal
+import tempfile
+import time
+from unittest import TestCase
+from server.profiler import SamplingProfiler, install_signal
+from server.server import GameService
+
+
+def busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(100))
+
+
+class SamplingProfilerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = SamplingProfiler(self.directory, interval=0.001)
+
+    def tearDown(self):
+        self.profiler.stop()
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path) as f:
+            return [line.rsplit(' ', 1) for line in f.read().splitlines()]
+
+    def test_collapsed_stacks(self):
+        self.assertFalse(self.profiler.running)
+        self.assertTrue(self.profiler.start())
+        self.assertFalse(self.profiler.start())
+        busy(0.1)
+        path = self.profiler.stop()
+        self.assertFalse(self.profiler.running)
+        stacks = self.read(path)
+        self.assertTrue(any('profiler_tests.py:busy' in stack for (stack, count) in stacks))
+        self.assertTrue(all(int(count) > 0 for (stack, count) in stacks))
+
+    def test_time_window(self):
+        self.profiler.start(seconds=0.05)
+        busy(0.2)
+        self.assertFalse(self.profiler.running)
+        self.assertTrue(os.path.exists(self.profiler.last_path))
+
+    def test_signal_toggles(self):
+        if not install_signal(self.profiler):
+            self.skipTest('no SIGUSR1 on this platform')
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertTrue(self.profiler.running)
+            busy(0.05)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertFalse(self.profiler.running)
+            self.assertTrue(os.path.exists(self.profiler.last_path))
+        finally:
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    def test_admin_message(self):
+        service = GameService(profiler=self.profiler, admin_token='secret')
+        self.assertIsNone(service.handle_message({'message': 'profile', 'action': 'start', 'token': 'wrong'}))
+        self.assertIsNone(GameService().handle_message({'message': 'profile', 'action': 'start', 'token': ''}))
+        self.assertFalse(self.profiler.running)
+        result = service.handle_message({'message': 'profile', 'action': 'start', 'token': 'secret'})
+        self.assertTrue(result['response']['running'])
+        busy(0.05)
+        result = service.handle_message({'message': 'profile', 'action': 'stop', 'token': 'secret'})
+        self.assertFalse(result['response']['running'])
+        self.assertTrue(os.path.exists(result['response']['path']))
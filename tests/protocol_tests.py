@@ -0,0 +1,93 @@
+import io
+from unittest import TestCase
+from common.protocol import MAX_MESSAGE_SIZE, BinaryCodec, JsonCodec, encode_message, negotiate, read_message
+
+
+class ProtocolTest(TestCase):
+    def test_round_trip(self):
+        data = {'message': 'turn', 'game_id': 'abc', 'area': 3, 'marker': 'X'}
+        rfile = io.BytesIO(encode_message(data) + encode_message({'message': 'start'}))
+        self.assertEqual(data, read_message(rfile))
+        self.assertEqual({'message': 'start'}, read_message(rfile))
+        self.assertIsNone(read_message(rfile))
+
+    def test_one_line_per_message(self):
+        self.assertEqual(1, encode_message({'name': 'multi\nline'}).count(b'\n'))
+
+    def test_truncated_message(self):
+        with self.assertRaises(ValueError):
+            read_message(io.BytesIO(encode_message({'message': 'start'})[:-1]))
+
+    def test_message_too_long(self):
+        with self.assertRaises(ValueError):
+            read_message(io.BytesIO(b'"' + b'x' * MAX_MESSAGE_SIZE + b'"\n'))
+
+
+class BinaryCodecTest(TestCase):
+    def round_trip(self, data):
+        server = BinaryCodec()
+        client = BinaryCodec()
+        server.register('abc')
+        client.register('abc', 1)
+        return server.read(io.BytesIO(client.encode(data)))
+
+    def test_requests(self):
+        for data in (
+            {'message': 'start', 'size': 15, 'win_length': 5, 'difficulty': 'search'},
+            {'message': 'name', 'game_id': 'abc', 'name': 'Zoë'},
+            {'message': 'turn', 'game_id': 'abc', 'area': 7, 'marker': 'O'},
+            {'message': 'turn', 'game_id': 'abc', 'area': 7, 'marker': 'O', 'seq': 4},
+        ):
+            self.assertEqual(data, self.round_trip(data))
+
+    def test_responses(self):
+        board = [None, 'X', None, 'O', 'X', None, None, None, 'O']
+        for data in (
+            {'message': 'ok_give_name', 'game_id': 'abc'},
+            {'message': 'ok_start_game', 'game_id': 'abc', 'response': {
+                'text': 'Hello', 'marker': 'X', 'board': board, 'size': 3, 'win_length': 3, 'status': True}},
+            {'message': 'your_turn', 'game_id': 'abc', 'response': {'status': False, 'board': board}},
+            {'message': 'your_turn', 'game_id': 'abc', 'response': {
+                'status': True, 'seq': 6, 'since': 4, 'changes': [[200, 'X'], [3, 'O']]}},
+            {'message': 'gameover', 'game_id': 'abc', 'response': {
+                'status': 'gameover', 'reason': 'lose', 'board': [None] * 225}},
+        ):
+            self.assertEqual(data, self.round_trip(data))
+
+    def test_compact_board(self):
+        self.assertEqual(5, len(BinaryCodec.encode_board(['X', None, 'O'] * 3)))
+        data = {'message': 'your_turn', 'game_id': 'abc', 'response': {'status': True, 'board': ['X'] * 9}}
+        self.assertLess(len(BinaryCodec().encode(data)), len(encode_message(data)) // 4)
+
+    def test_json_fallback(self):
+        for data in (
+            {'message': 'turn', 'game_id': 'abc', 'area': -1, 'marker': 'X'},
+            {'message': 'start', 'difficulty': 'unknown'},
+            {'message': 'gameover', 'game_id': 'abc', 'response': {'status': 'gameover'}},
+        ):
+            frame = BinaryCodec().encode(data)
+            self.assertEqual(BinaryCodec.OP_JSON, frame[0])
+            self.assertEqual(data, self.round_trip(data))
+
+    def test_unknown_handles(self):
+        # a game started after the switch is named by its handle on both ends
+        server = BinaryCodec()
+        client = BinaryCodec()
+        reply = client.read(io.BytesIO(server.encode({'message': 'ok_give_name', 'game_id': 'new'})))
+        request = server.read(io.BytesIO(client.encode({'message': 'name', 'game_id': reply['game_id'], 'name': 'a'})))
+        self.assertEqual('new', request['game_id'])
+
+    def test_truncated_frame(self):
+        frame = BinaryCodec().encode({'message': 'start'})
+        self.assertIsNone(BinaryCodec().read(io.BytesIO(b'')))
+        with self.assertRaises(ValueError):
+            BinaryCodec().read(io.BytesIO(frame[:-1]))
+
+    def test_negotiate(self):
+        codec = JsonCodec()
+        response = {'message': 'ok_give_name', 'game_id': 'abc'}
+        self.assertIs(codec, negotiate({'message': 'start'}, dict(response), codec))
+        binary = negotiate({'message': 'start', 'encoding': 'binary'}, response, codec)
+        self.assertIsInstance(binary, BinaryCodec)
+        self.assertEqual('binary', response['encoding'])
+        self.assertEqual('abc', binary.game_id(response['session']))
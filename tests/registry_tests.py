@@ -0,0 +1,135 @@
+import random
+import threading
+from unittest import TestCase
+from server.registry import GameRegistry, GameStore
+from server.server import Game, GameService
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class GameRegistryTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.registry = GameRegistry(max_size=3, ttl=10, clock=self.clock)
+
+    def test_add_and_get(self):
+        self.registry['a'] = 'game a'
+        self.assertEqual('game a', self.registry.get('a'))
+        self.assertEqual('game a', self.registry['a'])
+        self.assertIn('a', self.registry)
+        self.assertIsNone(self.registry.get('b'))
+        with self.assertRaises(KeyError):
+            self.registry['b']
+
+    def test_evicts_least_recently_used(self):
+        for game_id in ('a', 'b', 'c'):
+            self.registry[game_id] = game_id
+        self.registry.get('a')
+        self.registry['d'] = 'd'
+        self.assertNotIn('b', self.registry)
+        for game_id in ('a', 'c', 'd'):
+            self.assertIn(game_id, self.registry)
+        self.assertEqual(1, self.registry.stats()['evicted'])
+
+    def test_expires_idle_games(self):
+        self.registry['a'] = 'a'
+        self.clock.now = 6
+        self.registry['b'] = 'b'
+        self.clock.now = 11
+        self.assertIsNone(self.registry.get('a'))
+        self.assertEqual('b', self.registry.get('b'))
+        self.clock.now = 20
+        self.assertEqual('b', self.registry.get('b'))
+        self.assertEqual({'active': 1, 'evicted': 0, 'expired': 1, 'reaped': 0}, self.registry.stats())
+
+    def test_remove(self):
+        self.registry['a'] = 'a'
+        self.assertEqual('a', self.registry.remove('a'))
+        self.assertIsNone(self.registry.remove('a'))
+        self.assertEqual(0, len(self.registry))
+        self.assertEqual(1, self.registry.stats()['reaped'])
+
+
+class GameServiceRegistryTest(TestCase):
+    def test_finished_game_is_reaped(self):
+        registry = GameRegistry()
+        service = GameService(games=registry)
+        game_id = service.handle_message({'message': 'start'})['game_id']
+        self.assertIsInstance(registry.get(game_id), Game)
+        result = service.handle_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+        marker = result['response']['marker']
+        for area in range(1, 10):
+            if result['message'] == 'gameover':
+                break
+            if result['response']['board'][area - 1] is None:
+                result = service.handle_message({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+        self.assertEqual('gameover', result['message'])
+        self.assertEqual({'active': 0, 'evicted': 0, 'expired': 0, 'reaped': 1}, registry.stats())
+
+
+class GameStoreTest(TestCase):
+    def setUp(self):
+        self.store = GameStore(stripes=4, max_size=8)
+
+    def test_add_get_remove(self):
+        self.store = GameStore(stripes=4, max_size=100)
+        for game_id in ('a', 'b', 'c'):
+            self.store[game_id] = game_id
+        self.assertEqual(3, len(self.store))
+        self.assertEqual('b', self.store.get('b'))
+        self.assertEqual('c', self.store['c'])
+        self.assertEqual('a', self.store.remove('a'))
+        self.assertNotIn('a', self.store)
+        self.assertEqual({'active': 2, 'evicted': 0, 'expired': 0, 'reaped': 1}, self.store.stats())
+
+    def test_bounded_size(self):
+        for x in range(100):
+            self.store[str(x)] = x
+        self.assertLessEqual(len(self.store), 8)
+        self.assertEqual(100 - len(self.store), self.store.stats()['evicted'])
+
+    def test_concurrent_turns_on_one_game(self):
+        service = GameService(games=GameStore(stripes=4))
+        for x in range(20):
+            game_id = service.handle_message({'message': 'start', 'size': 5, 'win_length': 5})['game_id']
+            result = service.handle_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            marker = result['response']['marker']
+            game = service.games.get(game_id)
+            bot_marker = game.second_player.marker
+            bot_started = result['response']['board'].count(bot_marker)
+            accepted = []
+            errors = []
+
+            def hammer():
+                try:
+                    for area in random.sample(range(1, 26), 25):
+                        result = service.handle_message(
+                            {'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker}
+                        )
+                        if result is None:
+                            return
+                        if result['response']['status']:
+                            accepted.append(area)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=hammer) for x in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual([], errors)
+            board = game.board.to_list()
+            # every accepted turn placed exactly one marker and was answered
+            # by exactly one computer move, unless the turn ended the game
+            self.assertEqual(len(accepted), len(set(accepted)))
+            self.assertEqual(len(accepted), board.count(marker))
+            self.assertIn(board.count(bot_marker) - bot_started - len(accepted), (-1, 0))
+            self.assertNotIn(game_id, service.games)
@@ -0,0 +1,47 @@
+from unittest import TestCase
+from server.server import Board, ComputerPlayer
+from server.search import BoundedSearch
+
+
+class BoundedSearchTest(TestCase):
+    def setUp(self):
+        self.board = Board(size=15, win_length=5)
+        self.search = BoundedSearch(self.board.geometry)
+
+    def get_move(self):
+        return self.search.get_move(self.board.get_mask('X'), self.board.get_mask('O'))
+
+    def test_first_move_takes_center(self):
+        self.assertEqual(112, self.get_move())
+
+    def test_takes_win(self):
+        for index in (30, 31, 32, 33):
+            self.board.put_marker_in_area(index, 'X')
+        for index in (60, 61, 62, 63):
+            self.board.put_marker_in_area(index, 'O')
+        self.assertIn(self.get_move(), (29, 34))
+
+    def test_blocks_open_four(self):
+        for index in (60, 61, 62, 63):
+            self.board.put_marker_in_area(index, 'O')
+        self.board.put_marker_in_area(0, 'X')
+        self.assertIn(self.get_move(), (59, 64))
+
+    def test_candidates_stay_near_stones(self):
+        self.board.put_marker_in_area(112, 'O')
+        moves = self.search.candidates(0, self.board.get_mask('O'))
+        self.assertEqual(sorted([96, 97, 98, 111, 113, 126, 127, 128]), sorted(moves))
+
+    def test_computer_player_beats_random_cells(self):
+        bot = ComputerPlayer(name='Bot', marker='X', strategy='search')
+        free = list(reversed(self.board.get_free_indexes()))
+        while True:
+            bot.get_move(self.board)
+            if self.board.is_winner('X'):
+                break
+            self.assertFalse(self.board.is_full())
+            index = free.pop()
+            while not self.board.is_free(index):
+                index = free.pop()
+            self.board.put_marker_in_area(index, 'O')
+            self.assertFalse(self.board.is_winner('O'))
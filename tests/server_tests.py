@@ -1,5 +1,14 @@
+import os
+import resource
+import socket
+import threading
+import time
+from copy import deepcopy
 from unittest import TestCase, mock
-from server.server import Board, HumanPlayer, Player, ComputerPlayer, Game
+from client.client import BoardState, Connection
+from common.protocol import BinaryCodec, encode_message, read_message
+from server.server import Board, BoardGeometry, HumanPlayer, Player, ComputerPlayer, Game, MyTCPServer, \
+    MyTCPServerHandler
 
 
 class BoardTest(TestCase):
@@ -47,6 +56,75 @@ class BoardTest(TestCase):
         with self.assertRaises(ValueError):
             self.board.put_marker_in_area(10, 'X')
 
+    def test_masks_follow_board_view(self):
+        self.board.board[0] = 'X'
+        self.board.put_marker_in_area(4, 'O')
+        self.assertEqual(0b1, self.board.get_mask('X'))
+        self.assertEqual(0b10000, self.board.get_mask('O'))
+        self.assertEqual('O', self.board.board[4])
+
+        self.board.board[0] = None
+        self.assertEqual(0, self.board.get_mask('X'))
+        self.assertEqual([0, 1, 2, 3, 5, 6, 7, 8], self.board.get_free_indexes())
+
+    def test_is_winner(self):
+        for combo in Board.winning_combos:
+            board = Board()
+            for index in combo:
+                self.assertFalse(board.is_winner('X'))
+                board.put_marker_in_area(index, 'X')
+            self.assertTrue(board.is_winner('X'))
+            self.assertFalse(board.is_winner('O'))
+
+    def test_is_full(self):
+        for index in range(8):
+            self.board.put_marker_in_area(index, 'XO'[index % 2])
+        self.assertFalse(self.board.is_full())
+        self.board.put_marker_in_area(8, 'X')
+        self.assertTrue(self.board.is_full())
+
+
+class LargeBoardTest(TestCase):
+    def setUp(self):
+        self.board = Board(size=15, win_length=5)
+
+    def test_geometry(self):
+        geometry = BoardGeometry.get(15, 5)
+        self.assertIs(geometry, self.board.geometry)
+        # 11 starting cells per row and column, 11 * 11 per diagonal direction
+        self.assertEqual(2 * 15 * 11 + 2 * 11 * 11, len(geometry.winning_combos))
+        self.assertEqual(225, len(self.board.board))
+        self.assertEqual([0, 14, 210, 224], self.board.get_free_corners())
+        self.assertEqual([112], self.board.get_free_center())
+
+    def test_is_winner_checks_last_move(self):
+        for index in (20, 36, 52, 68):
+            self.board.put_marker_in_area(index, 'X')
+            self.assertFalse(self.board.is_winner('X'))
+        self.board.put_marker_in_area(84, 'X')
+        self.assertTrue(self.board.is_winner('X'))
+        self.assertFalse(self.board.is_winner('O'))
+
+    def test_no_wrap_around_rows(self):
+        for index in (12, 13, 14, 15, 16):
+            self.board.put_marker_in_area(index, 'O')
+        self.assertFalse(self.board.is_winner('O'))
+
+    def test_put_marker_in_area_throw_exception(self):
+        with self.assertRaises(ValueError):
+            self.board.put_marker_in_area(225, 'X')
+
+    def test_deepcopy_shares_geometry_only(self):
+        self.board.put_marker_in_area(20, 'X')
+        self.board.board
+        copy = deepcopy(self.board)
+        self.assertIs(self.board.geometry, copy.geometry)
+        copy.put_marker_in_area(21, 'O')
+        self.assertEqual('O', copy.board[21])
+        self.assertIsNone(self.board.board[21])
+        self.assertEqual([(20, 'X')], self.board.moves)
+        self.assertEqual([(20, 'X'), (21, 'O')], copy.moves)
+
 
 class HumanPlayerTest(TestCase):
     def setUp(self):
@@ -100,6 +178,29 @@ class ComputerPlayerTest(TestCase):
             [self.board.board[0], self.board.board[2], self.board.board[6], self.board.board[8]]
         )
 
+    def test_get_move_strategies_agree(self):
+        # win beats block: computer has 3, 5 and player has 0, 1
+        cells = [self.player.marker, self.player.marker, None, self.comp_player.marker, None,
+                 self.comp_player.marker, None, None, None]
+        for strategy in ComputerPlayer.strategies:
+            board = Board()
+            board.board[:] = cells
+            ComputerPlayer(name='Bot', marker='X', strategy=strategy).get_move(board)
+            self.assertEqual(self.comp_player.marker, board.board[4])
+            self.assertIsNone(board.board[2])
+
+    def test_get_move_does_not_copy_board(self):
+        self.board.board[0] = self.player.marker
+        self.board.board[2] = self.player.marker
+        with mock.patch('server.server.deepcopy') as deepcopy:
+            self.comp_player.get_move(self.board)
+        self.assertEqual(0, deepcopy.call_count)
+        self.assertEqual(self.comp_player.marker, self.board.board[1])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            ComputerPlayer(name='Bot', marker='X', strategy='unknown')
+
 
 class GameTest(TestCase):
     def setUp(self):
@@ -109,6 +210,65 @@ class GameTest(TestCase):
         self.assertEqual('testid', self.game.game_id)
         self.assertTrue(isinstance(self.game.board, Board))
 
+    def test_turn_board_includes_computer_move(self):
+        self.game.register_player(name='test')
+        marker = self.game.first_player.marker
+        before = self.game.board.to_list()
+        area = before.index(None) + 1
+        response = self.game.turn(area, marker)
+        self.assertEqual(self.game.board.to_list(), response['board'])
+        if response['status'] is True:
+            self.assertEqual(before.count(None) - 2, response['board'].count(None))
+
+    def test_delta_updates(self):
+        game = Game('testid', size=15, win_length=5, updates='delta')
+        response = game.register_player(name='test')
+        board = response['board']
+        marker = game.first_player.marker
+        area = board.index(None) + 1
+        result = game.turn(area, marker, response['seq'])
+        self.assertNotIn('board', result)
+        self.assertEqual(response['seq'], result['since'])
+        self.assertEqual(response['seq'] + 2, result['seq'])
+        self.assertEqual(area - 1, result['changes'][0][0])
+        for (index, changed) in result['changes']:
+            board[index] = changed
+        self.assertEqual(game.board.to_list(), board)
+        # a client that missed moves gets them again by acknowledging an older seq
+        result = game.turn(0, marker, response['seq'])
+        self.assertFalse(result['status'])
+        self.assertEqual(2, len(result['changes']))
+        self.assertEqual(game.board.to_list(), game.sync()['board'])
+        with self.assertRaises(ValueError):
+            Game('testid', updates='sometimes')
+
+    def test_board_size(self):
+        game = Game('testid', size=15, win_length=5)
+        self.assertEqual(225, len(game.board.board))
+        self.assertEqual('search', game.difficulty)
+        game.register_player(name='test')
+        response = game.turn(225, game.first_player.marker)
+        self.assertTrue(response['status'])
+        self.assertEqual(game.first_player.marker, response['board'][224])
+        self.assertFalse(game.turn(226, game.first_player.marker)['status'])
+
+    def test_board_size_validation(self):
+        with self.assertRaises(ValueError):
+            Game('testid', size=2)
+        with self.assertRaises(ValueError):
+            Game('testid', size=5, win_length=6)
+        with self.assertRaises(ValueError):
+            Game('testid', difficulty='perfect', size=4)
+
+    def test_difficulty_selects_strategy(self):
+        game = Game('testid', difficulty='perfect')
+        game.register_player(name='test')
+        self.assertEqual('perfect', game.second_player.strategy)
+        self.game.register_player(name='test')
+        self.assertEqual('bitboard', self.game.second_player.strategy)
+        with self.assertRaises(ValueError):
+            Game('testid', difficulty='impossible')
+
     @mock.patch.object(ComputerPlayer, 'get_move')
     @mock.patch.object(Game, 'draw_first_player')
     def test_register_player(self, draw_first_player, get_move):
@@ -149,6 +309,14 @@ class GameTest(TestCase):
         self.assertEqual(False, response['status'])
 
 
+    def test_turn_refuses_unknown_marker(self):
+        self.game.register_player(name='test')
+        moves = list(self.game.board.moves)
+        area = self.game.board.to_list().index(None) + 1
+        response = self.game.turn(area, 'Z')
+        self.assertFalse(response['status'])
+        self.assertEqual(moves, self.game.board.moves)
+
     @mock.patch.object(Board, 'put_marker_in_area')
     @mock.patch.object(Board, 'is_free')
     @mock.patch.object(Player, 'is_winner')
@@ -221,4 +389,274 @@ class GameTest(TestCase):
 
 
 class MyTCPServerHandlerTest(TestCase):
-    pass
\ No newline at end of file
+    def setUp(self):
+        self.server = MyTCPServer(('127.0.0.1', 0), MyTCPServerHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.socket = socket.create_connection(self.server.server_address)
+        self.rfile = self.socket.makefile('rb')
+
+    def tearDown(self):
+        self.rfile.close()
+        self.socket.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, data):
+        self.socket.sendall(encode_message(data))
+        return read_message(self.rfile)
+
+    def test_whole_game_over_one_connection(self):
+        result = self.request({'message': 'start'})
+        self.assertEqual('ok_give_name', result['message'])
+        game_id = result['game_id']
+        result = self.request({'message': 'name', 'game_id': game_id, 'name': 'test'})
+        self.assertEqual('ok_start_game', result['message'])
+        marker = result['response']['marker']
+        for area in range(1, 10):
+            if result['message'] == 'gameover':
+                break
+            if result['response']['board'][area - 1] is None:
+                result = self.request({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+                self.assertIn(result['message'], ('your_turn', 'gameover'))
+        self.assertEqual('gameover', result['message'])
+
+    def test_failed_requests_get_error_replies(self):
+        self.socket.settimeout(5)
+        for data in ({'message': 'start', 'size': 25}, {'message': 'start', 'difficulty': 'unknown'}):
+            result = self.request(data)
+            self.assertEqual(('error', 'invalid'), (result['message'], result['response']['reason']))
+        for message in ('name', 'turn', 'sync'):
+            result = self.request({'message': message, 'game_id': 'unknown', 'name': 'test', 'area': 1, 'marker': 'X'})
+            self.assertEqual(('error', 'unknown_game'), (result['message'], result['response']['reason']))
+            self.assertEqual('unknown', result['game_id'])
+        # a finished game is gone
+        game_id = self.request({'message': 'start'})['game_id']
+        result = self.request({'message': 'name', 'game_id': game_id, 'name': 'test'})
+        marker = result['response']['marker']
+        while result['message'] != 'gameover':
+            area = result['response']['board'].index(None) + 1
+            result = self.request({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+        result = self.request({'message': 'turn', 'game_id': game_id, 'area': 1, 'marker': marker})
+        self.assertEqual(('error', 'unknown_game'), (result['message'], result['response']['reason']))
+        # the connection still serves new games
+        self.assertEqual('ok_give_name', self.request({'message': 'start'})['message'])
+
+    def test_message_that_is_not_an_object(self):
+        self.socket.settimeout(5)
+        self.socket.sendall(b'[1, 2]\n' + encode_message({'message': 'start'}))
+        result = read_message(self.rfile)
+        self.assertEqual(('error', 'invalid'), (result['message'], result['response']['reason']))
+        self.assertEqual('ok_give_name', read_message(self.rfile)['message'])
+
+    def test_pipelined_requests(self):
+        self.socket.sendall(encode_message({'message': 'start'}) * 3)
+        game_ids = set(read_message(self.rfile)['game_id'] for x in range(3))
+        self.assertEqual(3, len(game_ids))
+
+    def test_message_split_across_segments(self):
+        payload = encode_message({'message': 'start', 'size': 15, 'win_length': 5})
+        self.socket.sendall(payload[:5])
+        self.socket.sendall(payload[5:])
+        result = read_message(self.rfile)
+        game_id = result['game_id']
+        result = self.request({'message': 'name', 'game_id': game_id, 'name': 'x' * 2000})
+        self.assertEqual(225, len(result['response']['board']))
+
+    def test_multiplexed_requests(self):
+        # many games interleaved on one connection, replies matched by request_id
+        game_ids = {}
+        for request_id in range(20):
+            self.socket.sendall(encode_message({'message': 'start', 'request_id': request_id}))
+        for x in range(20):
+            result = read_message(self.rfile)
+            self.assertEqual('ok_give_name', result['message'])
+            game_ids[result['request_id']] = result['game_id']
+        self.assertEqual(set(range(20)), set(game_ids))
+        self.assertEqual(20, len(set(game_ids.values())))
+        for (request_id, game_id) in game_ids.items():
+            self.socket.sendall(encode_message({
+                'message': 'name', 'game_id': game_id, 'name': 'test', 'request_id': 'name-%s' % request_id,
+            }))
+        self.socket.sendall(encode_message({'message': 'turn', 'game_id': 'unknown', 'request_id': 'lost'}))
+        replies = {}
+        for x in range(21):
+            result = read_message(self.rfile)
+            replies[result['request_id']] = result
+        self.assertEqual('error', replies['lost']['message'])
+        for (request_id, game_id) in game_ids.items():
+            self.assertEqual(game_id, replies['name-%s' % request_id]['game_id'])
+            self.assertEqual('ok_start_game', replies['name-%s' % request_id]['message'])
+
+    def test_human_opponents_get_pushes(self):
+        other = socket.create_connection(self.server.server_address)
+        other_rfile = other.makefile('rb')
+        try:
+            game_id = self.request({'message': 'start', 'opponent': 'human'})['game_id']
+            result = self.request({'message': 'name', 'game_id': game_id, 'name': 'first'})
+            self.assertEqual('waiting', result['message'])
+            other.sendall(encode_message({'message': 'start', 'opponent': 'human'}))
+            other_id = read_message(other_rfile)['game_id']
+            other.sendall(encode_message({'message': 'name', 'game_id': other_id, 'name': 'second'}))
+            self.assertEqual('ok_start_game', read_message(other_rfile)['message'])
+            # the waiting player is told without asking
+            result = read_message(self.rfile)
+            self.assertEqual(('ok_start_game', game_id), (result['message'], result['game_id']))
+            if result['response']['your_move']:
+                self.socket.sendall(encode_message({'message': 'turn', 'game_id': game_id, 'area': 5}))
+                self.assertEqual('opponent_turn', read_message(self.rfile)['message'])
+                result = read_message(other_rfile)
+            else:
+                other.sendall(encode_message({'message': 'turn', 'game_id': other_id, 'area': 5}))
+                self.assertEqual('opponent_turn', read_message(other_rfile)['message'])
+                result = read_message(self.rfile)
+            self.assertEqual('your_turn', result['message'])
+            self.assertIsNotNone(result['response']['board'][4])
+        finally:
+            other_rfile.close()
+            other.close()
+        # the player left behind is told the game is over
+        result = read_message(self.rfile)
+        self.assertEqual(('gameover', 'abandoned'), (result['message'], result['response']['reason']))
+
+    def test_watchers_get_every_board(self):
+        game_id = self.request({'message': 'start'})['game_id']
+        watcher = socket.create_connection(self.server.server_address)
+        watcher_rfile = watcher.makefile('rb')
+        try:
+            watcher.sendall(encode_message({'message': 'watch', 'game_id': game_id}))
+            result = read_message(watcher_rfile)
+            self.assertEqual(('watching', 0), (result['message'], result['response']['seq']))
+            result = self.request({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            marker = result['response']['marker']
+            for area in range(1, 10):
+                if result['message'] == 'gameover':
+                    break
+                if result['response']['board'][area - 1] is None:
+                    result = self.request({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+                    update = read_message(watcher_rfile)
+                    self.assertEqual('game_update', update['message'])
+                    self.assertEqual(result['response']['board'], update['response']['board'])
+            self.assertEqual('gameover', update['response']['status'])
+            self.assertIn('winner', update['response'])
+            # the stream is over, the connection answers requests again
+            watcher.sendall(encode_message({'message': 'start'}))
+            self.assertEqual('ok_give_name', read_message(watcher_rfile)['message'])
+        finally:
+            watcher_rfile.close()
+            watcher.close()
+
+    def test_watch_on_high_descriptor(self):
+        # select() refuses descriptors from 1024 up
+        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1200:
+            self.skipTest('not allowed to open enough files')
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1200), hard))
+        spare = [os.open(os.devnull, os.O_RDONLY) for x in range(1100)]
+        try:
+            game_id = self.request({'message': 'start'})['game_id']
+            with socket.create_connection(self.server.server_address) as watcher:
+                watcher.settimeout(5)
+                with watcher.makefile('rb') as watcher_rfile:
+                    watcher.sendall(encode_message({'message': 'watch', 'game_id': game_id}))
+                    self.assertEqual('watching', read_message(watcher_rfile)['message'])
+                    watcher.sendall(encode_message({'message': 'start'}))
+                    self.assertEqual('ok_give_name', read_message(watcher_rfile)['message'])
+        finally:
+            for fd in spare:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def test_watch_with_invalid_game_id(self):
+        self.socket.settimeout(5)
+        result = self.request({'message': 'watch', 'game_id': ['x']})
+        self.assertEqual(('error', 'unknown_game'), (result['message'], result['response']['reason']))
+        self.assertEqual('ok_give_name', self.request({'message': 'start'})['message'])
+
+    def test_binary_watcher_gets_error(self):
+        with Connection(*self.server.server_address, exit_on_error=False) as connection:
+            connection.send_message({'message': 'start', 'encoding': 'binary'})
+            game_id = connection.retrieve_message()['game_id']
+            connection.socket.settimeout(5)
+            connection.send_message({'message': 'watch', 'game_id': game_id})
+            result = connection.retrieve_message()
+            self.assertEqual(('error', 'unsupported'), (result['message'], result['response']['reason']))
+
+    def test_binary_encoding(self):
+        with Connection(*self.server.server_address, exit_on_error=False) as connection:
+            connection.send_message({'message': 'start', 'encoding': 'binary'})
+            result = connection.retrieve_message()
+            self.assertEqual('binary', result['encoding'])
+            self.assertIsInstance(connection.codec, BinaryCodec)
+            game_id = result['game_id']
+            connection.send_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            result = connection.retrieve_message()
+            self.assertEqual('ok_start_game', result['message'])
+            marker = result['response']['marker']
+            for area in range(1, 10):
+                if result['message'] == 'gameover':
+                    break
+                if result['response']['board'][area - 1] is None:
+                    connection.send_message({'message': 'turn', 'game_id': game_id, 'area': area, 'marker': marker})
+                    result = connection.retrieve_message()
+                    self.assertIn(result['message'], ('your_turn', 'gameover'))
+            self.assertEqual('gameover', result['message'])
+            # later games on the connection stay binary
+            connection.send_message({'message': 'start', 'updates': 'delta'})
+            game_id = connection.retrieve_message()['game_id']
+            connection.send_message({'message': 'name', 'game_id': game_id, 'name': 'test'})
+            state = BoardState()
+            response = connection.retrieve_message()['response']
+            self.assertTrue(state.apply(response))
+            marker = response['marker']
+            connection.send_message(state.turn_message(game_id, state.board.index(None) + 1, marker))
+            result = connection.retrieve_message()
+            self.assertIn('changes', result['response'])
+            self.assertTrue(state.apply(result['response']))
+            connection.send_message({'message': 'sync', 'game_id': game_id})
+            self.assertEqual(state.board, connection.retrieve_message()['response']['board'])
+            connection.send_message({'message': 'start'})
+            self.assertEqual('ok_give_name', connection.retrieve_message()['message'])
+
+class SmallBufferHandler(MyTCPServerHandler):
+    def setup(self):
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        super(SmallBufferHandler, self).setup()
+
+
+class StalledPeerTest(TestCase):
+    def setUp(self):
+        self.server = MyTCPServer(('127.0.0.1', 0), SmallBufferHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @mock.patch.object(MyTCPServer, 'multiplex_workers', 4)
+    def test_peer_not_reading_stalls_nobody_else(self):
+        stalled = socket.socket()
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(self.server.server_address)
+        with stalled, stalled.makefile('rb') as stalled_rfile:
+            stalled.sendall(encode_message({'message': 'start', 'size': 19, 'win_length': 5}))
+            game_id = read_message(stalled_rfile)['game_id']
+            # far more board replies than the socket buffers hold, none of them read
+            sync = b''.join(
+                encode_message({'message': 'sync', 'game_id': game_id, 'request_id': request_id})
+                for request_id in range(300)
+            )
+            stalled.setblocking(False)
+            try:
+                stalled.send(sync)
+            except BlockingIOError:
+                pass
+            time.sleep(0.2)
+            with socket.create_connection(self.server.server_address, timeout=5) as other:
+                with other.makefile('rb') as other_rfile:
+                    for request_id in range(10):
+                        other.sendall(encode_message({'message': 'start', 'request_id': request_id}))
+                        self.assertEqual(request_id, read_message(other_rfile)['request_id'])
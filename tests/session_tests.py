@@ -0,0 +1,56 @@
+import re
+import threading
+from unittest import TestCase, mock
+from server.registry import GameRegistry, GameStore
+from server.server import Game, GameService
+from server.session import SHARD_TAGS, SessionIds, shard_of
+
+
+class SessionIdsTest(TestCase):
+    def test_ids_are_compact_and_unique(self):
+        ids = SessionIds()
+        generated = set(ids.new_id() for x in range(10000))
+        self.assertEqual(10000, len(generated))
+        for game_id in generated:
+            self.assertRegex(game_id, re.compile(r'^[A-Za-z0-9_-]{20}$'))
+
+    def test_shard_tag(self):
+        for shard in (0, 5, len(SHARD_TAGS) - 1):
+            game_id = SessionIds(shard).new_id()
+            self.assertEqual(20, len(game_id))
+            self.assertEqual(SHARD_TAGS[shard], game_id[0])
+            self.assertEqual(shard, shard_of(game_id, len(SHARD_TAGS)))
+        with self.assertRaises(ValueError):
+            SessionIds(len(SHARD_TAGS))
+
+    def test_insert_skips_taken_ids(self):
+        games = GameStore()
+        ids = SessionIds()
+        games['taken'] = 'old game'
+        game = Game(None)
+        with mock.patch.object(ids, 'new_id', side_effect=['taken', 'taken', 'free']):
+            self.assertEqual(('free', 2), ids.insert(games, game))
+        self.assertEqual('free', game.game_id)
+        self.assertEqual('old game', games['taken'])
+        self.assertIs(game, games['free'])
+
+    def test_registry_insert(self):
+        registry = GameRegistry()
+        self.assertTrue(registry.insert('a', 'first'))
+        self.assertFalse(registry.insert('a', 'second'))
+        self.assertEqual('first', registry['a'])
+
+    def test_concurrent_starts(self):
+        service = GameService(GameStore())
+        game_ids = []
+
+        def start():
+            for x in range(200):
+                game_ids.append(service.handle_message({'message': 'start'})['game_id'])
+        threads = [threading.Thread(target=start) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1600, len(set(game_ids)))
+        self.assertEqual(1600, len(service.games))
@@ -0,0 +1,77 @@
+import random
+from unittest import TestCase, skipIf
+from server.server import Board, ComputerPlayer
+from server.simulation import BatchSimulator, np, simulate
+
+
+@skipIf(np is None, 'numpy is not installed')
+class BatchSimulatorTest(TestCase):
+    def setUp(self):
+        self.simulator = BatchSimulator(seed=7)
+
+    def random_positions(self, count):
+        # (own, opponent) masks of unfinished positions with own to move
+        positions = []
+        rng = random.Random(3)
+        while len(positions) < count:
+            board = Board()
+            cells = rng.sample(range(9), rng.randint(0, 7))
+            for (step, index) in enumerate(cells):
+                board.put_marker_in_area(index, 'XO'[step % 2])
+            own = board.get_mask('XO'[len(cells) % 2])
+            opponent = board.get_mask('XO'[(len(cells) + 1) % 2])
+            if not (Board.winning[own] or Board.winning[opponent]):
+                positions.append((own, opponent))
+        return positions
+
+    def arrays(self, positions):
+        return (np.array([own for (own, opponent) in positions], dtype=np.int32),
+                np.array([opponent for (own, opponent) in positions], dtype=np.int32))
+
+    def test_moves_are_legal(self):
+        positions = self.random_positions(500)
+        (own, opponent) = self.arrays(positions)
+        for strategy in BatchSimulator.strategies:
+            moves = getattr(self.simulator, 'move_' + strategy)(own, opponent)
+            for ((own_mask, opponent_mask), move) in zip(positions, moves):
+                self.assertFalse((own_mask | opponent_mask) >> int(move) & 1)
+
+    def test_bitboard_matches_computer_player_on_forced_moves(self):
+        positions = self.random_positions(500)
+        (own, opponent) = self.arrays(positions)
+        moves = self.simulator.move_bitboard(own, opponent)
+        player = ComputerPlayer(name='Bot', marker='X')
+        for ((own_mask, opponent_mask), move) in zip(positions, moves):
+            board = Board()
+            board.masks = {'X': own_mask, 'O': opponent_mask}
+            expected = player.find_move_bitboard(board)
+            free = [index for index in range(9) if not (own_mask | opponent_mask) >> index & 1]
+            if any(Board.winning[mask | 1 << index] for mask in (own_mask, opponent_mask) for index in free):
+                self.assertEqual(expected, int(move))
+
+    def test_perfect_matches_solver(self):
+        positions = self.random_positions(300)
+        (own, opponent) = self.arrays(positions)
+        moves = self.simulator.move_perfect(own, opponent)
+        solver = ComputerPlayer.get_solver()
+        for ((own_mask, opponent_mask), move) in zip(positions, moves):
+            self.assertEqual(solver.get_move(own_mask, opponent_mask), int(move))
+
+    def test_play_results(self):
+        results = self.simulator.play('perfect', 'perfect', 1000)
+        self.assertTrue((results == 0).all())
+
+    def test_simulate(self):
+        result = simulate('perfect', 'random', 20000, seed=1)
+        self.assertEqual(20000, result['wins'] + result['draws'] + result['losses'])
+        self.assertEqual(0, result['losses'])
+        self.assertGreater(result['win_rate'], 0.8)
+
+    def test_simulate_in_processes(self):
+        result = simulate('bitboard', 'random', 10001, processes=2, seed=1)
+        self.assertEqual(10001, result['wins'] + result['draws'] + result['losses'])
+        self.assertGreater(result['win_rate'], 0.8)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            simulate('search', 'random', 10)
@@ -0,0 +1,68 @@
+import os
+import random
+import tempfile
+from unittest import TestCase
+from server.server import Board, ComputerPlayer
+from server.solver import PerfectPlaySolver
+
+
+class PerfectPlaySolverTest(TestCase):
+    def setUp(self):
+        self.solver = ComputerPlayer.get_solver()
+
+    def play(self, players, marker):
+        board = Board()
+        while True:
+            players[marker].get_move(board)
+            if board.is_winner(marker):
+                return marker
+            if board.is_full():
+                return None
+            marker = 'O' if marker == 'X' else 'X'
+
+    def test_symmetries_are_permutations(self):
+        self.assertEqual(8, len(set(PerfectPlaySolver.symmetries)))
+        for permutation in PerfectPlaySolver.symmetries:
+            self.assertEqual(list(range(9)), sorted(permutation))
+
+    def test_takes_win_before_block(self):
+        board = Board()
+        board.board[:] = ['O', 'O', None, 'X', None, 'X', None, None, None]
+        self.assertEqual(4, self.solver.get_move(board.get_mask('X'), board.get_mask('O')))
+
+    def test_blocks(self):
+        board = Board()
+        board.board[:] = ['O', None, 'O', None, 'X', None, None, None, None]
+        self.assertEqual(1, self.solver.get_move(board.get_mask('X'), board.get_mask('O')))
+
+    def test_perfect_play_draws_itself(self):
+        for first in ('X', 'O'):
+            players = {
+                'X': ComputerPlayer(name='X', marker='X', strategy='perfect'),
+                'O': ComputerPlayer(name='O', marker='O', strategy='perfect'),
+            }
+            self.assertIsNone(self.play(players, first))
+
+    def test_perfect_play_never_loses(self):
+        class RandomPlayer(ComputerPlayer):
+            def find_move_bitboard(self, board_obj):
+                return random.choice(board_obj.get_free_indexes())
+
+        for marker in ('X', 'O'):
+            opponent = 'O' if marker == 'X' else 'X'
+            players = {
+                marker: ComputerPlayer(name='Bot', marker=marker, strategy='perfect'),
+                opponent: RandomPlayer(name='Random', marker=opponent),
+            }
+            for x in range(200):
+                self.assertNotEqual(opponent, self.play(players, random.choice('XO')))
+
+    def test_save_and_load(self):
+        (handle, path) = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.solver.save(path)
+            loaded = PerfectPlaySolver.load(Board.winning, path)
+        finally:
+            os.remove(path)
+        self.assertEqual(self.solver.table, loaded.table)
@@ -0,0 +1,72 @@
+import threading
+from unittest import TestCase
+from server.registry import GameStore
+from server.server import GameService
+from server.spectators import Spectators, Subscriber
+
+
+class SubscriberTest(TestCase):
+    def test_drop_keeps_the_latest_updates(self):
+        subscriber = Subscriber('game', buffer=2, policy='drop')
+        for seq in range(1, 5):
+            subscriber.offer(b'%d' % seq, seq)
+        self.assertEqual([b'3', b'4'], subscriber.take(0))
+        self.assertEqual(2, subscriber.dropped)
+        self.assertFalse(subscriber.finished)
+
+    def test_disconnect_closes_a_full_buffer(self):
+        subscriber = Subscriber('game', buffer=2, policy='disconnect')
+        for seq in range(1, 4):
+            subscriber.offer(b'%d' % seq, seq)
+        self.assertTrue(subscriber.closed)
+        self.assertTrue(subscriber.finished)
+        self.assertEqual([], subscriber.take(0))
+
+    def test_updates_older_than_the_board_are_skipped(self):
+        subscriber = Subscriber('game', since=4)
+        subscriber.offer(b'old', 3)
+        subscriber.offer(b'new', 5)
+        self.assertEqual([b'new'], subscriber.take(0))
+
+    def test_end_after_the_buffered_updates(self):
+        subscriber = Subscriber('game')
+        subscriber.offer(b'last', 1)
+        subscriber.end()
+        self.assertFalse(subscriber.finished)
+        self.assertEqual([b'last'], subscriber.take())
+        self.assertTrue(subscriber.finished)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Subscriber('game', policy='block')
+
+
+class SpectatorsTest(TestCase):
+    def test_update_is_encoded_once_for_every_watcher(self):
+        spectators = Spectators()
+        woken = threading.Semaphore(0)
+        subscribers = [spectators.subscribe('game', wake=woken.release) for x in range(100)]
+        other = spectators.subscribe('other')
+        spectators.publish('game', {'message': 'game_update', 'game_id': 'game'}, 1, last=True)
+        for x in range(200):
+            self.assertTrue(woken.acquire(timeout=5))
+        payloads = [subscriber.take(0) for subscriber in subscribers]
+        self.assertTrue(all(payload[0] is payloads[0][0] for payload in payloads))
+        self.assertTrue(all(subscriber.finished for subscriber in subscribers))
+        self.assertEqual([], other.take(0))
+        for subscriber in subscribers:
+            spectators.unsubscribe(subscriber)
+        self.assertNotIn('game', spectators)
+        self.assertIn('other', spectators)
+        spectators.close()
+
+    def test_watch_needs_a_live_game(self):
+        service = GameService(games=GameStore())
+        (response, subscriber) = service.watch({'message': 'watch', 'game_id': 'unknown'})
+        self.assertEqual(('error', 'unknown_game'), (response['message'], response['response']['reason']))
+        self.assertIsNone(subscriber)
+        (response, subscriber) = service.watch({'message': 'watch', 'game_id': ['x']})
+        self.assertEqual(('error', 'unknown_game'), (response['message'], response['response']['reason']))
+        self.assertIsNone(subscriber)
+        (response, subscriber) = service.watch({'message': 'watch', 'game_id': 'unknown', 'request_id': 7})
+        self.assertEqual(('error', 7), (response['message'], response['request_id']))
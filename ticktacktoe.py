@@ -1,15 +1,195 @@
-from client.client import *
-from server.server import *
-
-select = int(input('You want start server(0) or client(1): '))
-if select == 0:
-    IP = '127.0.0.1'
-    PORT = 13373
-    print('Server starts on %s:%s' % (IP, PORT))
-    server = MyTCPServer(('127.0.0.1', 13373), MyTCPServerHandler)
-    server.serve_forever()
-elif select == 1:
-    server = input('Server IP: ')
-    port = int(input('Port: '))
-    c = Client(server, port)
-    c.run()
\ No newline at end of file
+import argparse
+import os
+import sys
+import time
+
+# startup is measured from here, every subsystem is imported by the command that needs it
+STARTED = time.perf_counter()
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 13373
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='ticktacktoe', description='Tic Tac Toe server and client')
+    parser.add_argument('--log-file', default='logs.log')
+    levels = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+    parser.add_argument('--log-level', choices=levels, default='DEBUG')
+    parser.add_argument('--message-log-level', choices=levels, help='level of the one line per message logs')
+    parser.add_argument('--message-sample-rate', type=float, default=1.0,
+                        help='fraction of the per-message logs below WARNING that are written')
+    commands = parser.add_subparsers(dest='command')
+
+    server = commands.add_parser('server', help='start the game server')
+    server.add_argument('--host', default=DEFAULT_HOST)
+    server.add_argument('--port', type=int, default=DEFAULT_PORT, help='0 picks a free port')
+    server.add_argument('--workers', type=int, default=1, help='worker processes, each owning a shard of the games')
+    server.add_argument('--backend', choices=('threading', 'asyncio'), default='threading')
+    server.add_argument('--journal', help='directory for durable game state, games stay in memory only without it')
+    server.add_argument('--metrics-port', type=int, default=0, help='Prometheus metrics HTTP port, 0 for none')
+    server.add_argument('--history', help='file recording every finished game, read with python -m server.history')
+    # admission control, 0 switches a limit off
+    server.add_argument('--max-connections', type=int, default=10000, help='concurrent connections per process')
+    server.add_argument('--max-queue', type=int, default=1024, help='requests waiting for the worker pool')
+    server.add_argument('--start-rate', type=float, default=0, help='start messages per second per client address')
+    server.add_argument('--start-burst', type=float, default=0, help='start messages a client can send at once')
+    server.add_argument('--turn-rate', type=float, default=0, help='turn messages per second per client address')
+    server.add_argument('--turn-burst', type=float, default=0, help='turn messages a client can send at once')
+
+    client = commands.add_parser('client', help='play against the server')
+    client.add_argument('--host', default=DEFAULT_HOST)
+    client.add_argument('--port', type=int, default=DEFAULT_PORT)
+    client.add_argument('--size', type=int, default=3)
+    client.add_argument('--win-length', type=int, default=3)
+    client.add_argument('--difficulty')
+    client.add_argument('--encoding', choices=('json', 'binary'))
+    client.add_argument('--updates', choices=('full', 'delta'))
+    client.add_argument('--opponent', choices=('computer', 'human'), help='human waits for another player')
+    return parser
+
+
+def ready(address):
+    print('Server ready on %s:%s in %.1f ms' % (address[0], address[1], (time.perf_counter() - STARTED) * 1000))
+    sys.stdout.flush()
+
+
+def warm_solver():
+    # the perfect play table loads after the server listens, not before
+    import threading
+    from server.server import ComputerPlayer
+    thread = threading.Thread(target=ComputerPlayer.get_solver, name='SolverWarmup')
+    thread.daemon = True
+    thread.start()
+
+
+def admission_limits(args):
+    # AdmissionControl arguments, None for the limits switched off
+    return {
+        key: getattr(args, key) or None
+        for key in ('max_connections', 'max_queue', 'start_rate', 'start_burst', 'turn_rate', 'turn_burst')
+    }
+
+
+def log_options(args):
+    # setup_logging arguments
+    return {
+        'filename': args.log_file,
+        'level': args.log_level,
+        'message_level': args.message_log_level,
+        'sample_rate': args.message_sample_rate,
+    }
+
+
+def run_server(args):
+    limits = admission_limits(args)
+    if args.workers > 1:
+        from server.cluster import ShardedServer
+        server = ShardedServer(
+            (args.host, args.port), args.workers, args.journal, args.metrics_port, limits, args.history,
+            log_options=log_options(args),
+        )
+        server.start_workers()
+        ready(server.server_address)
+        server.serve_forever()
+        return
+
+    from server.admission import AdmissionControl
+    from server.server import GameService
+    from server.profiler import SamplingProfiler, install_signal
+    if args.metrics_port:
+        from server.metrics_http import serve
+        # metrics and the profiler toggle stay on localhost whatever --host is
+        serve(args.metrics_port)
+    journal = None
+    if args.journal:
+        from server.persistence import GameJournal
+        journal = GameJournal.open(args.journal)
+    history = None
+    if args.history:
+        from server.history import GameHistory
+        history = GameHistory.open(args.history)
+    # kill -USR1 <pid>, or a profile message carrying the admin token,
+    # switches the sampling profiler on and off
+    profiler = SamplingProfiler()
+    install_signal(profiler)
+    service = GameService(
+        journal=journal, profiler=profiler, admin_token=os.environ.get('TICKTACKTOE_ADMIN_TOKEN'), history=history,
+    )
+
+    if args.backend == 'asyncio':
+        import asyncio
+        from server.async_server import AsyncGameServer
+        server = AsyncGameServer(args.host, args.port, service, admission=AdmissionControl(**limits))
+
+        async def serve():
+            await server.start()
+            ready(server.server_address)
+            warm_solver()
+            await server.serve_forever()
+        try:
+            asyncio.run(serve())
+        finally:
+            server.close()
+    else:
+        from server.server import MyTCPServer, MyTCPServerHandler
+        server = MyTCPServer(
+            (args.host, args.port), MyTCPServerHandler, service=service, admission=AdmissionControl(**limits)
+        )
+        ready(server.server_address)
+        warm_solver()
+        server.serve_forever()
+
+
+def run_client(args):
+    from client.client import Client
+    client = Client(
+        args.host, args.port, args.size, args.win_length, args.difficulty,
+        encoding=args.encoding, updates=args.updates, opponent=args.opponent,
+    )
+    client.run()
+
+
+def ask(args):
+    # the old interactive questions, for runs without a command
+    select = int(input('You want start server(0) or client(1): '))
+    if select == 0:
+        # the limits and the rest keep their command line defaults
+        options = args
+        args = build_parser().parse_args(['server'])
+        for key in ('log_file', 'log_level', 'message_log_level', 'message_sample_rate'):
+            setattr(args, key, getattr(options, key))
+        backend = int(input('Server backend, threading(0) or asyncio(1) [0]: ').strip() or '0')
+        args.backend = ('threading', 'asyncio')[backend]
+        if args.backend == 'threading':
+            args.workers = int(input('Worker processes [1]: ').strip() or '1')
+        args.journal = input('Directory for durable game state, empty to keep games in memory only: ').strip()
+        args.metrics_port = int(input('Metrics HTTP port, 0 for none [0]: ').strip() or '0')
+    elif select == 1:
+        args.command = 'client'
+        args.host = input('Server IP: ')
+        args.port = int(input('Port: '))
+        args.size = 3
+        args.win_length = 3
+        args.difficulty = args.encoding = args.updates = None
+        opponent = int(input('Play against the computer(0) or another player(1) [0]: ').strip() or '0')
+        args.opponent = ('computer', 'human')[opponent]
+    return args
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'server' and args.workers > 1 and args.backend != 'threading':
+        # shard workers run the threaded server
+        parser.error('--workers needs the threading backend')
+    from common.logs import setup_logging
+    setup_logging(**log_options(args))
+    if args.command is None:
+        args = ask(args)
+    if args.command == 'server':
+        run_server(args)
+    elif args.command == 'client':
+        run_client(args)
+
+
+if __name__ == '__main__':
+    main()